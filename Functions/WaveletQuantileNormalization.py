@@ -9,7 +9,6 @@
 ''' 
 
 import numpy as np
-import pywt
 from Functions.ecdf import *
 
 #WQN with ecdf
@@ -30,6 +29,8 @@ def WQN(y,index_mask,wavelet_name,mode,min_interval,alpha):
     - post_WQN_signal <-- the cleaned eeg signal corrected thanks to the Wavelet Quantile Normalization algorithms (WQN)   
     '''
 
+    import pywt   # loaded on the first correction
+
     post_WQN_signal=y.copy()                 # copy of the raw signal
     index_mask=[0]+index_mask+[len(y)-1]     # add starting point at 0 and final at the last index of y
 
@@ -94,6 +95,8 @@ def WQN_2(y,index_mask,wavelet_name,mode,min_interval,alpha):
     output :
     - post_WQN_signal <-- the cleaned eeg signal corrected thanks to the Wavelet Quantile Normalization algorithms (WQN)   
     '''
+    import pywt   # loaded on the first correction
+
     post_WQN_signal=y.copy()                 # copy of the raw signal
     index_mask=[0]+index_mask+[len(y)-1]     # add starting point at 0 and final at the last index of y
 
@@ -159,6 +162,8 @@ def WQN_3(y,index_mask,wavelet_name,mode,min_interval,alpha):
     output :
     - post_WQN_signal <-- the cleaned eeg signal corrected thanks to the Wavelet Quantile Normalization algorithms (WQN)   
     '''
+    import pywt   # loaded on the first correction
+
     post_WQN_signal=y.copy()                 # copy of the raw signal
     index_mask=[0]+index_mask+[len(y)-1]     # add starting point at 0 and final at the last index of y
 
@@ -0,0 +1,206 @@
+'''
+Features of sliding windows assembled from statistics of fixed blocks
+
+The signal is cut in blocks of `block` samples (10 s by default). For the
+statistics that are additive (sum of |diff|, number of zero crossings, sum of
+the Welch segment periodograms, counts of a fixed-bin histogram) the sums over
+the blocks are computed once and their cumulative sum gives the sum over any
+window that starts and ends on block boundaries: a window of 30 s, 60 s or
+120 s with a step of 10 s costs a subtraction per window.
+
+A few terms cross the end of a window (the diff between the last sample of the
+window and the next one, the Welch segment that starts half a segment before
+the end) and are removed from the block sums, so the windows are the same as in
+sliding_fct.py: window i covers [i*step, i*step + Ws) for i*step in range(0, N - Ws, step).
+
+Fallback: the median (power of the bands, amplitude of the line length) is not
+additive. It is computed exactly on each window from the samples (vectorized by
+chunks of windows) and cached per (Ws, step), it does not benefit from the blocks.
+'''
+
+import numpy as np
+import scipy as sc
+
+
+class BlockFeatures:
+    '''
+    Inputs:
+    - y      <-- signal
+    - t      <-- time of the samples (array or TimeAxis)
+    - fs     <-- sampling frequency
+    - block  <-- length of a block (samples), Ws and step must be multiples of it
+    '''
+
+    def __init__(self, y, t, fs, block=None):
+        self.y = np.asarray(y)
+        self.t = t
+        self.fs = fs
+        self.N = len(self.y)
+        self.block = int(block or 10 * fs)
+        self.nperseg = 256
+        self.noverlap = self.nperseg // 2
+        self.block_cumsums = {}   # name --> (values of each unit, unit, cumulative sum over the blocks)
+        self.medians = {}         # (name, Ws, step) --> median of each window
+
+    #-------------------------------------------------------------------------------------------#
+    #                                        Windows                                            #
+    #-------------------------------------------------------------------------------------------#
+
+    def starts(self, Ws, step):
+
+        if Ws % self.block or step % self.block:
+            raise ValueError('Ws (%d) and step (%d) must be multiples of the block length (%d)' % (Ws, step, self.block))
+        return np.arange(0, self.N - Ws, step)
+
+    def t_list(self, Ws, step):
+
+        return [self.t[Ws + i * step] for i in range(len(self.starts(Ws, step)))]
+
+    def additive(self, name, values, unit=1):
+        '''
+        registers the values of an additive statistic (one per unit of `unit` samples,
+        unit i covers the samples starting at i*unit) and the cumulative sum of their block sums
+        '''
+        units_per_block = self.block // unit
+        n_blocks = -(-self.N // self.block)
+        padded = np.zeros((n_blocks * units_per_block,) + values.shape[1:])
+        padded[:len(values)] = values
+        block_sums = padded.reshape((n_blocks, units_per_block) + values.shape[1:]).sum(axis=1)
+        cumsum = np.concatenate((np.zeros((1,) + values.shape[1:]), np.cumsum(block_sums, axis=0)))
+        self.block_cumsums[name] = (padded, unit, cumsum)
+
+    def window_sums(self, name, Ws, step, exclude_last=False):
+        '''
+        sum of an additive statistic over each window, exclude_last removes the unit
+        that starts inside the window but ends after it
+        '''
+        starts = self.starts(Ws, step)
+        values, unit, cumsum = self.block_cumsums[name]
+        b0 = starts // self.block
+        sums = cumsum[b0 + Ws // self.block] - cumsum[b0]
+        if exclude_last:
+            sums = sums - values[(starts + Ws) // unit - 1]
+        return sums
+
+    def window_median(self, name, x, Ws, step, chunk=256):
+        '''
+        fallback for the median (not additive): exact median of x on each window, cached
+        '''
+        key = (name, Ws, step)
+        if key not in self.medians:
+            starts = self.starts(Ws, step)
+            x = np.atleast_2d(x)
+            medians = np.zeros((x.shape[0], len(starts)))
+            for c in range(0, len(starts), chunk):
+                index = starts[c:c + chunk, None] + np.arange(Ws)
+                for k in range(x.shape[0]):
+                    medians[k, c:c + chunk] = np.median(x[k][index], axis=1)
+            self.medians[key] = medians
+        return self.medians[key]
+
+    #-------------------------------------------------------------------------------------------#
+    #                                  Block statistics                                         #
+    #-------------------------------------------------------------------------------------------#
+
+    def abs_diff(self):
+
+        if 'abs_diff' not in self.block_cumsums:
+            self.additive('abs_diff', np.abs(np.diff(self.y)))
+
+    def crossings(self):
+
+        if 'crossings' not in self.block_cumsums:
+            self.additive('crossings', (np.diff(np.sign(self.y)) != 0).astype(np.float64))
+
+    def segment_psd(self):
+        '''
+        periodogram of every Welch segment of the signal (hann window of nperseg samples,
+        hop of nperseg // 2, constant detrend, density scaling as scipy.signal.welch)
+        '''
+        if 'segment_psd' in self.block_cumsums:
+            return
+        hop = self.nperseg - self.noverlap
+        if self.block % hop:
+            raise ValueError('the block length must be a multiple of %d' % hop)
+        window = sc.signal.get_window('hann', self.nperseg)
+        segments = np.lib.stride_tricks.sliding_window_view(self.y, self.nperseg)[::hop]
+        psd = np.zeros((len(segments), self.nperseg // 2 + 1))
+        for c in range(0, len(segments), 4096):
+            seg = segments[c:c + 4096]
+            seg = (seg - seg.mean(axis=1, keepdims=True)) * window
+            psd[c:c + 4096] = np.abs(np.fft.rfft(seg, axis=1)) ** 2
+        psd /= self.fs * np.sum(window ** 2)
+        psd[:, 1:-1] *= 2
+        self.additive('segment_psd', psd, unit=hop)
+
+    def histogram(self, edges):
+        '''
+        counts of the samples in the fixed bins `edges` for each block
+        '''
+        name = ('histogram', tuple(edges))
+        if name not in self.block_cumsums:
+            n_bins = len(edges) - 1
+            index = np.clip(np.searchsorted(edges, self.y, side='right') - 1, 0, n_bins - 1)
+            inside = (self.y >= edges[0]) & (self.y <= edges[-1])
+            block_id = np.arange(self.N) // self.block
+            counts = np.bincount(block_id[inside] * n_bins + index[inside], minlength=(block_id[-1] + 1) * n_bins)
+            self.additive(name, counts.reshape(-1, n_bins).astype(np.float64), unit=self.block)
+        return name
+
+    #-------------------------------------------------------------------------------------------#
+    #                                       Features                                            #
+    #-------------------------------------------------------------------------------------------#
+
+    def line_length(self, Ws, step):
+        '''
+        same as sliding_fct.compute_line_length, the sum of |diff| comes from the blocks,
+        the amplitude sqrt(median(y**2)) from the median fallback
+        '''
+        self.abs_diff()
+        res = self.window_sums('abs_diff', Ws, step, exclude_last=True)
+        amp = np.sqrt(self.window_median('y2', self.y ** 2, Ws, step)[0])
+        return self.t_list(Ws, step), res / amp / Ws
+
+    def central_frequency(self, Ws, step):
+        '''
+        same as sliding_fct.compute_central_frequency (zero crossings counted from the blocks)
+        '''
+        self.crossings()
+        n_crossings = self.window_sums('crossings', Ws, step, exclude_last=True)
+        return self.t_list(Ws, step), (n_crossings / 2) / (Ws / self.fs)
+
+    def psd(self, Ws, step):
+        '''
+        Welch PSD of each window (mean of the periodograms of its segments)
+
+        Outputs:
+        - freqs  <-- frequencies of the PSD
+        - psd    <-- (n_windows, n_freqs)
+        '''
+        self.segment_psd()
+        n_segments = (Ws - self.noverlap) // (self.nperseg - self.noverlap)
+        psd = self.window_sums('segment_psd', Ws, step, exclude_last=True) / n_segments
+        return np.fft.rfftfreq(self.nperseg, 1 / self.fs), psd
+
+    def freqs_quantiles(self, Ws, step, quantiles=[0.5, 0.75, 0.85, 0.95]):
+        '''
+        same as sliding_fct.compute_freqs_quantiles with nperseg=None (256)
+        '''
+        freqs, psd = self.psd(Ws, step)
+        cum_power = np.cumsum(psd, axis=1)
+        cum_power /= cum_power[:, -1:]
+        # searchsorted(cum_power, q) of each window
+        index = np.stack([np.sum(cum_power < q, axis=1) for q in quantiles])
+        return self.t_list(Ws, step), freqs[np.minimum(index, len(freqs) - 1)]
+
+    def histograms(self, Ws, step, edges):
+        '''
+        counts of the samples of each window in the fixed bins `edges`, (n_windows, n_bins)
+        '''
+        return self.t_list(Ws, step), self.window_sums(self.histogram(edges), Ws, step)
+
+    def power_nD(self, signals, Ws, step, name='bands'):
+        '''
+        same as sliding_fct.power_nD (median fallback), cached under `name`
+        '''
+        return self.t_list(Ws, step), self.window_median(name, np.asarray(signals) ** 2, Ws, step)
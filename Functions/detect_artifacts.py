@@ -8,14 +8,15 @@ see if sliding mean on abs value of the signal can be good for detection
 '''
 
 import numpy as np
-import pywt         # https://pywavelets.readthedocs.io/en/latest/ref/wavelets.html for list of wavelet family name
+import scipy as sc   # scipy loads scipy.signal on first use
 
 from Functions.ecdf import ecdf
-from scipy import stats
+from Functions.profiling import timed
+from Functions.jit import kernel
 
 
 def is_outlier_zscore(data, threshold=3):
-    z_scores = np.abs(stats.zscore(data))
+    z_scores = np.abs((data - np.mean(data)) / np.std(data))   # scipy.stats.zscore
     return z_scores > threshold
 
 def remove_short_art(signal,pos_art,ws,smoothing_ws):
@@ -53,6 +54,7 @@ def remove_short_art(signal,pos_art,ws,smoothing_ws):
 
     return fit
 
+@timed()
 def find_artifacts(y,
                    Ws,
                    step,
@@ -79,34 +81,24 @@ def find_artifacts(y,
 
     # gathering the slopes, thresholding and creating mask
 
-    ## initialization
-    start_window=0                              # marker of the position of the left window edge for the next computation
-
     # creating the mask    
     threshold_a,threshold_d1=threshold          # receives the thresholds value
-    mask_artifacts=[1 for i in range(N)]        # initialize the mask
     mask_pos=[]                                 # set iteration indexes of where the artefacts start and end. (useful for Clean_EEG.py to avoid an unecessary search index in a list to get positions of 0 in the mask) 
-    
-    while start_window<=N:
-        if start_window+Ws<=N:                           # checking that the marker for next computation + the size of the window is within the length of the signal
 
-            s_a,s_d1=CDF_Slope(y[start_window:start_window+Ws],wavelet_name,level,mode)
-            #med_amp=np.quantile(np.abs(y[start_window:start_window+Ws]),1)
-        
-            if (s_a<threshold_a or s_d1<threshold_d1):# or med_amp>=90) :  # slope lower than threshold_a indicating an artifact EOG or Motion and lower than threshold_d1 indicating an artifact EMG
-                mask_artifacts[start_window:start_window+Ws]=[0 for i in range(Ws)]
-                mask_pos.append([start_window,start_window+Ws]) # in case
-            start_window+=step                           # will go above n in case of equality and stops the cycle
+    # windows within the length of the signal
+    slopes = window_slopes(y,Ws,step,wavelet_name,level,mode)
+    # slope lower than threshold_a indicating an artifact EOG or Motion and lower than threshold_d1 indicating an artifact EMG
+    artifacts = (slopes[:,0]<threshold_a) | (slopes[:,1]<threshold_d1)
+    mask_pos += [[start_window,start_window+Ws] for start_window in range(0,len(slopes)*step,step) if artifacts[start_window//step]]
 
-        elif (start_window<N and start_window+Ws>N):     # still within the signal but next window will have a part in the signal and another outside. si on prend plus de signal (au moin step en iteration de plus) ne pose plus de pblm (voir avec pour le spectro)
-            
-            s_a,s_d1=CDF_Slope(y[start_window:],wavelet_name,level,mode)
+    start_window = len(slopes)*step                 # marker of the position of the left window edge after the last window
+    if start_window<N:                              # still within the signal but next window will have a part in the signal and another outside. si on prend plus de signal (au moin step en iteration de plus) ne pose plus de pblm (voir avec pour le spectro)
+
+        s_a,s_d1=CDF_Slope(y[start_window:],wavelet_name,level,mode)
+
+        if (s_a<threshold_a or s_d1<threshold_d1): # or med_amp>=90):    
+            mask_pos.append([start_window,N-1]) # in case
 
-            if (s_a<threshold_a or s_d1<threshold_d1): # or med_amp>=90):    
-                mask_artifacts[start_window:]=[0 for i in range(N-start_window)]
-                mask_pos.append([start_window,N-1]) # in case
-            start_window+=Ws                             # will be higher than N and this stops the cycle
-    
 
     if len(mask_pos)<1:
         #print('no artifact detected')
@@ -206,6 +198,66 @@ def CDF_Slope(y,wavelet_name,level,mode):
 
     return slope_a,slope_d1 
 
+def window_slopes(y,Ws,step,wavelet_name,level,mode,chunk=4096):
+    '''
+    slopes of CDF_Slope of the windows y[i:i+Ws] within the signal (i = 0, step, ... while i+Ws <= len(y)),
+    the DWD of a chunk of windows at once
+
+    Outputs:
+    - slopes  <-- array (windows, 2) of the slopes of the approximation and first detail coefficients
+    '''
+    import pywt
+    if len(y)<Ws:
+        return np.zeros((0,2))
+    windows=np.lib.stride_tricks.sliding_window_view(y,Ws)[::step]
+    slopes=np.zeros((len(windows),2))
+    for i in range(0,len(windows),chunk):
+        coeffs=pywt.wavedec(windows[i:i+chunk],wavelet_name,mode,level,axis=-1)
+        slopes[i:i+chunk,0]=cdf_slopes(coeffs[0])
+        slopes[i:i+chunk,1]=cdf_slopes(coeffs[len(coeffs)-1])
+
+    return slopes
+
+def cdf_slopes_numpy(coeffs):
+    '''
+    slope of the empirical CDF of the absolute values of each row of coeffs, as in CDF_Slope:
+    (1 - proportion of the minimum) / (maximum - minimum)
+    '''
+    values=np.abs(coeffs)
+    low,high=np.min(values,axis=-1),np.max(values,axis=-1)
+    count=np.count_nonzero(values==low[:,None],axis=-1)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return (1-count/values.shape[-1])/(high-low)
+
+@kernel(cdf_slopes_numpy)
+def cdf_slopes(coeffs):
+    '''
+    slope of the empirical CDF of the absolute values of each row of coeffs, as in CDF_Slope:
+    (1 - proportion of the minimum) / (maximum - minimum)
+    '''
+    rows,n=coeffs.shape
+    slopes=np.zeros(rows)
+    for r in range(rows):
+        low=high=abs(coeffs[r,0])
+        nan=False
+        for i in range(n):
+            value=abs(coeffs[r,i])
+            nan=nan or value!=value
+            if value<low:
+                low=value
+            if value>high:
+                high=value
+        if nan:   # as np.min and np.max
+            slopes[r]=np.nan
+            continue
+        count=0
+        for i in range(n):
+            if abs(coeffs[r,i])==low:
+                count+=1
+        slopes[r]=(1-count/n)/(high-low)
+
+    return slopes
+
 def coeffs_wavelet(y,wavelet_name,level,mode):
     '''
     Inputs:
@@ -219,6 +271,7 @@ def coeffs_wavelet(y,wavelet_name,level,mode):
     - cd1          <-- first detail coefficient array
     '''
 
+    import pywt   # https://pywavelets.readthedocs.io/en/latest/ref/wavelets.html for list of wavelet family name
     coeffs=pywt.wavedec(y,wavelet_name,mode,level) # discrete wavelet decomposition from the pywt library, it returns the coefficients 
     ca=coeffs[0]                                   # such as the approximation one is the first of the list and the first detail one the last
     cd1=coeffs[len(coeffs)-1]                 
@@ -1,21 +1,63 @@
 import numpy as np
-from scipy.signal import butter, sosfiltfilt
+from functools import lru_cache
+import scipy as sc   # scipy loads scipy.signal on first use
+from Functions.profiling import timed
 
-def get_filtered_signal(y,fs,list_freq_int):
+def work_dtype(y):
+    '''
+    precision of the computations on y: float32 signals stay in float32, anything else is computed in float64
+    '''
+    return np.dtype(np.float32) if np.asarray(y).dtype == np.float32 else np.dtype(np.float64)
 
-    N=y.size
+@timed()
+def get_filtered_signal(y,fs,list_freq_int):
+    '''
+    y can be 1D or (channels, N): the output is (bands, N) or (bands, channels, N),
+    all the channels are filtered at once along the last axis
+    '''
     N_freq_int=len(list_freq_int)
-    filtered_signals=np.zeros(shape=(N_freq_int,N))
+    filtered_signals=np.zeros(shape=(N_freq_int,)+np.shape(y),dtype=work_dtype(y))
     for k in range(N_freq_int):
         filtered_signals[k,:]=filter_butterworth(y,fs,list_freq_int[k])
     return filtered_signals
 
+@lru_cache(maxsize=None)
+def design_butterworth(fs,low_f,high_f,order,dtype=np.dtype(np.float64)):
+    '''
+    second-order sections of the band-pass filter, designed once per (fs, band, order, dtype)
+    (the sliding functions filter every window with the same few filters)
+    '''
+    nyq = 0.5 * fs
+    low = low_f / nyq
+    high = high_f / nyq
+    sos = sc.signal.butter(order, [low, high], btype='band', output='sos')
+    return sos.astype(dtype)
+
+def sosfiltfilt_float32(sos, y):
+    '''
+    scipy.signal.sosfiltfilt (odd padding of 3 * ntaps samples) on the last axis with the states
+    in float32, so that the whole filter runs in float32 (scipy computes its initial states in float64)
+    '''
+    n_sections = sos.shape[0]
+    ntaps = 2 * n_sections + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    edge = 3 * ntaps
+    if y.shape[-1] <= edge:
+        raise ValueError('the signal must be longer than %d samples' % edge)
+    # odd extension of the signal at both ends
+    ext = np.concatenate((2 * y[..., :1] - y[..., edge:0:-1], y, 2 * y[..., -1:] - y[..., -2:-(edge + 2):-1]), axis=-1)
+    zi = sc.signal.sosfilt_zi(sos).astype(np.float32).reshape((n_sections,) + (1,) * (y.ndim - 1) + (2,))
+    filtered, _ = sc.signal.sosfilt(sos, ext, zi=zi * ext[..., :1])
+    filtered, _ = sc.signal.sosfilt(sos, filtered[..., ::-1], zi=zi * filtered[..., -1:])
+    return filtered[..., ::-1][..., edge:-edge]
+
+@timed()
 def filter_butterworth(y,fs,f_int,order=4):
 
-    nyq = 0.5 * fs
-    low = f_int[0] / nyq
-    high = f_int[-1] / nyq
-    sos = butter(order, [low, high], btype='band', output='sos')
-    filtered_signal = sosfiltfilt(sos, y)
+    dtype = work_dtype(y)
+    sos = design_butterworth(fs,f_int[0],f_int[-1],order,dtype)
+    if dtype == np.float32:
+        filtered_signal = sosfiltfilt_float32(sos, y)
+    else:
+        filtered_signal = sc.signal.sosfiltfilt(sos, y)
 
     return filtered_signal
@@ -0,0 +1,114 @@
+'''
+Optional Numba compilation of the loops that NumPy does not vectorize
+
+A kernel is written twice with the same outputs: as plain loops (compiled with
+numba.njit on its first call when Numba is installed) and as NumPy code (used
+when Numba is not installed). Numba is not a dependency of the project and is
+only imported on the first call of a kernel, not with Functions.
+
+The backend is the same for all the kernels:
+- 'numba' when Numba is installed, 'numpy' otherwise
+- the environment variable EEG_JIT=numpy (or set_backend('numpy')) forces NumPy
+- backend() returns the backend in use, use_backend(name) changes it in a block
+
+The kernels are registered in KERNELS (name --> Kernel), see the jit.*
+benchmarks of benchmarks/suite.py for their times with both backends.
+
+    python -m Functions.jit      # backend in use and kernels
+'''
+
+import contextlib
+import importlib.util
+import os
+
+BACKENDS = ['numba', 'numpy']
+
+# name --> Kernel
+KERNELS = {}
+
+_backend = None
+
+
+def numba_available():
+
+    return importlib.util.find_spec('numba') is not None
+
+
+def backend():
+    '''
+    backend of the kernels: EEG_JIT ('numba' by default) when available, 'numpy' otherwise
+    '''
+    global _backend
+    if _backend is None:
+        requested = os.environ.get('EEG_JIT', 'numba')
+        _backend = 'numba' if requested == 'numba' and numba_available() else 'numpy'
+    return _backend
+
+
+def set_backend(name):
+
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError('backend %r is not one of %s' % (name, BACKENDS))
+    if name == 'numba' and not numba_available():
+        raise ImportError('the numba backend needs Numba (pip install numba)')
+    _backend = name
+
+
+@contextlib.contextmanager
+def use_backend(name):
+
+    previous = backend()
+    set_backend(name)
+    try:
+        yield
+    finally:
+        set_backend(previous)
+
+
+class Kernel:
+    '''
+    loop version of a kernel (compiled on its first call with the numba backend) and its NumPy version
+    '''
+
+    def __init__(self, loops, numpy_version):
+        self.loops = loops
+        self.numpy = numpy_version
+        self.compiled = None
+        self.__name__ = loops.__name__
+        self.__doc__ = loops.__doc__
+
+    def compile(self):
+
+        if self.compiled is None:
+            import numba
+            # error_model='numpy': a division by 0 gives inf or nan as in NumPy
+            self.compiled = numba.njit(cache=True, error_model='numpy')(self.loops)
+        return self.compiled
+
+    def __call__(self, *args):
+        if backend() == 'numba':
+            return self.compile()(*args)
+        return self.numpy(*args)
+
+
+def kernel(numpy_version):
+    '''
+    decorator of the loop version of a kernel, numpy_version(*args) gives the same outputs
+    '''
+    def decorator(loops):
+        KERNELS[loops.__name__] = Kernel(loops, numpy_version)
+        return KERNELS[loops.__name__]
+    return decorator
+
+
+if __name__ == '__main__':
+    #--- modules of the kernels (registered in Functions.jit, not in this __main__ module)
+    import Functions.detect_artifacts, Functions.sliding_fct, Functions.time_frequency, Functions.utils
+    import state_annotation.features
+    import Functions.jit as jit
+
+    version = importlib.import_module('numba').__version__ if numba_available() else 'not installed'
+    print('backend: %s (numba %s, EEG_JIT=%s)' % (jit.backend(), version, os.environ.get('EEG_JIT', '')))
+    for name, fct in jit.KERNELS.items():
+        print('  %-28s %s' % (name, fct.numpy.__module__))
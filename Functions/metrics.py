@@ -1,48 +1,46 @@
 import numpy as np
-from scipy.signal import welch
+import scipy as sc
 
 #-------------------------------------------------------------------------------------------#
 #                                      Regularity                                           #
 #-------------------------------------------------------------------------------------------#
 
 def line_length(y):
+    '''
+    y can be 1D or (channels, N), the line length is computed on the last axis
+    '''
+    res = np.sum(np.abs(np.diff(y, axis=-1)), axis=-1)
+    amp = np.sqrt(np.median(y **2, axis=-1))
 
-    res = np.sum(np.abs(np.diff(y)))
-    amp = np.sqrt(np.median(y **2))
-
-    return res/amp/ len(y)
+    return res/amp/ y.shape[-1]
 
 def freqs_quantiles(signal, sampling_rate, quantiles, nperseg):
     """
     Compute frequencies associated to multiple quantiles of cumulative power of the PSD.
 
     Parameters:
-        signal (1D array): Input signal.
+        signal (1D array or (channels, N) array): Input signal.
         sampling_rate (float): Sampling frequency in Hz.
         quantiles (list of float): Quantiles (e.g., [0.25, 0.5, 0.75, 0.9]).
         nperseg (int or None): Segment length for Welch method.
 
     Returns:
-        quantiles_freqs (dict): Mapping from quantile to frequency in Hz.
+        quantiles_freqs (array): Frequency (Hz) of each quantile (last axis, after the channels).
     """
 
-    freqs, psd = welch(signal, fs=sampling_rate, nperseg=nperseg)
-    cum_power = np.cumsum(psd)
-    cum_power /= cum_power[-1]  # normalize to [0, 1]
+    freqs, psd = sc.signal.welch(signal, fs=sampling_rate, nperseg=nperseg)
+    cum_power = np.cumsum(psd, axis=-1)
+    cum_power /= cum_power[..., -1:]  # normalize to [0, 1]
 
-    N_quantiles = len(quantiles)
-    quantiles_freqs = np.zeros(N_quantiles)
-    for i in range(N_quantiles):
-        idx = np.searchsorted(cum_power, quantiles[i])
-        quantile_freq = freqs[idx] if idx < len(freqs) else freqs[-1]
-        quantiles_freqs[i] = quantile_freq
+    # index of the first cumulative power >= quantile (np.searchsorted, left) for every channel at once
+    idx = np.sum(cum_power[..., None, :] < np.asarray(quantiles)[:, None], axis=-1)
+    quantiles_freqs = freqs[np.minimum(idx, len(freqs) - 1)]
 
     return quantiles_freqs
 
 def frequency_zcr(signal, sampling_rate):
-    zero_crossings = np.where(np.diff(np.sign(signal)))[0]
-    num_crossings = len(zero_crossings)
-    duration = len(signal) / sampling_rate
+    num_crossings = np.count_nonzero(np.diff(np.sign(signal), axis=-1), axis=-1)
+    duration = signal.shape[-1] / sampling_rate
     return (num_crossings / 2) / duration
 
 
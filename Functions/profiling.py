@@ -0,0 +1,194 @@
+'''
+Instrumentation of the computations: time (and optionally peak memory) per stage
+
+The stages are marked with the decorator `timed` (functions) or the context
+manager `stage` (blocks of code). They are recorded only inside `profile()`:
+outside, a stage costs one test of a global, so the instrumentation can stay in
+the hot paths.
+
+The stages are nested: a stage is recorded under the path of the stages that
+contain it (e.g. 'get_supp_ratio/detect_suppressions_power/get_mask_ground_check'),
+with its number of calls, its total time and its self time (without the nested
+stages). With memory=True the peak of the memory allocated in the stage
+(tracemalloc, above the memory at its start) is also recorded: tracemalloc slows
+the computations down, the times are then only indicative.
+
+    with profile(memory=True) as profiler:
+        C.run()
+    report = profiler.report()
+'''
+
+import functools
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_profiler = None   # Profiler recording the stages, None when disabled
+
+
+class Profiler:
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}                 # path --> [calls, time, self time, peak]
+        self.local = threading.local()   # stack of the open stages of each thread
+        self.lock = threading.Lock()
+        self.t_start = time.perf_counter()
+        self.elapsed = None
+
+    def enter(self, name):
+
+        stack = self.local.__dict__.setdefault('stack', [])
+        # frame: path, start time, time of the nested stages, memory at the start, peak
+        frame = [(stack[-1][0] + '/' if stack else '') + name, 0., 0., 0, 0]
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][4] = max(stack[-1][4], peak)
+            tracemalloc.reset_peak()
+            frame[3] = frame[4] = current
+        stack.append(frame)
+        frame[1] = time.perf_counter()
+
+    def exit(self):
+
+        t_end = time.perf_counter()
+        stack = self.local.stack
+        path, t_start, t_nested, memory_start, peak = stack.pop()
+        elapsed = t_end - t_start
+        if self.memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1][4] = max(stack[-1][4], peak)
+        if stack:
+            stack[-1][2] += elapsed
+        with self.lock:
+            record = self.stages.setdefault(path, [0, 0., 0., 0])
+            record[0] += 1
+            record[1] += elapsed
+            record[2] += elapsed - t_nested
+            record[3] = max(record[3], peak - memory_start)
+
+    def report(self):
+        '''
+        Output:
+        - dictionnary with the total time, the stages (path --> calls, time, self_time[, peak] in s and bytes)
+          in the order of their first call and the stages summed by name whatever their path
+        '''
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.t_start
+        stages, by_name = {}, {}
+        for path, (calls, total, own, peak) in self.stages.items():
+            stages[path] = {'calls': calls, 'time': total, 'self_time': own}
+            parents, _, name = path.rpartition('/')
+            entry = by_name.setdefault(name, {'calls': 0, 'time': 0., 'self_time': 0.})
+            entry['calls'] += calls
+            entry['self_time'] += own
+            # time of the outermost calls only (a recursive stage is not counted twice)
+            if name not in parents.split('/'):
+                entry['time'] += total
+            if self.memory:
+                stages[path]['peak'] = peak
+                entry['peak'] = max(entry.get('peak', 0), peak)
+        return {'time': elapsed, 'memory': self.memory, 'stages': stages, 'by_name': by_name}
+
+
+@contextmanager
+def profile(memory=False):
+    '''
+    records the stages run inside the block (in every thread) in the Profiler it yields
+    '''
+    global _profiler
+    if _profiler is not None:
+        raise RuntimeError('a profile is already running')
+    profiler = Profiler(memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _profiler = None
+        profiler.elapsed = time.perf_counter() - profiler.t_start
+        if started:
+            tracemalloc.stop()
+
+
+class _Stage:
+
+    __slots__ = ('name', 'profiler')
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = None
+
+    def __enter__(self):
+        self.profiler = _profiler
+        if self.profiler is not None:
+            self.profiler.enter(self.name)
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.exit()
+        return False
+
+
+class _Disabled:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+_DISABLED = _Disabled()
+
+
+def stage(name):
+    '''
+    context manager marking a stage of the computations
+    '''
+    return _DISABLED if _profiler is None else _Stage(name)
+
+
+def timed(name=None):
+    '''
+    decorator marking a function as a stage (named after the function by default)
+    '''
+    def decorator(fct):
+        stage_name = name or fct.__name__
+
+        @functools.wraps(fct)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return fct(*args, **kwargs)
+            profiler.enter(stage_name)
+            try:
+                return fct(*args, **kwargs)
+            finally:
+                profiler.exit()
+        return wrapper
+    return decorator
+
+
+def merge_reports(reports):
+    '''
+    corpus summary of several reports: times and calls summed, peaks maximal, share of the total time
+    '''
+    total = sum(report['time'] for report in reports)
+    summary = {'recordings': len(reports), 'time': total, 'stages': {}, 'by_name': {}}
+    for report in reports:
+        for key in ('stages', 'by_name'):
+            for name, values in report[key].items():
+                entry = summary[key].setdefault(name, {'calls': 0, 'time': 0., 'self_time': 0.})
+                entry['calls'] += values['calls']
+                entry['time'] += values['time']
+                entry['self_time'] += values['self_time']
+                if 'peak' in values:
+                    entry['peak'] = max(entry.get('peak', 0), values['peak'])
+    for key in ('stages', 'by_name'):
+        for entry in summary[key].values():
+            entry['share'] = entry['time'] / total if total else 0.
+    return summary
@@ -1,11 +1,15 @@
 '''
 Functions computed on sliding windows with a specific window size and step in between two consecutive windows
+
+The signal can be 1D or (channels, N): the windows are taken on the last axis and
+each window is computed for all the channels at once, the outputs get an axis of
+channels before the axis of the windows.
 '''
 import numpy as np
 from Functions.suppressions import detect_suppressions_power
-from scipy.stats import entropy
-from collections import Counter
 from Functions.metrics import line_length, freqs_quantiles, frequency_zcr
+from Functions.profiling import timed
+from Functions.jit import kernel
 
 
 #-------------------------------------------------------------------------------------------#
@@ -26,17 +30,18 @@ def power_1D(signal,t,Ws,step):
 
     return t_list,mean_power_list
 
+@timed()
 def power_nD(signals,t,Ws,step):
     '''
     Input:
-    signals: nD numpy array
+    signals: nD numpy array (bands, N) or (bands, channels, N)
     Output:
-    mean_power_list: numpy array of same number of line as signals
+    mean_power_list: numpy array of same shape as signals with the windows on the last axis
     '''
     # create a list of all the sliding windows
-    windows=[signals[:,i:i+Ws]**2 for i in range(0,np.shape(signals)[1]-Ws,step)]
-    # compute the mean power in each window for axis 1
-    mean_power_list=np.transpose([np.median(win,axis=1) for win in windows])
+    windows=[signals[...,i:i+Ws]**2 for i in range(0,np.shape(signals)[-1]-Ws,step)]
+    # compute the mean power in each window for the last axis
+    mean_power_list=np.moveaxis(np.array([np.median(win,axis=-1) for win in windows]),0,-1)
     # associated time list (time bin is for th end of a window)
     t_list=[t[Ws+i*step] for i in range(len(windows))]
 
@@ -60,9 +65,10 @@ def supp_power(y,Ws,step,fs,T_IES_max,T_alpha_max):
 
     return pos_IES, pos_alpha_supp
 
+@timed()
 def supp_power_prop(y,t,Ws,step,fs):
 
-    windows=[y[i:i+Ws] for i in range(0,len(y)-Ws,step)]
+    windows=[y[...,i:i+Ws] for i in range(0,np.shape(y)[-1]-Ws,step)]
     IES_prop, alpha_supp_prop = [], []
     for i in range(len(windows)):
         IES, alpha_supp = detect_suppressions_power(windows[i],fs)[-2:]
@@ -71,52 +77,110 @@ def supp_power_prop(y,t,Ws,step,fs):
 
     t_list=[t[Ws+i*step] for i in range(len(windows))] 
 
-    return t_list, np.array(IES_prop), np.array(alpha_supp_prop)
+    return t_list, np.transpose(IES_prop), np.transpose(alpha_supp_prop)
 
 
 #-------------------------------------------------------------------------------------------#
 #                                      Entropy                                              #
 #-------------------------------------------------------------------------------------------#
 
+def bin_index(x, edges):
+    '''
+    index i of the bin edges[..., i] <= x < edges[..., i + 1] of each value (as np.searchsorted(edges, x, 'right') - 1)
+    for uniform edges, one row of edges per row of x (last axis)
+    '''
+    n_bins = edges.shape[-1] - 1
+    first, last = edges[..., :1], edges[..., -1:]
+    index = np.clip(((x - first) / (last - first) * n_bins).astype(np.intp), 0, n_bins)
+    # correction of the rounding (as np.histogram)
+    edges = np.concatenate((edges, np.full(edges.shape[:-1] + (1,), np.inf)), axis=-1)
+    index -= x < np.take_along_axis(edges, index, axis=-1)
+    index += x >= np.take_along_axis(edges, index + 1, axis=-1)
+    return index
+
+def bin_edges(x, n_bins):
+    '''
+    np.histogram_bin_edges(x, bins=n_bins) of each row of x (last axis)
+    '''
+    first, last = np.min(x, axis=-1), np.max(x, axis=-1)
+    flat = first == last
+    first, last = np.where(flat, first - 0.5, first), np.where(flat, last + 0.5, last)
+    return np.linspace(first, last, n_bins + 1, axis=-1)
+
+def count_rows(index, n):
+    '''
+    counts of the values 0 ... n - 1 of each row of index (last axis)
+    '''
+    rows = np.arange(index.size // index.shape[-1]).reshape(index.shape[:-1] + (1,))
+    return np.bincount((rows * n + index).ravel(), minlength=rows.size * n).reshape(index.shape[:-1] + (n,))
+
+def kgram_counts_numpy(quantized, k, n_values):
+    '''
+    counts of the k-grams (codes 0 ... n_values ** k - 1) of each row of quantized (rows, n)
+    '''
+    kgrams = np.zeros((quantized.shape[0], quantized.shape[-1] - k + 1), dtype=np.intp)
+    for j in range(k):
+        kgrams = kgrams * n_values + quantized[:, j:quantized.shape[-1] - k + 1 + j]
+    return count_rows(kgrams, n_values ** k)
+
+@kernel(kgram_counts_numpy)
+def kgram_counts(quantized, k, n_values):
+    '''
+    counts of the k-grams (codes 0 ... n_values ** k - 1) of each row of quantized (rows, n)
+    '''
+    rows, n = quantized.shape
+    counts = np.zeros((rows, n_values ** k), dtype=np.intp)
+    for r in range(rows):
+        for i in range(n - k + 1):
+            code = 0
+            for j in range(k):
+                code = code * n_values + quantized[r, i + j]
+            counts[r, code] += 1
+    return counts
+
+def entropy_counts(counts):
+    '''
+    Shannon entropy (bits) of the distributions of counts (last axis)
+    '''
+    probs = counts / np.sum(counts, axis=-1, keepdims=True)
+    return -np.sum(probs * np.log2(np.where(probs > 0, probs, 1)), axis=-1)
+
 def compute_entropy(signal, t, window_size, step, n_bins=10, normalize=True):
     entropies = []
-    for i in range(0, len(signal) - window_size + 1, step):
-        window = signal[i:i+window_size]
+    for i in range(0, np.shape(signal)[-1] - window_size + 1, step):
+        window = signal[..., i:i+window_size]
         if normalize:
-            window = (window - np.mean(window)) / np.std(window)  # z-score
-        # Discretize
-        hist, _ = np.histogram(window, bins=n_bins, density=True)
-        hist = hist[hist > 0]  # remove 0 entries
-        ent = entropy(hist, base=2)
+            window = (window - np.mean(window, axis=-1, keepdims=True)) / np.std(window, axis=-1, keepdims=True)  # z-score
+        # Discretize (histogram of each channel, the last edge is included in the last bin)
+        index = np.minimum(bin_index(window, bin_edges(window, n_bins)), n_bins - 1)
+        ent = entropy_counts(count_rows(index, n_bins))
         entropies.append(ent)
 
     t_list=[t[window_size+i*step] for i in range(len(entropies))]
 
-    return t_list, np.array(entropies)
+    return t_list, np.transpose(entropies)
 
 def compute_block_entropy_k(signal, t, window_size, step, k=2, n_bins=10, normalize=True):
     entropies = []
-    for i in range(0, len(signal) - window_size + 1, step):
-        window = signal[i:i+window_size]
+    for i in range(0, np.shape(signal)[-1] - window_size + 1, step):
+        window = signal[..., i:i+window_size]
         if normalize:
-            window = (window - np.mean(window)) / (np.std(window) + 1e-8)
+            window = (window - np.mean(window, axis=-1, keepdims=True)) / (np.std(window, axis=-1, keepdims=True) + 1e-8)
         
-        # Discretize
-        quantized = np.digitize(window, np.histogram_bin_edges(window, bins=n_bins))
+        # Discretize (as np.digitize, values 0 ... n_bins + 1)
+        quantized = bin_index(window, bin_edges(window, n_bins)) + 1
         
-        # Create k-grams
-        kgrams = [tuple(quantized[j:j+k]) for j in range(len(quantized) - k + 1)]
-        freqs = Counter(kgrams)
-        total = sum(freqs.values())
-        probs = np.array([count / total for count in freqs.values()])
+        # Count the k-grams (one code per k-gram) of each channel
+        n_values = n_bins + 2
+        counts = kgram_counts(quantized.reshape(-1, quantized.shape[-1]), k, n_values)
         
         # Shannon entropy of the k-grams
-        ent = -np.sum(probs * np.log2(probs))
+        ent = entropy_counts(counts.reshape(quantized.shape[:-1] + (-1,)))
         entropies.append(ent)
 
     t_list=[t[window_size+i*step] for i in range(len(entropies))]
     
-    return t_list, np.array(entropies)
+    return t_list, np.transpose(entropies)
 
 #-------------------------------------------------------------------------------------------#
 #                                      Regularity                                           #
@@ -124,9 +188,9 @@ def compute_block_entropy_k(signal, t, window_size, step, k=2, n_bins=10, normal
 
 def compute_line_length(signal, t, Ws, step):
     # create a list of all the sliding windows
-    windows=[signal[i:i+Ws] for i in range(0,len(signal)-Ws,step)]
+    windows=[signal[...,i:i+Ws] for i in range(0,np.shape(signal)[-1]-Ws,step)]
     # compute the line length in each window
-    line_length_list=np.array([line_length(win) for win in windows])
+    line_length_list=np.transpose([line_length(win) for win in windows])
     # associated time list (time bin is for the end of a window)
     t_list=[t[Ws+i*step] for i in range(len(windows))]
 
@@ -139,7 +203,7 @@ def compute_line_length(signal, t, Ws, step):
 
 def compute_freqs_quantiles(signal, t, Ws, step, sampling_rate, quantiles=[0.5, 0.75, 0.85, 0.95], nperseg=None):
     # create a list of all the sliding windows
-    windows=[signal[i:i+Ws] for i in range(0,len(signal)-Ws,step)]
+    windows=[signal[...,i:i+Ws] for i in range(0,np.shape(signal)[-1]-Ws,step)]
     # compute the line length in each window
     freqs_list=np.array([freqs_quantiles(win, sampling_rate, quantiles, nperseg) for win in windows])
     # associated time list (time bin is for the end of a window)
@@ -153,9 +217,9 @@ def compute_freqs_quantiles(signal, t, Ws, step, sampling_rate, quantiles=[0.5,
 #-------------------------------------------------------------------------------------------#
 def compute_central_frequency(signal, t, fs, Ws, step):
     # create a list of all the sliding windows
-    windows=[signal[i : i + Ws] for i in range(0, len(signal) - Ws, step)]
+    windows=[signal[..., i : i + Ws] for i in range(0, np.shape(signal)[-1] - Ws, step)]
     # compute the line length in each window
-    central_f_list = np.array([frequency_zcr(win, fs) for win in windows])
+    central_f_list = np.transpose([frequency_zcr(win, fs) for win in windows])
     # associated time list (time bin is for the end of a window)
     t_list=[t[Ws + i * step] for i in range(len(windows))]
 
@@ -1,8 +1,10 @@
 import numpy as np
 import scipy as sc
-from Functions.filter import filter_butterworth
+from Functions.filter import filter_butterworth, work_dtype
 from Functions.utils import detect_pos_1, diff_envelops, envelope_maxima
+from Functions.profiling import timed, stage
 
+@timed()
 def erosion_dilation(mask,min_band,max_gap,fs):
     '''
     Function that return a mask after erosion/dilatation/erosion
@@ -20,115 +22,162 @@ def erosion_dilation(mask,min_band,max_gap,fs):
     min_band = int(fs*min_band) 
     max_gap = int(fs*max_gap) - 1   # minus 1 to have the correct effect on erosion (erosion with int 3 for instance takes away 2 by construction of the function)
 
-    # routine to erode, dilate and erode the mask
-    new_mask = sc.ndimage.binary_erosion(mask,np.ones(min_band),iterations=1)
-    new_mask = sc.ndimage.binary_dilation(new_mask,np.ones(min_band+max_gap),iterations=1)
-    new_mask = sc.ndimage.binary_erosion(new_mask,np.ones(max_gap),iterations=1)
+    # routine to erode, dilate and erode the mask (along the last axis, each channel of a (channels, N) mask separately)
+    new_mask = binary_erosion(mask,min_band)
+    new_mask = binary_dilation(new_mask,min_band+max_gap)
+    new_mask = binary_erosion(new_mask,max_gap)
 
     return new_mask
 
+def count_ones(mask, L, shift):
+    '''
+    number of 1 in mask[..., i - shift:i - shift + L] for each position i of the last axis (0 outside of the mask)
+    Outputs:
+    - counts
+    - True where the interval is inside the mask
+    '''
+    N = mask.shape[-1]
+    cumsum = np.concatenate((np.zeros(mask.shape[:-1] + (1,), dtype=np.intp), np.cumsum(mask != 0, axis=-1, dtype=np.intp)), axis=-1)
+    start = np.arange(N) - shift
+    counts = cumsum[..., np.clip(start + L, 0, N)] - cumsum[..., np.clip(start, 0, N)]
+    return counts, (start >= 0) & (start + L <= N)
+
+def binary_erosion(mask, L):
+    '''
+    same as sc.ndimage.binary_erosion(mask, np.ones(L)) on the last axis, from cumulative sums (cost independent of L)
+    '''
+    counts, inside = count_ones(mask, L, L // 2)
+    return (counts == L) & inside
+
+def binary_dilation(mask, L):
+    '''
+    same as sc.ndimage.binary_dilation(mask, np.ones(L)) on the last axis (the structure is reflected)
+    '''
+    return count_ones(mask, L, L - 1 - L // 2)[0] > 0
+
+def smooth(y, h):
+    '''
+    np.convolve(y, h, mode='same') on the last axis of y (1D or (channels, N))
+    '''
+    if np.ndim(y) == 1:
+        return np.convolve(y, h, mode='same')
+    return np.array([np.convolve(row, h, mode='same') for row in y])
+
+def quantile_below(y, T, q):
+    '''
+    quantile q of the values of y lower than T on the last axis, of all the values when none is lower
+    Outputs:
+    - quantile of each channel
+    - True for the channels where some values are lower than T
+    '''
+    below = y < T
+    rows, masks = np.reshape(y, (-1, np.shape(y)[-1])), np.reshape(below, (-1, np.shape(y)[-1]))
+    quantiles = [np.quantile(row[mask] if mask.any() else row, q) for row, mask in zip(rows, masks)]
+    return np.reshape(quantiles, np.shape(y)[:-1]), below.any(axis=-1)
+
+@timed()
 def detect_suppressions_power(y, fs, T_IES_max = 12, T_alpha_max=5):
     ''''
     Function to detect the alpha-suppressions and IES
+
+    y can be 1D or (channels, N): the channels are filtered and smoothed at once and
+    the thresholds are set per channel (the outputs get a first axis of channels)
+
+    float32 signals are computed in float32, the masks are returned as uint8 (0 or 1)
     '''
     
+    dtype = work_dtype(y)
     N_points = int(fs/4)
-    h = np.ones(N_points) / N_points #  0.25 s 
+    h = np.ones(N_points, dtype=dtype) / N_points #  0.25 s 
 
-    # smoothed power of signal between [1.5,30]] Hz
-    y2 = np.convolve(filter_butterworth(y,fs,[1.5,30])**2,h,mode='same')
-    N = len(y2)
+    with stage('band_powers'):
+        # smoothed power of signal between [1.5,30]] Hz
+        y2 = smooth(filter_butterworth(y,fs,[1.5,30])**2,h)
+        N = y2.shape[-1]
     
-    # smoothed power of signal between [7,14]] Hz
-    y2_alpha = np.convolve(filter_butterworth(y,fs,[7,14])**2,h,mode='same')
+        # smoothed power of signal between [7,14]] Hz
+        y2_alpha = smooth(filter_butterworth(y,fs,[7,14])**2,h)
 
-    # smoothed power of signal between [15,20] Hz
-    y2_beta = np.convolve(filter_butterworth(y,fs,[15,20])**2,h,mode='same')
+        # smoothed power of signal between [15,20] Hz
+        y2_beta = smooth(filter_butterworth(y,fs,[15,20])**2,h)
 
-    # smoothed power of signal between [30,45]] Hz
-    y2_gamma = np.convolve(filter_butterworth(y,fs,[40,45])**2,h,mode='same')
+        # smoothed power of signal between [30,45]] Hz
+        y2_gamma = smooth(filter_butterworth(y,fs,[40,45])**2,h)
 
-    #--- IES threshold
-    # find if zone is ok or mostly suppression
-    q = np.quantile(y2,0.75)
+    with stage('thresholds'):
+        #--- IES threshold
+        # find if zone is ok or mostly suppression
+        q = np.quantile(y2,0.75,axis=-1)
     
-    if q <= 8: # condition indicating it is mostly suppresions
-        T_IES = min(10,q*3)
+        # if q <= 8: condition indicating it is mostly suppresions
+        # else: take only values that are lower than very high values from high power region and artefact, ground checks
+        # (all the values when there are none), what happens if power in Burst is same as high values signal ?
+        T_IES = np.where(q <= 8, np.minimum(10,q*3), np.minimum(quantile_below(y2,T_IES_max*12,0.9)[0]*0.12,T_IES_max))
 
-    else:
-        # take only values that are lower than very high values from high power region and artefact, ground checks
-        # what happens if power in Burst is same as high values signal ?
-        try:
-            indices=np.where(y2<T_IES_max*12)[0]
-            T_IES=np.quantile(y2[indices],0.9)*0.12
-        except: # indices is empty
-            T_IES=np.quantile(y2,0.9)*0.12
-
-        # Threshold for IES
-        T_IES = min(T_IES,T_IES_max)
-
-    # if T_IES<=8: # can be if just a burst or artefact that make the quantile 75 high and 0.12*quantile(0.9) low #8
-    #     print('T_IES', T_IES)
-    #     T_IES = 8
-
-    #--- alpha-suppressions threshold
-    try:
-        indices=np.where(y2_alpha<T_alpha_max*15)[0]
-        T_alpha=np.quantile(y2_alpha[indices],0.9)*0.15
-    except: # indices is empty
-        T_alpha=np.quantile(y2_alpha,0.9)*0.15
-
-        # threshold for alpha supp
-        T_alpha = min(T_alpha, T_IES_max)
-
-    # if T_alpha<=1: # can be if just a burst or artefact that make the quantile 75 high and 0.12*quantile(0.9) low #8
-    #     print('T_alpha', T_alpha)
-    #     T_IES = 1
-
-    #--- beta threshold
-    T_beta = T_alpha * 0.75
-
-    #--- get shallow signals mask
-    r_gamma_delta = np.convolve(filter_butterworth(y,fs,[30,45])**2,h,mode='same') / np.convolve(filter_butterworth(y,fs,[1,4])**2,np.ones(fs)/fs,mode='same')
-    P_y = np.convolve(filter_butterworth(y,fs,[0.1,45])**2,h,mode='same')
-    mask_shallow_signal = np.zeros(N)
-    mask_shallow_signal[np.where((r_gamma_delta >= 0.05) & (P_y <= 100))[0]] = 1
-    mask_shallow_signal = erosion_dilation(mask_shallow_signal,0.5,0.5,fs)*1
+        # if T_IES<=8: # can be if just a burst or artefact that make the quantile 75 high and 0.12*quantile(0.9) low #8
+        #     print('T_IES', T_IES)
+        #     T_IES = 8
+
+        #--- alpha-suppressions threshold
+        q_alpha, found = quantile_below(y2_alpha,T_alpha_max*15,0.9)
+        # threshold for alpha supp (bounded only when all the values are used)
+        T_alpha = np.where(found, q_alpha*0.15, np.minimum(q_alpha*0.15, T_IES_max))
+
+        # if T_alpha<=1: # can be if just a burst or artefact that make the quantile 75 high and 0.12*quantile(0.9) low #8
+        #     print('T_alpha', T_alpha)
+        #     T_IES = 1
+
+        #--- beta threshold
+        T_beta = T_alpha * 0.75
+
+        # thresholds of each channel against the last axis
+        T_IES, T_alpha, T_beta = T_IES[..., None], T_alpha[..., None], T_beta[..., None]
+
+    with stage('shallow_signal'):
+        #--- get shallow signals mask
+        r_gamma_delta = smooth(filter_butterworth(y,fs,[30,45])**2,h) / smooth(filter_butterworth(y,fs,[1,4])**2,np.ones(fs,dtype=dtype)/fs)
+        P_y = smooth(filter_butterworth(y,fs,[0.1,45])**2,h)
+        mask_shallow_signal = (r_gamma_delta >= 0.05) & (P_y <= 100)
+        mask_shallow_signal = erosion_dilation(mask_shallow_signal,0.5,0.5,fs)
 
     #--- ground check mask
     mask_ground_check = get_mask_ground_check(y,fs)
 
-    #--- mask of suppressions
-    Om_alpha = np.where((y2_alpha < T_alpha) & (y2_beta < T_beta) & (mask_shallow_signal != 1) & (y2_gamma < 0.25) & (mask_ground_check != 1))[0]    # list of indices where the condition is satisfied for alpha-suppressions
-    mask_alpha = np.zeros(N)
-    mask_alpha[Om_alpha] = 1           #  set 1 where there is an alpha suppression, 0 elsewhere
+    with stage('masks'):
+        #--- mask of suppressions
+        # True where the condition is satisfied for alpha-suppressions
+        mask_alpha = (y2_alpha < T_alpha) & (y2_beta < T_beta) & ~mask_shallow_signal & (y2_gamma < 0.25) & (mask_ground_check != 1)
 
-    Om_IES = np.where((mask_alpha == 1) & (y2 < T_IES))[0]     # list of indices where the condition is satisfied for IES
-    Om_IES = np.where((y2 < T_IES))
-    mask_IES = np.zeros(N)
-    mask_IES[Om_IES] = 1           #  set 1 where there is an IES suppression, 0 elsewhere
+        # True where the condition is satisfied for IES
+        mask_IES = y2 < T_IES
 
-    #--- Erosion and dilatation routine
-    mask_alpha = erosion_dilation(mask_alpha,0.6,0.5,fs)*1
-    mask_IES = erosion_dilation(mask_IES,1.1,0.9,fs)*1 
+        #--- Erosion and dilatation routine
+        mask_alpha = erosion_dilation(mask_alpha,0.6,0.5,fs)
+        mask_IES = erosion_dilation(mask_IES,1.1,0.9,fs)
 
-    # remove alpha_supp where there is an IES
-    mask_alpha[np.where((mask_alpha-mask_IES) != 1)[0]] = 0
-    #mask_alpha = erosion_dilation(mask_alpha,0.5,0.5,fs)
+        # remove alpha_supp where there is an IES
+        mask_alpha &= ~mask_IES
+        #mask_alpha = erosion_dilation(mask_alpha,0.5,0.5,fs)
+        mask_IES, mask_alpha = mask_IES.view(np.uint8), mask_alpha.view(np.uint8)
 
     # get proportion of shallow signals
-    shallow_signal_proportion = np.sum(mask_shallow_signal)/N
+    shallow_signal_proportion = np.count_nonzero(mask_shallow_signal,axis=-1)/N
 
-    # get position of suppressions
-    pos_IES = detect_pos_1(mask_IES)
-    pos_alpha = detect_pos_1(mask_alpha)
+    # get position of suppressions (list per channel)
+    if np.ndim(y) == 1:
+        pos_IES = detect_pos_1(mask_IES)
+        pos_alpha = detect_pos_1(mask_alpha)
+    else:
+        pos_IES = [detect_pos_1(mask) for mask in mask_IES]
+        pos_alpha = [detect_pos_1(mask) for mask in mask_alpha]
 
     # get proportion of IES in window
-    IES_proportion = np.sum(mask_IES)/N
-    alpha_suppression_proportion = np.sum(mask_alpha)/N
+    IES_proportion = np.count_nonzero(mask_IES,axis=-1)/N
+    alpha_suppression_proportion = np.count_nonzero(mask_alpha,axis=-1)/N
 
     return y2,y2_alpha,pos_IES,pos_alpha,shallow_signal_proportion, mask_IES, mask_alpha, IES_proportion,alpha_suppression_proportion
 
+@timed()
 def get_mask_ground_check(y,fs, delta_f = 1, n_overlap = 16):
 
     # compute the spectrogram
@@ -138,29 +187,19 @@ def get_mask_ground_check(y,fs, delta_f = 1, n_overlap = 16):
     delta_f = f_spectro[1] - f_spectro[0]
     j = int(45 / delta_f)
     f_spectro = f_spectro[:j]
-    spectro = spectro[:j, :]  
+    spectro = spectro[..., :j, :]  
 
     # get sum of values above T_h in a spectro per colum
     T_h = 10
-    T_h_spectro = np.zeros_like(spectro)
-    T_h_spectro[np.where(spectro >= T_h)] = 1
-
-    sum_h = np.sum(T_h_spectro, axis = 0)
+    sum_h = np.count_nonzero(spectro >= T_h, axis = -2)
 
     # get sum of values bellow T_l
     T_l = 0.005
-
-    T_l_spectro = np.zeros_like(spectro)
-    T_l_spectro[np.where(spectro <= T_l)] = 1
-
-    sum_l = np.sum(T_l_spectro, axis = 0) 
+    sum_l = np.count_nonzero(spectro <= T_l, axis = -2) 
 
     # mask of values higher or lower than threhsolds
-    mask_h = np.zeros_like(sum_h)
-    mask_h[np.where(sum_h >= 30)] = 1
-
-    mask_l = np.zeros_like(sum_l)
-    mask_l[np.where(sum_l >= 20)] = 1
+    mask_h = (sum_h >= 30).view(np.uint8)
+    mask_l = (sum_l >= 20).view(np.uint8)
 
     delta_t = t_spectro[1] - t_spectro[0]
 
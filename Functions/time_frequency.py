@@ -1,6 +1,6 @@
 import numpy as np
 import scipy as sc
-from scipy.ndimage import median_filter, gaussian_filter, uniform_filter, minimum_filter, maximum_filter
+from Functions.jit import kernel
 #-----------------------------------------------------------------------------------------------------------------------#
 #--------------------------------------------- time-frequency representation -------------------------------------------#
 #-----------------------------------------------------------------------------------------------------------------------#
@@ -191,6 +191,18 @@ def get_edge_significant_value(thresholded_M, f, N_max):
 
     Ouput:
     '''
+    # index of the edge frequency of each column (-1 when there is none)
+    index = edge_significant_index(np.asarray(thresholded_M), N_max)
+    # 0 when there is no edge frequency (check if can be changed)
+    valid = (index >= 0) & (index < len(f))
+    edge_frequencies = np.where(valid, np.asarray(f)[np.where(valid, index, 0)], 0.)
+
+    return edge_frequencies #, cumulative_spectro
+
+def edge_significant_index_numpy(thresholded_M, N_max):
+    '''
+    index of the edge frequency of each column of thresholded_M (-1 when there is none)
+    '''
     # create matrix where in a column 0,0--> 0 | 0,1 --> 0 | 1,0 --> 0 | 1,1 --> 1 
     M_01 = thresholded_M[:-1, :] * thresholded_M[1:, :]
 
@@ -199,19 +211,46 @@ def get_edge_significant_value(thresholded_M, f, N_max):
     reversed_cumulative_spectro = np.cumsum(reversed_spectro, axis=0)
     cumulative_spectro = np.flipud(reversed_cumulative_spectro)
 
-    # find first frequency where M_01 is 1 or when the cumulative reaches N_max
-    N = len(thresholded_M[0,:])
-    edge_frequencies = np.zeros(N)
-    for j in range(N):
-        try:
-            i = max(np.where(cumulative_spectro[:, j] == N_max)[0])
-            k = max(np.where(M_01[:, j] == 1)[0]) + 1
-            index = max(i,k)
-            edge_frequencies[j] = f[index] # check if it cannot be higher than index in f_spectro
-        except:
-            edge_frequencies[j] = 0 # already 0 check if can be changed
+    # last frequency where M_01 is 1 (+1) and where the cumulative reaches N_max
+    i = last_index(cumulative_spectro == N_max)
+    k = last_index(M_01 == 1) + 1
 
-    return edge_frequencies #, cumulative_spectro
+    return np.where((i >= 0) & (k > 0), np.maximum(i, k), -1)
+
+def last_index(cond):
+    '''
+    last row where cond is True in each column (-1 when there is none)
+    '''
+    if len(cond) == 0:
+        return np.full(cond.shape[1:], -1, dtype=np.intp)
+    index = len(cond) - 1 - np.argmax(cond[::-1], axis=0)
+    return np.where(cond.any(axis=0), index, -1)
+
+@kernel(edge_significant_index_numpy)
+def edge_significant_index(thresholded_M, N_max):
+    '''
+    index of the edge frequency of each column of thresholded_M (-1 when there is none): the highest
+    of the last frequency where the cumulative (from the highest frequency) reaches N_max and of the
+    last frequency of two consecutive values of 1
+    '''
+    rows, columns = thresholded_M.shape
+    index = np.full(columns, -1, dtype=np.intp)
+    for j in range(columns):
+        i = -1
+        cumulative = 0.
+        for r in range(rows - 1, -1, -1):
+            cumulative += thresholded_M[r, j]
+            if cumulative == N_max:
+                i = r
+                break
+        k = -1
+        for r in range(rows - 2, -1, -1):
+            if thresholded_M[r, j] * thresholded_M[r + 1, j] == 1:
+                k = r + 1
+                break
+        if i >= 0 and k >= 0:
+            index[j] = max(i, k)
+    return index
 
 
 #-----------------------------------------------------------------------------------------------------------------------#
@@ -1,5 +1,6 @@
 import numpy as np
 import scipy as sc
+from Functions.jit import kernel
 
 '''
 Function that detects the position of a 0 to 1 edge in a mask (the position is the one of the 1 in the mask)
@@ -261,7 +262,6 @@ def get_re(y):
     
     return (y[-1] - y[0]) / np.abs(y[0])
 
-from scipy.interpolate import interp1d
 
 def resize_binary_mask(mask, new_length):
     """
@@ -281,7 +281,7 @@ def resize_binary_mask(mask, new_length):
     x_old = np.linspace(0, 1, original_length)
     x_new = np.linspace(0, 1, new_length)
     
-    f = interp1d(x_old, mask, kind='linear')
+    f = sc.interpolate.interp1d(x_old, mask, kind='linear')
     resized = f(x_new)
     
     # Threshold to get binary mask again
@@ -302,22 +302,8 @@ def filter_binary_mask(mask, min_length):
         np.ndarray: Filtered binary mask.
     """
     mask = np.asarray(mask, dtype=np.uint8)
-    result = np.zeros_like(mask)
     
-    start = None
-    for i, val in enumerate(mask):
-        if val == 1:
-            if start is None:
-                start = i
-        else:
-            if start is not None and i - start >= min_length:
-                result[start:i] = 1
-            start = None
-    # Handle case where the mask ends with a segment of 1s
-    if start is not None and len(mask) - start >= min_length:
-        result[start:] = 1
-    
-    return result
+    return keep_long_segments(mask, min_length)
 
 
 def remove_short_segments(mask, min_length):
@@ -332,20 +318,43 @@ def remove_short_segments(mask, min_length):
         np.ndarray: Filtered binary mask.
     """
     mask = np.asarray(mask, dtype=np.uint8)
+
+    return keep_long_segments(mask, min_length)
+
+
+def keep_long_segments_numpy(mask, min_length):
+    '''
+    mask (uint8) with only the segments of consecutive 1s of at least min_length
+    '''
+    edge_0_1, edge_1_0 = detect_mask_edge((mask == 1).view(np.uint8))
+    keep = edge_1_0 - edge_0_1 + 1 >= min_length
+    # +1 at the start and -1 after the end of the segments kept (separated by at least one 0)
+    change = np.zeros(len(mask) + 1, dtype=np.int8)
+    change[edge_0_1[keep]] = 1
+    change[edge_1_0[keep] + 1] = -1
+
+    return np.cumsum(change[:-1], dtype=np.int8).astype(np.uint8)
+
+
+@kernel(keep_long_segments_numpy)
+def keep_long_segments(mask, min_length):
+    '''
+    mask (uint8) with only the segments of consecutive 1s of at least min_length
+    '''
     result = np.zeros_like(mask)
 
-    start = None
-    for i, val in enumerate(mask):
-        if val == 1:
-            if start is None:
+    start = -1
+    for i in range(len(mask)):
+        if mask[i] == 1:
+            if start < 0:
                 start = i
         else:
-            if start is not None and i - start >= min_length:
+            if start >= 0 and i - start >= min_length:
                 result[start:i] = 1
-            start = None
+            start = -1
 
     # Handle case where the mask ends with a segment of 1s
-    if start is not None and len(mask) - start >= min_length:
+    if start >= 0 and len(mask) - start >= min_length:
         result[start:] = 1
 
     return result
@@ -0,0 +1,330 @@
+'''
+Equivalence of fast implementations with the reference code (golden outputs)
+
+An engine is a set of implementations of the functions of the pipeline
+(FUNCTIONS: the sliding window functions, detect_suppressions_power,
+find_artifacts and WQN_3) with the signatures of the reference ones in
+Functions/. The harness runs the reference and an engine on the same signals
+(synthetic recordings of benchmarks/synthetic_eeg.py and real recordings) and
+reports side by side, for every output:
+- the maximal absolute and relative errors and the non finite values that differ
+- the agreement of the states of get_state_0_20 computed from each engine's features
+- the time of each function and the speedup
+
+The reference outputs can be saved as golden files (--save-golden) and an
+engine compared with them later (--golden), e.g. to check that a change of the
+reference code itself keeps its outputs. benchmarks/golden/ holds the outputs of
+the code before the kernels of Functions/jit.py (find_artifacts, the k-gram counts
+of compute_block_entropy_k, get_edge_significant_value and the segment filters of
+Functions/utils.py were rewritten with them), the current code is checked with
+the last command below. The run fails (exit code 1) when an
+output exceeds the tolerances or when a state differs (--min-agreement).
+
+Engines are registered in ENGINES (name --> factory returning the functions it
+replaces and the dtype of its input signal), the missing functions are the
+reference ones, an engine can also be given as module:factory.
+
+    python -m benchmarks.equivalence --engine float32 --hours 1 --seeds 0 1 --recordings recordings_npy --limit 5
+    python -m benchmarks.equivalence --save-golden golden/ --hours 1 --recordings recordings_npy
+    python -m benchmarks.equivalence --engine reference --golden golden/
+    python -m benchmarks.equivalence --engine numba --hours 1 --recordings recordings_npy
+    python -m benchmarks.equivalence --golden benchmarks/golden --hours 0.25 --seeds 0 1 --recordings recordings_npy/EEG_data_000351929.npy
+'''
+
+import argparse
+import contextlib
+import glob
+import importlib
+import io
+import json
+import os
+import sys
+import time
+import numpy as np
+
+import Functions.jit as jit
+import Functions.sliding_fct as sliding
+from Functions.suppressions import detect_suppressions_power
+from Functions.detect_artifacts import find_artifacts
+from Functions.WaveletQuantileNormalization import WQN_3
+from Functions.filter import get_filtered_signal
+from Functions.compute_state import get_state_0_20
+from state_annotation.batch import LIST_DETECTION, LIST_WQN
+from state_annotation.compute import BANDS
+from state_annotation.recording import Recording, TimeAxis
+from benchmarks.synthetic_eeg import FS, synthetic_eeg
+
+FUNCTIONS = ['power_nD', 'supp_power_prop', 'compute_entropy', 'compute_block_entropy_k', 'compute_line_length',
+             'compute_freqs_quantiles', 'compute_central_frequency', 'detect_suppressions_power', 'find_artifacts', 'WQN_3']
+
+WARM_UP_HOURS = 0.05
+
+TOLERANCES = {'rtol': 1e-7,           # maximal relative error (max |delta| / max |reference| of an output)
+              'atol': 1e-9,           # errors below atol are ignored
+              'min_agreement': 1.0}   # proportion of the epochs with the same state
+
+
+def reference_functions():
+
+    return {'power_nD': sliding.power_nD, 'supp_power_prop': sliding.supp_power_prop,
+            'compute_entropy': sliding.compute_entropy, 'compute_block_entropy_k': sliding.compute_block_entropy_k,
+            'compute_line_length': sliding.compute_line_length, 'compute_freqs_quantiles': sliding.compute_freqs_quantiles,
+            'compute_central_frequency': sliding.compute_central_frequency,
+            'detect_suppressions_power': detect_suppressions_power, 'find_artifacts': find_artifacts, 'WQN_3': WQN_3}
+
+
+def with_backend(fct, backend):
+    '''
+    fct run with the given backend of the kernels of Functions/jit.py
+    '''
+    def wrapper(*args):
+        with jit.use_backend(backend):
+            return fct(*args)
+    return wrapper
+
+
+def reference_engine():
+    '''
+    the reference code, with the NumPy kernels of Functions/jit.py whatever the backend of the process
+    '''
+    return {'functions': {name: with_backend(fct, 'numpy') for name, fct in reference_functions().items()},
+            'dtype': np.float64}
+
+
+def float32_engine():
+    '''
+    the reference code on float32 signals (precision policy of Compute, see state_annotation/precision_report.py)
+    '''
+    return dict(reference_engine(), dtype=np.float32)
+
+
+def numba_engine():
+    '''
+    the reference code with the kernels of Functions/jit.py compiled by Numba
+    '''
+    if not jit.numba_available():
+        raise ImportError('the numba engine needs Numba (pip install numba)')
+    return {'functions': {name: with_backend(fct, 'numba') for name, fct in reference_functions().items()}}
+
+
+ENGINES = {'reference': reference_engine, 'float32': float32_engine, 'numba': numba_engine}
+
+
+def load_engine(name):
+    '''
+    functions of an engine (the reference ones where it has none) and the dtype of its input
+    '''
+    if name in ENGINES:
+        engine = ENGINES[name]()
+    elif ':' in name:
+        module, factory = name.split(':')
+        engine = getattr(importlib.import_module(module), factory)()
+    else:
+        raise ValueError('engine %r is not one of %s (or module:factory)' % (name, list(ENGINES)))
+    functions = dict(reference_engine()['functions'], **engine.get('functions', {}))
+    return {'name': name, 'functions': functions, 'dtype': engine.get('dtype', np.float64)}
+
+
+#-------------------------------------------------------------------------------------------#
+#                                        Outputs                                            #
+#-------------------------------------------------------------------------------------------#
+
+def timed_call(times, name, fct, *args):
+
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):   # debug prints of the reference code
+        out = fct(*args)
+    times[name] = times.get(name, 0.) + time.perf_counter() - t0
+    return out
+
+
+def run_engine(engine, y, fs=FS, Ws=None, step=None, index_mask=None):
+    '''
+    Inputs:
+    - index_mask  <-- artifacts corrected by WQN_3 (the ones found by the engine by default), the
+                      reference ones so that WQN_3 is compared on the same artifacts
+    Outputs:
+    - outputs  <-- dictionnary output --> array (features, states, suppressions of each window, artifacts, WQN signal)
+    - times    <-- dictionnary function --> time (s)
+    '''
+    fct = engine['functions']
+    Ws, step = Ws or 30 * fs, step or 10 * fs
+    y = np.asarray(y, dtype=engine['dtype'])
+    t = TimeAxis(len(y), fs)
+    outputs, times = {}, {}
+
+    #--- features of Compute
+    signals = get_filtered_signal(y, fs, BANDS)   # shared input of power_nD (not an engine function)
+    P = np.asarray(timed_call(times, 'power_nD', fct['power_nD'], signals, t, Ws, step)[-1])
+    IES, alpha = timed_call(times, 'supp_power_prop', fct['supp_power_prop'], y, t, Ws, step, fs)[-2:]
+    outputs.update({'P_signals': P, 'IES_prop': np.asarray(IES), 'alpha_supp_prop': np.asarray(alpha)})
+    outputs['entropy'] = timed_call(times, 'compute_entropy', fct['compute_entropy'], y, t, Ws, step)[-1]
+    outputs['be'] = timed_call(times, 'compute_block_entropy_k', fct['compute_block_entropy_k'], y, t, Ws, step)[-1]
+    outputs['line_length'] = timed_call(times, 'compute_line_length', fct['compute_line_length'], y, t, Ws, step)[-1]
+    outputs['freqs_quantiles'] = timed_call(times, 'compute_freqs_quantiles', fct['compute_freqs_quantiles'], y, t, Ws, step, fs)[-1]
+    outputs['f_central'] = timed_call(times, 'compute_central_frequency', fct['compute_central_frequency'], y, t, fs, Ws, step)[-1]
+
+    #--- states from the features of the engine
+    supp = outputs['alpha_supp_prop'] + 2 * outputs['IES_prop']
+    prop = P / np.sum(P, axis=0)
+    outputs['state'] = np.array([get_state_0_20(supp[i], prop[:, i]) for i in range(len(supp))])
+
+    #--- suppressions of each window (masks concatenated)
+    masks_IES, masks_alpha = [], []
+    for i in range(0, len(y) - Ws, step):
+        out = timed_call(times, 'detect_suppressions_power', fct['detect_suppressions_power'], y[i:i + Ws], fs)
+        masks_IES.append(out[5])
+        masks_alpha.append(out[6])
+    outputs['mask_IES'] = np.concatenate(masks_IES).astype(np.uint8) if masks_IES else np.zeros(0, np.uint8)
+    outputs['mask_alpha'] = np.concatenate(masks_alpha).astype(np.uint8) if masks_alpha else np.zeros(0, np.uint8)
+
+    #--- artifacts and their correction
+    found = timed_call(times, 'find_artifacts', fct['find_artifacts'], y, *LIST_DETECTION)
+    outputs['index_mask'] = np.asarray(found, dtype=np.int64)
+    outputs['artifact_mask'] = artifact_mask(found, len(y))
+    index_mask = [int(i) for i in (found if index_mask is None else index_mask)]
+    outputs['WQN'] = timed_call(times, 'WQN_3', fct['WQN_3'], y, index_mask, *LIST_WQN) if len(index_mask) else y
+    return {name: np.asarray(value) for name, value in outputs.items()}, times
+
+
+def artifact_mask(index_mask, N):
+
+    mask = np.zeros(N, dtype=np.uint8)
+    for k in range(0, len(index_mask) - 1, 2):
+        mask[index_mask[k]:index_mask[k + 1] + 1] = 1
+    return mask
+
+
+#-------------------------------------------------------------------------------------------#
+#                                       Comparison                                          #
+#-------------------------------------------------------------------------------------------#
+
+def errors(reference, candidate, atol=TOLERANCES['atol']):
+    '''
+    maximal absolute and relative errors of an output, non finite values that differ
+    '''
+    a, b = np.asarray(reference, dtype=np.float64), np.asarray(candidate, dtype=np.float64)
+    if a.shape != b.shape:
+        return {'shape': [list(a.shape), list(b.shape)], 'max_abs': float('inf'), 'max_rel': float('inf'), 'nonfinite': 0}
+    finite = np.isfinite(a) & np.isfinite(b)
+    delta = np.abs(a[finite] - b[finite])
+    max_abs = float(delta.max()) if delta.size else 0.
+    # relative to the magnitude of the output (signals crossing 0 have no elementwise relative error)
+    scale = float(np.abs(a[finite]).max()) if delta.size else 0.
+    max_rel = 0. if max_abs <= atol else max_abs / scale if scale > 0 else float('inf')
+    return {'max_abs': max_abs, 'max_rel': max_rel, 'nonfinite': int(np.sum(np.isfinite(a) != np.isfinite(b)))}
+
+
+def compare(reference, candidate, ref_times, times, tolerances=TOLERANCES):
+    '''
+    Output:
+    - dictionnary with the errors of each output, the state agreement, the times and the failures
+    '''
+    outputs = {name: errors(reference[name], candidate[name], tolerances['atol']) for name in reference}
+    same_length = len(reference['state']) == len(candidate['state'])
+    agreement = float(np.mean(reference['state'] == candidate['state'])) if same_length and len(reference['state']) else float(same_length)
+    functions = {name: {'reference': ref_times.get(name), 'engine': times.get(name),
+                        'speedup': ref_times[name] / times[name] if ref_times.get(name) and times.get(name) else None}
+                 for name in FUNCTIONS}
+    failures = ['%s: relative error %.2e' % (name, e['max_rel']) for name, e in outputs.items() if e['max_rel'] > tolerances['rtol']]
+    failures += ['%s: %d non finite values differ' % (name, e['nonfinite']) for name, e in outputs.items() if e['nonfinite']]
+    if agreement < tolerances['min_agreement']:
+        failures.append('state agreement %.4f' % agreement)
+    return {'outputs': outputs, 'state_agreement': agreement, 'functions': functions, 'failures': failures}
+
+
+def print_case(name, result):
+
+    print('\n%s: state agreement %.4f  %s' % (name, result['state_agreement'],
+                                             'ok' if not result['failures'] else 'FAILED: ' + '; '.join(result['failures'])))
+    print('  %-28s %12s %12s' % ('output', 'max abs', 'max rel'))
+    for output, e in result['outputs'].items():
+        print('  %-28s %12.3e %12.3e' % (output, e['max_abs'], e['max_rel']))
+    print('  %-28s %12s %12s %9s' % ('function', 'reference', 'engine', 'speedup'))
+    for function, t in result['functions'].items():
+        if t['engine'] is None:
+            continue
+        print('  %-28s %11s %11.3fs %9s' % (function, '%.3fs' % t['reference'] if t['reference'] is not None else '-',
+                                          t['engine'], 'x%.2f' % t['speedup'] if t['speedup'] else '-'))
+
+
+#-------------------------------------------------------------------------------------------#
+#                                         Cases                                             #
+#-------------------------------------------------------------------------------------------#
+
+def cases(hours=(1,), seeds=(0,), recordings=(), limit=None, fs=FS):
+    '''
+    (name, signal) of the synthetic recordings and of the real ones (folders or .npy files)
+    '''
+    for h in hours:
+        for seed in seeds:
+            # last sample dropped as Recording does (a signal of Ws + k * step samples has one more
+            # window of entropy than time indices)
+            yield 'synthetic_%gh_seed%d' % (h, seed), synthetic_eeg(h, fs, seed=seed)[0][:-1]
+    paths = []
+    for item in recordings:
+        paths += sorted(glob.glob(os.path.join(item, '*.npy'))) if os.path.isdir(item) else [item]
+    for path in paths[:limit]:
+        yield os.path.splitext(os.path.basename(path))[0], Recording(path, fs).signal()
+
+
+def save_golden(folder, name, outputs, times):
+
+    os.makedirs(folder, exist_ok=True)
+    np.savez_compressed(os.path.join(folder, name + '.npz'), times=json.dumps(times), **outputs)
+
+
+def load_golden(folder, name):
+
+    with np.load(os.path.join(folder, name + '.npz')) as D:
+        return {key: D[key] for key in D.files if key != 'times'}, json.loads(str(D['times']))
+
+
+def run(engine_name='reference', case_list=(), golden=None, save_golden_folder=None, tolerances=TOLERANCES, verbose=True):
+    '''
+    compares the engine with the reference (run now, or read from the golden folder) on each case
+    '''
+    reference = load_engine('reference')
+    engine = load_engine(engine_name)
+    # modules imported on first use and filter designs loaded before the timings
+    warm_up = synthetic_eeg(WARM_UP_HOURS, seed=0)[0][:-1]
+    for e in (reference, engine):
+        run_engine(e, warm_up)
+    results = {}
+    for name, y in case_list:
+        if golden is not None:
+            ref_outputs, ref_times = load_golden(golden, name)
+        else:
+            ref_outputs, ref_times = run_engine(reference, y)
+            if save_golden_folder is not None:
+                save_golden(save_golden_folder, name, ref_outputs, ref_times)
+        outputs, times = run_engine(engine, y, index_mask=ref_outputs['index_mask'])
+        results[name] = compare(ref_outputs, outputs, ref_times, times, tolerances)
+        if verbose:
+            print_case(name, results[name])
+    return {'engine': engine_name, 'tolerances': tolerances, 'cases': results,
+            'passed': all(not r['failures'] for r in results.values())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Equivalence of an engine with the reference code')
+    parser.add_argument('--engine', default='reference', help='one of %s or module:factory' % list(ENGINES))
+    parser.add_argument('--hours', type=float, nargs='*', default=[1], help='durations of the synthetic recordings')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0], help='seeds of the synthetic recordings')
+    parser.add_argument('--recordings', nargs='*', default=[], help='real recordings (.npy files or folders)')
+    parser.add_argument('--limit', type=int, default=None, help='maximal number of real recordings')
+    parser.add_argument('--golden', default=None, help='folder of golden outputs to compare with (instead of running the reference)')
+    parser.add_argument('--save-golden', default=None, help='folder where the reference outputs are saved')
+    parser.add_argument('--rtol', type=float, default=TOLERANCES['rtol'])
+    parser.add_argument('--atol', type=float, default=TOLERANCES['atol'])
+    parser.add_argument('--min-agreement', type=float, default=TOLERANCES['min_agreement'])
+    parser.add_argument('--out', default=None, help='report (json)')
+    args = parser.parse_args()
+
+    tolerances = {'rtol': args.rtol, 'atol': args.atol, 'min_agreement': args.min_agreement}
+    result = run(args.engine, cases(args.hours, args.seeds, args.recordings, args.limit), args.golden, args.save_golden, tolerances)
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(result, file, indent=1)
+    print('\n' + ('passed' if result['passed'] else 'FAILED'))
+    sys.exit(0 if result['passed'] else 1)
@@ -0,0 +1,365 @@
+'''
+Benchmarks of the feature pipeline on synthetic EEG (benchmarks/synthetic_eeg.py)
+
+The benchmarks cover the sliding window functions of Functions/sliding_fct.py,
+the band filters, Compute.run, the artifact detection (find_artifacts) and
+correction (WQN_3) and the load path of the viewer (EEGViewer.load_file with an
+empty feature cache, offscreen, skipped when PyQt6 is not available) and the
+kernels of Functions/jit.py with each backend ('jit.<kernel>[numba]' and
+'[numpy]', the numba ones skipped when Numba is not installed). Each one
+runs on synthetic recordings of the given durations (1, 8, 24 h at 128 Hz),
+generated once in --data and reused.
+
+The results (min and median of the repetitions, samples per second) are saved
+as a JSON baseline. `compare` flags the benchmarks slower than the baseline by
+more than --threshold (on the minimum time, the least noisy) and exits with 1
+when there is one.
+
+    python -m benchmarks.suite run --hours 1 8 --out benchmarks/baseline.json
+    python -m benchmarks.suite run --hours 1 --filter sliding --compare benchmarks/baseline.json
+    python -m benchmarks.suite compare benchmarks/baseline.json current.json --threshold 0.2
+    python -m benchmarks.suite run --hours 1 8 --filter jit.
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import scipy
+
+import Functions.jit as jit
+import Functions.sliding_fct as sliding
+from Functions.filter import get_filtered_signal
+from Functions.detect_artifacts import find_artifacts
+from Functions.time_frequency import spectrogram
+from state_annotation.batch import LIST_DETECTION, correct_artifacts
+from state_annotation.compute import Compute, BANDS
+from state_annotation.recording import Recording
+from benchmarks.synthetic_eeg import FS, write_recording
+
+THRESHOLD = 0.2   # relative slowdown flagged by compare
+WARM_UP_HOURS = 0.05
+
+# name --> (function, setup, teardown): function(data, *setup(data)) is timed
+BENCHMARKS = {}
+
+
+def benchmark(name, setup=None, teardown=None):
+
+    def decorator(fct):
+        BENCHMARKS[name] = (fct, setup, teardown)
+        return fct
+    return decorator
+
+
+class Data:
+    '''
+    synthetic recording of a benchmark and the inputs computed once (filtered signals, artifacts)
+    '''
+
+    def __init__(self, path, fs=FS):
+        self.path = path
+        self.fs = fs
+        self.recording = Recording(path, fs)
+        self.y = self.recording.signal()
+        self.t = self.recording.t
+        self.Ws, self.step = 30 * fs, 10 * fs
+        self._signals = None
+        self._index_mask = None
+        self._inputs = {}
+
+    @property
+    def signals(self):
+        if self._signals is None:
+            self._signals = get_filtered_signal(self.y, self.fs, BANDS)
+        return self._signals
+
+    @property
+    def index_mask(self):
+        if self._index_mask is None:
+            self._index_mask = find_artifacts(self.y, *LIST_DETECTION)
+        return self._index_mask
+
+    def inputs(self, name, compute):
+        '''
+        inputs of a benchmark computed on first use by compute(data)
+        '''
+        if name not in self._inputs:
+            self._inputs[name] = compute(self)
+        return self._inputs[name]
+
+
+#-------------------------------------------------------------------------------------------#
+#                                      Benchmarks                                           #
+#-------------------------------------------------------------------------------------------#
+
+@benchmark('filter.get_filtered_signal')
+def bench_filtered_signal(data):
+    get_filtered_signal(data.y, data.fs, BANDS)
+
+@benchmark('sliding.power_1D', setup=lambda data: (data.signals[0],))
+def bench_power_1D(data, signal):
+    sliding.power_1D(signal, data.t, data.Ws, data.step)
+
+@benchmark('sliding.power_nD', setup=lambda data: (data.signals,))
+def bench_power_nD(data, signals):
+    sliding.power_nD(signals, data.t, data.Ws, data.step)
+
+@benchmark('sliding.supp_power')
+def bench_supp_power(data):
+    sliding.supp_power(data.y, data.Ws, data.step, data.fs, 12, 5)
+
+@benchmark('sliding.supp_power_prop')
+def bench_supp_power_prop(data):
+    sliding.supp_power_prop(data.y, data.t, data.Ws, data.step, data.fs)
+
+@benchmark('sliding.compute_entropy')
+def bench_entropy(data):
+    sliding.compute_entropy(data.y, data.t, data.Ws, data.step)
+
+@benchmark('sliding.compute_block_entropy_k')
+def bench_block_entropy(data):
+    sliding.compute_block_entropy_k(data.y, data.t, data.Ws, data.step)
+
+@benchmark('sliding.compute_line_length')
+def bench_line_length(data):
+    sliding.compute_line_length(data.y, data.t, data.Ws, data.step)
+
+@benchmark('sliding.compute_freqs_quantiles')
+def bench_freqs_quantiles(data):
+    sliding.compute_freqs_quantiles(data.y, data.t, data.Ws, data.step, data.fs)
+
+@benchmark('sliding.compute_central_frequency')
+def bench_central_frequency(data):
+    sliding.compute_central_frequency(data.y, data.t, data.fs, data.Ws, data.step)
+
+@benchmark('compute.run')
+def bench_compute(data):
+    C = Compute()
+    C.get_data(data.t, data.y, data.fs, data.Ws, data.step, data.Ws, data.step)
+    C.run()
+
+@benchmark('artifacts.find_artifacts')
+def bench_find_artifacts(data):
+    find_artifacts(data.y, *LIST_DETECTION)
+
+@benchmark('artifacts.WQN_3', setup=lambda data: (data.index_mask,))
+def bench_wqn(data, index_mask):
+    correct_artifacts(data.y, index_mask)
+
+
+#--- kernels of Functions/jit.py with each backend (compiled during the warm up)
+def kgram_inputs(data):
+    rows = data.y[:len(data.y) // data.Ws * data.Ws].reshape(-1, data.Ws)
+    return sliding.bin_index(rows, sliding.bin_edges(rows, 10)) + 1, 2, 12
+
+def cdf_slopes_inputs(data):
+    import pywt
+    Ws, wavelet_name, level, mode = LIST_DETECTION[0], *LIST_DETECTION[3:]
+    windows = data.y[:len(data.y) // Ws * Ws].reshape(-1, Ws)
+    return pywt.wavedec(windows, wavelet_name, mode, level, axis=-1)[-1],
+
+def edge_index_inputs(data):
+    M = spectrogram(data.y, data.fs)[-1]
+    threshold = min(2, max(0.05, 5 * np.quantile(np.clip(M, 0.001, 20), 0.5)))   # as edge_frequencies_significant_value
+    return (M >= threshold).astype(float), 2
+
+def segments_inputs(data):
+    return (np.abs(data.y) < 10).view(np.uint8), data.fs // 2
+
+KERNEL_INPUTS = {'kgram_counts': kgram_inputs, 'cdf_slopes': cdf_slopes_inputs,
+                 'edge_significant_index': edge_index_inputs, 'keep_long_segments': segments_inputs,
+                 'trailing_mean3': lambda data: (data.y,)}
+
+def kernel_benchmark(name, backend):
+
+    def bench_kernel(data, *inputs):
+        with jit.use_backend(backend):   # ImportError without Numba
+            jit.KERNELS[name](*inputs)
+    benchmark('jit.%s[%s]' % (name, backend), setup=lambda data: data.inputs(name, KERNEL_INPUTS[name]))(bench_kernel)
+
+for kernel_name in KERNEL_INPUTS:
+    for backend_name in jit.BACKENDS:
+        kernel_benchmark(kernel_name, backend_name)
+
+
+#--- load path of the viewer: file opened with an empty feature cache until the first plot
+_app = None
+
+def setup_viewer(data):
+    global _app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    import state_app
+    if _app is None:
+        _app = state_app.QApplication.instance() or state_app.QApplication(sys.argv[:1])
+    folder = tempfile.mkdtemp(prefix='benchmark_viewer_')
+    viewer = state_app.EEGViewer()
+    viewer.fs_input.setValue(data.fs)
+    viewer.save_folder = os.path.join(folder, 'annotations/')
+    viewer.journal_folder = os.path.join(folder, 'journal/')
+    viewer.feature_cache.folder = os.path.join(folder, 'feature_cache/')
+    state_app.QFileDialog.getOpenFileName = staticmethod(lambda *args, **kwargs: (os.path.abspath(data.path), ''))
+    return viewer, folder
+
+def teardown_viewer(data, viewer, folder):
+    if viewer.feature_thread is not None:
+        viewer.feature_thread.join()   # features evaluated in the background after the first plot
+    viewer.close()
+    shutil.rmtree(folder, ignore_errors=True)
+
+@benchmark('app.load_file', setup=setup_viewer, teardown=teardown_viewer)
+def bench_load_file(data, viewer, folder):
+    viewer.load_file()
+
+
+#-------------------------------------------------------------------------------------------#
+#                                        Running                                            #
+#-------------------------------------------------------------------------------------------#
+
+def recording_path(folder, hours, seed):
+    '''
+    synthetic recording of the given duration, generated on first use
+    '''
+    path = os.path.join(folder, 'synthetic_%gh_seed%d.npy' % (hours, seed))
+    if not os.path.isfile(path):
+        os.makedirs(folder, exist_ok=True)
+        write_recording(path, hours, seed=seed)
+    return path
+
+
+def warm_up(names, data_folder, seed):
+    '''
+    runs the benchmarks once on a short recording: the modules imported on first use
+    (scipy.signal, pywt, Qt) and the filter designs are loaded before the timings
+    '''
+    data = Data(recording_path(data_folder, WARM_UP_HOURS, seed))
+    for name in names:
+        try:
+            time_benchmark(name, data, 1)
+        except ImportError:
+            pass
+
+
+def time_benchmark(name, data, repeat):
+
+    fct, setup, teardown = BENCHMARKS[name]
+    times = []
+    for _ in range(repeat):
+        args = setup(data) if setup is not None else ()
+        t0 = time.perf_counter()
+        fct(data, *args)
+        times.append(time.perf_counter() - t0)
+        if teardown is not None:
+            teardown(data, *args)
+    return times
+
+
+def metadata():
+
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'jit_backend': jit.backend()}
+
+
+def run(hours=(1,), names=None, repeat=3, data_folder=None, seed=0, verbose=True):
+    '''
+    Output:
+    - dictionnary 'meta' and 'results': '<benchmark>@<hours>h' --> times, min, median, samples_per_s
+      (or 'skipped' with the reason)
+    '''
+    data_folder = data_folder or os.path.join(tempfile.gettempdir(), 'eeg_benchmarks')
+    names = list(BENCHMARKS) if names is None else names
+    warm_up(names, data_folder, seed)
+    results = {}
+    for h in hours:
+        data = Data(recording_path(data_folder, h, seed))
+        for name in names:
+            key = '%s@%gh' % (name, h)
+            try:
+                times = time_benchmark(name, data, repeat)
+            except ImportError as e:   # e.g. the viewer without PyQt6
+                results[key] = {'skipped': repr(e)}
+                if verbose:
+                    print('%-45s skipped (%s)' % (key, e))
+                continue
+            results[key] = {'hours': h, 'samples': len(data.y), 'times': times, 'min': min(times),
+                            'median': float(np.median(times)), 'samples_per_s': len(data.y) / min(times)}
+            if verbose:
+                print('%-45s min %8.3f s  median %8.3f s  %12.0f samples/s' % (key, min(times), np.median(times),
+                                                                             len(data.y) / min(times)))
+    return {'meta': dict(metadata(), repeat=repeat, seed=seed), 'results': results}
+
+
+def compare(baseline, current, threshold=THRESHOLD, verbose=True):
+    '''
+    Output:
+    - dictionnary key --> ratio of the minimum times (current / baseline) and status (slower, faster, ok)
+      for the benchmarks of both runs, and the keys missing in one of them
+    '''
+    out = {}
+    for key in sorted(set(baseline['results']) & set(current['results'])):
+        base, new = baseline['results'][key], current['results'][key]
+        if 'skipped' in base or 'skipped' in new:
+            continue
+        ratio = new['min'] / base['min']
+        status = 'slower' if ratio > 1 + threshold else 'faster' if ratio < 1 / (1 + threshold) else 'ok'
+        out[key] = {'baseline': base['min'], 'current': new['min'], 'ratio': ratio, 'status': status}
+        if verbose:
+            print('%-45s %8.3f s -> %8.3f s  x%.2f  %s' % (key, base['min'], new['min'], ratio,
+                                                          status.upper() if status == 'slower' else status))
+    missing = sorted(set(baseline['results']) ^ set(current['results']))
+    if verbose and missing:
+        print('only in one of the runs: ' + ', '.join(missing))
+    return {'benchmarks': out, 'missing': missing,
+            'slower': [key for key, value in out.items() if value['status'] == 'slower']}
+
+
+def load(path):
+
+    with open(path) as file:
+        return json.load(file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the feature pipeline on synthetic EEG')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks and save the results')
+    run_parser.add_argument('--hours', type=float, nargs='+', default=[1], help='durations of the synthetic recordings')
+    run_parser.add_argument('--filter', default=None, help='only the benchmarks whose name contains this text')
+    run_parser.add_argument('--repeat', type=int, default=3, help='repetitions of each benchmark')
+    run_parser.add_argument('--data', default=None, help='folder of the synthetic recordings (reused between runs)')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--out', default=None, help='results (json), e.g. a new baseline')
+    run_parser.add_argument('--compare', default=None, help='baseline (json) to compare the results with')
+    run_parser.add_argument('--threshold', type=float, default=THRESHOLD, help='relative slowdown flagged')
+    compare_parser = commands.add_parser('compare', help='compare results with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD, help='relative slowdown flagged')
+    commands.add_parser('list', help='list the benchmarks')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        print('\n'.join(BENCHMARKS))
+        sys.exit(0)
+    if args.command == 'run':
+        names = [name for name in BENCHMARKS if args.filter is None or args.filter in name]
+        current = run(args.hours, names, args.repeat, args.data, args.seed)
+        if args.out:
+            with open(args.out, 'w') as file:
+                json.dump(current, file, indent=1)
+        if args.compare is None:
+            sys.exit(0)
+        baseline = load(args.compare)
+    else:
+        baseline, current = load(args.baseline), load(args.current)
+    result = compare(baseline, current, args.threshold)
+    if result['slower']:
+        print('%d benchmark(s) slower than the baseline by more than %d%%' % (len(result['slower']), 100 * args.threshold))
+    sys.exit(1 if result['slower'] else 0)
@@ -0,0 +1,169 @@
+'''
+Synthetic single channel EEG at realistic scales (1, 8, 24 h at 128 Hz)
+
+The signal is the sum of band limited gaussian noises (shaped in the Fourier
+domain) with the powers of the bands of Compute and a 1/f background. The
+powers drift slowly (one random level every few minutes) so that the states of
+get_state_0_20 change along the recording. Two kinds of events are added:
+- burst-suppression episodes: the signal is attenuated (suppressions of 2-8 s)
+  between bursts of 1-3 s, as detected by detect_suppressions_power
+- artifacts: motion (large slow waves), EMG (high frequency bursts) and
+  electrode pops (steps with an exponential return), as detected by find_artifacts
+
+The positions of the events are returned with the signal (samples), the
+generation is deterministic for a given seed and is done hour by hour so that
+a 24 h signal needs no more memory than the signal itself.
+
+    y, events = synthetic_eeg(8, seed=0)
+    python -m benchmarks.synthetic_eeg 24 --out /tmp/eeg_24h.npy
+'''
+
+import argparse
+import json
+import os
+import numpy as np
+
+FS = 128
+
+# power (uV^2) of the bands of Compute, the 1/f background and the drift (log std) of each band
+BAND_POWERS = {(0.5, 4): 150., (7, 14): 30., (15, 30): 8., (30, 45): 1.}
+BACKGROUND = 20.
+DRIFT = 0.6
+DRIFT_PERIOD = 300   # s between two random levels of the band powers
+
+SUPPRESSION_GAIN = 0.08   # amplitude of the signal during a suppression
+ARTIFACT_KINDS = ['motion', 'emg', 'pop']
+
+
+def shaped_noise(rng, n, fs, band_powers, background):
+    '''
+    sum of band limited noises with the given powers, plus a 1/f background (1 to 45 Hz)
+    '''
+    f = np.fft.rfftfreq(n, 1 / fs)
+    X = np.fft.rfft(rng.standard_normal(n))
+    y = np.zeros(n)
+    components = [(band, power, 1.) for band, power in band_powers.items()]
+    components.append(((1, 45), background, 1 / np.maximum(f, 1)))
+    for (low, high), power, shape in components:
+        component = np.fft.irfft(X * ((f >= low) & (f < high)) * shape, n)
+        y += component * np.sqrt(power / np.mean(component ** 2))
+    return y
+
+
+def drift(rng, n, fs, period, sigma):
+    '''
+    slow multiplicative drift: random log levels every `period` seconds, linearly interpolated
+    '''
+    knots = np.arange(0, n + period * fs, period * fs)
+    return np.exp(np.interp(np.arange(n), knots, sigma * rng.standard_normal(len(knots))))
+
+
+def burst_suppression_envelope(rng, n, fs):
+    '''
+    amplitude of a burst-suppression episode of n samples and the positions of its suppressions
+    '''
+    envelope = np.ones(n)
+    suppressions = []
+    i = int(rng.uniform(1, 3) * fs)
+    while i < n:
+        length = int(rng.uniform(2, 8) * fs)
+        stop = min(n, i + length)
+        envelope[i:stop] = SUPPRESSION_GAIN
+        suppressions.append((i, stop))
+        i = stop + int(rng.uniform(1, 3) * fs)   # burst
+    # ramps of 0.1 s between bursts and suppressions
+    ramp = int(0.1 * fs)
+    return np.convolve(envelope, np.ones(ramp) / ramp, mode='same'), suppressions
+
+
+def artifact(rng, kind, fs):
+    '''
+    waveform (uV) of an artifact
+    '''
+    if kind == 'motion':
+        n = int(rng.uniform(1, 4) * fs)
+        t = np.arange(n) / fs
+        return rng.uniform(300, 800) * np.sin(2 * np.pi * rng.uniform(0.3, 1) * t) * np.hanning(n)
+    if kind == 'emg':
+        n = int(rng.uniform(2, 5) * fs)
+        burst = np.fft.irfft(np.fft.rfft(rng.standard_normal(n)) * (np.fft.rfftfreq(n, 1 / fs) > 30), n)
+        return rng.uniform(50, 150) * burst / np.std(burst) * np.hanning(n)
+    if kind == 'pop':
+        n = int(rng.uniform(1, 2) * fs)
+        return rng.choice([-1, 1]) * rng.uniform(200, 500) * np.exp(-np.arange(n) / (0.2 * fs))
+    raise ValueError('artifact %r is not one of %s' % (kind, ARTIFACT_KINDS))
+
+
+def synthetic_eeg(hours, fs=FS, band_powers=BAND_POWERS, background=BACKGROUND, drift_sigma=DRIFT,
+                  burst_suppression=0.1, artifacts_per_hour=12, artifact_kinds=ARTIFACT_KINDS, seed=0):
+    '''
+    Inputs:
+    - hours               <-- duration of the signal
+    - band_powers         <-- band (Hz) --> power (uV^2) of the band limited noises
+    - background          <-- power of the 1/f background
+    - drift_sigma         <-- log std of the slow drift of each band (0: constant powers)
+    - burst_suppression   <-- proportion of the signal in burst-suppression episodes (10 min each)
+    - artifacts_per_hour  <-- number of artifacts (random kind among artifact_kinds)
+    Outputs:
+    - y       <-- signal (float64, uV)
+    - events  <-- dictionnary 'suppressions', 'burst_suppression' and 'artifacts' --> list of (start, stop, [kind])
+    '''
+    rng = np.random.default_rng(seed)
+    N = int(hours * 3600 * fs)
+    y = np.zeros(N)
+    chunk = 3600 * fs
+    for start in range(0, N, chunk):
+        n = min(chunk, N - start)
+        for band, power in band_powers.items():
+            y[start:start + n] += shaped_noise(rng, n, fs, {band: power}, 0) * drift(rng, n, fs, DRIFT_PERIOD, drift_sigma)
+        y[start:start + n] += shaped_noise(rng, n, fs, {}, background)
+
+    events = {'burst_suppression': [], 'suppressions': [], 'artifacts': []}
+    #--- burst-suppression episodes of 10 min at random positions (not overlapping)
+    episode = 600 * fs
+    n_episodes = int(round(burst_suppression * N / episode))
+    if n_episodes:
+        slots = rng.choice(N // episode, size=min(n_episodes, N // episode), replace=False)
+        for slot in np.sort(slots):
+            start = int(slot * episode)
+            envelope, suppressions = burst_suppression_envelope(rng, episode, fs)
+            y[start:start + episode] *= envelope
+            events['burst_suppression'].append((start, start + episode))
+            events['suppressions'] += [(start + a, start + b) for a, b in suppressions]
+
+    #--- artifacts at random positions
+    n_artifacts = int(round(artifacts_per_hour * hours))
+    for start in np.sort(rng.integers(0, max(1, N - 10 * fs), size=n_artifacts)):
+        kind = str(rng.choice(artifact_kinds))
+        wave = artifact(rng, kind, fs)
+        stop = min(N, int(start) + len(wave))
+        y[start:stop] += wave[:stop - start]
+        events['artifacts'].append((int(start), stop, kind))
+    return y, events
+
+
+def write_recording(path, hours, **kwargs):
+    '''
+    saves a synthetic signal as a recording (.npy) and its events next to it (.json)
+    '''
+    y, events = synthetic_eeg(hours, **kwargs)
+    np.save(path, y)
+    with open(os.path.splitext(path)[0] + '_events.json', 'w') as file:
+        json.dump(events, file)
+    return events
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic EEG recording (.npy)')
+    parser.add_argument('hours', type=float, help='duration (h)')
+    parser.add_argument('--out', required=True, help='path of the recording (.npy)')
+    parser.add_argument('--fs', type=int, default=FS, help='sampling frequency')
+    parser.add_argument('--burst-suppression', type=float, default=0.1, help='proportion of burst-suppression')
+    parser.add_argument('--artifacts', type=float, default=12, help='artifacts per hour')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    events = write_recording(args.out, args.hours, fs=args.fs, burst_suppression=args.burst_suppression,
+                             artifacts_per_hour=args.artifacts, seed=args.seed)
+    print('%s: %d suppressions in %d episodes, %d artifacts' % (args.out, len(events['suppressions']),
+          len(events['burst_suppression']), len(events['artifacts'])))
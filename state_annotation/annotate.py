@@ -0,0 +1,135 @@
+'''
+Headless annotation of recordings with the rule-based states
+
+Each recording goes through the steps of the viewer without Qt: artifact
+detection (and WQN correction with --artifacts), Compute and get_state_0_20.
+The states are written as annotation files (D_<name>.npz of annotation_io) in
+the folder of the viewer, with state_updated = state, so that the viewer opens
+the recording pre-filled. The recordings are computed by the pool of
+batch.run_batch, the features go through the feature cache shared with the
+viewer.
+
+An existing annotation is never replaced, except with --overwrite when it was
+written by this module (an annotation saved from the viewer is always kept).
+
+    python -m state_annotation.annotate recordings_npy --out data_state_annotation --workers 8
+    python -m state_annotation.annotate "recordings_npy/rec_2024*.npy" --artifacts --report annotate_report.json
+'''
+
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+
+from Functions.detect_artifacts import find_artifacts
+from state_annotation.batch import FS, LIST_DETECTION, correct_artifacts, run_batch
+from state_annotation.compute import Compute
+from state_annotation.recording import Recording
+from state_annotation.feature_cache import FeatureCache
+from state_annotation.annotation_io import annotation_path, find_annotation, read_header, recording_stem, save_annotation
+from state_annotation.features import N_STATES, artifact_epochs
+
+SOURCE = 'annotate'   # header field 'source' of the annotations written here
+
+
+def list_recordings(inputs):
+    '''
+    sorted paths of the .npy recordings of folders and glob patterns
+    '''
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.npy')
+        paths.update(path for path in glob.glob(pattern) if path.endswith('.npy'))
+    return sorted(paths)
+
+
+def can_write(out_folder, path, overwrite):
+    '''
+    False if the recording already has an annotation that must be kept
+    '''
+    existing = find_annotation(out_folder, path)
+    if existing is None:
+        return True
+    if not overwrite or not existing.endswith('.npz'):
+        return False
+    return read_header(existing).get('source') == SOURCE
+
+
+def annotate_recording(path, out_folder='data_state_annotation', fs=FS, artifacts=False, overwrite=False, use_cache=True):
+    '''
+    Inputs:
+    - path        <-- .npy recording
+    - out_folder  <-- folder of the annotations
+    - artifacts   <-- when True the states are computed on the signal corrected by WQN
+    - overwrite   <-- replace the annotations written by this module
+    - use_cache   <-- features of the on-disk cache (the ones computed are stored for the viewer)
+    Output:
+    - summary of the recording (samples, epochs, epochs with artifacts, distribution of the states, written)
+    '''
+    name = recording_stem(path)
+    if not can_write(out_folder, path, overwrite):
+        return {'name': name, 'samples': 0, 'epochs': 0, 'written': False}
+
+    # same preprocessing as the viewer so that the epochs match the ones it computes
+    recording = Recording(path, fs)
+    y = recording.signal()
+    index_mask = find_artifacts(y, *LIST_DETECTION)
+    if artifacts:
+        y = correct_artifacts(y, index_mask)
+
+    C = Compute()
+    C.get_data(recording.t, y, fs, Ws = 30 * fs, step = 10 * fs, Ws_line_length = 30 * fs, step_line_length = 10 * fs)
+    if use_cache:
+        preprocessing = {'drop_last': True, 'correct_offset': True}
+        if artifacts:
+            preprocessing['artifacts'] = True
+        FeatureCache().run(C, path, **preprocessing)
+    # without the cache only the features of the state are computed (lazy Compute)
+    state = np.asarray(C.state)
+    artifact = artifact_epochs(index_mask, len(y), C.Ws, C.step, len(state))
+
+    os.makedirs(out_folder, exist_ok=True)
+    save_annotation(annotation_path(out_folder, path), C.t_list, state, state,
+                    fs=fs, Ws=C.Ws, step=C.step, source=SOURCE, artifacts=artifacts)
+    return {'name': name, 'samples': len(recording), 'epochs': len(state), 'artifact_epochs': int(np.sum(artifact)),
+            'states': np.bincount(state.astype(int), minlength=N_STATES).tolist(), 'written': True}
+
+
+def throughput(results, elapsed):
+    '''
+    recordings per minute and samples per second of the annotated recordings
+    '''
+    written = [summary for summary in results.values() if summary['written']]
+    samples = sum(summary['samples'] for summary in written)
+    return {'recordings': len(written), 'skipped': len(results) - len(written), 'samples': samples,
+            'elapsed': elapsed, 'recordings_per_min': 60 * len(written) / elapsed if elapsed else 0.,
+            'samples_per_s': samples / elapsed if elapsed else 0.}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Annotate recordings with the rule-based states (no GUI)')
+    parser.add_argument('inputs', nargs='+', help='folders or glob patterns of .npy recordings')
+    parser.add_argument('--out', default='data_state_annotation', help='folder of the annotations (opened by the viewer)')
+    parser.add_argument('--fs', type=int, default=FS, help='sampling frequency')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (all cores by default)')
+    parser.add_argument('--timeout', type=float, default=600, help='maximal time per recording (s)')
+    parser.add_argument('--artifacts', action='store_true', help='compute the states on the WQN corrected signal')
+    parser.add_argument('--overwrite', action='store_true', help='replace the annotations written by a previous run')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the feature cache')
+    parser.add_argument('--report', default=None, help='report of the run (json)')
+    args = parser.parse_args()
+
+    paths = list_recordings(args.inputs)
+    t_start = time.perf_counter()
+    results, errors = run_batch(annotate_recording, paths, args.workers, args.timeout, out_folder=args.out, fs=args.fs,
+                                artifacts=args.artifacts, overwrite=args.overwrite, use_cache=not args.no_cache)
+    report = throughput(results, time.perf_counter() - t_start)
+    print('%d annotated, %d kept, %d errors: %.1f recordings/min, %.0f samples/s'
+          % (report['recordings'], report['skipped'], len(errors), report['recordings_per_min'], report['samples_per_s']))
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump({**report, 'results': {os.path.basename(path): summary for path, summary in results.items()},
+                       'errors': errors}, file, indent=1)
@@ -0,0 +1,239 @@
+'''
+Versioned annotation format of the state lists
+
+An annotation D_<recording>.npz is an uncompressed .npz of typed arrays:
+- header         <-- JSON (format, version, number of epochs, fields) stored as uint8
+- t0, step       <-- float64, time of the first epoch and time between two epochs
+- t_list         <-- float64, only saved when the epochs are not regularly spaced
+- state          <-- int8, state from get_state_0_20
+- state_updated  <-- int8, state edited by the annotator
+
+The members are not compressed so that a single field can be memory-mapped
+directly from the file (read_field). The legacy pickled dictionaries
+D_<recording>.npy are still read, and can be converted once with:
+
+    python -m state_annotation.annotation_io data_state_annotation/
+'''
+
+import argparse
+import json
+import os
+import zipfile
+import numpy as np
+
+FORMAT = 'eeg-state-annotation'
+VERSION = 1
+EXTENSION = '.npz'
+LEGACY_EXTENSION = '.npy'
+STATE_FIELDS = ['state', 'state_updated']
+
+
+def recording_stem(file_name):
+    '''
+    name of the recording without extension from a recording or annotation file name
+    ex: 'D_rec_20240118_094517.npz' --> 'rec_20240118_094517'
+    '''
+    file_name = os.path.basename(file_name)
+    if file_name.startswith('D_'):
+        file_name = file_name[2:]
+    return os.path.splitext(file_name)[0]
+
+
+def annotation_path(folder, name, legacy=False):
+
+    return os.path.join(folder, 'D_' + recording_stem(name) + (LEGACY_EXTENSION if legacy else EXTENSION))
+
+
+def find_annotation(folder, name):
+    '''
+    path of the annotation of a recording (new format first), None if there is none
+    '''
+    for legacy in (False, True):
+        path = annotation_path(folder, name, legacy)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def list_annotated(folder):
+    '''
+    sorted names (stem) of the recordings that have an annotation in folder
+    '''
+    names = set()
+    for file_name in os.listdir(folder):
+        if file_name.startswith('D_') and os.path.splitext(file_name)[1] in (EXTENSION, LEGACY_EXTENSION):
+            names.add(recording_stem(file_name))
+    return sorted(names)
+
+
+#-------------------------------------------------------------------------------------------#
+#                                        Writing                                            #
+#-------------------------------------------------------------------------------------------#
+
+def to_state_array(state):
+    '''
+    int8 array of the states, raises ValueError if they are not integers
+    '''
+    state = np.asarray(state)
+    state_int = np.rint(state).astype(np.int8)
+    if not np.array_equal(state_int, state):
+        raise ValueError('states must be integers in [-128, 127]')
+    return state_int
+
+
+def save_annotation(path, t_list, state, state_updated, **meta):
+    '''
+    Inputs:
+    - path           <-- path of the .npz file
+    - t_list         <-- time of the epochs
+    - state          <-- state from get_state_0_20
+    - state_updated  <-- state edited by the annotator
+    - meta           <-- json serializable values stored in the header (e.g. fs, Ws, step)
+    '''
+    t_list = np.asarray(t_list, dtype=np.float64)
+    N = len(t_list)
+    t0 = t_list[0] if N else 0.0
+    step = t_list[1] - t_list[0] if N > 1 else 0.0
+    arrays = {'t0': np.float64(t0), 'step': np.float64(step),
+              'state': to_state_array(state), 'state_updated': to_state_array(state_updated)}
+    # the times are only saved when they cannot be recovered exactly from (t0, step)
+    if not np.array_equal(t0 + np.arange(N) * step, t_list):
+        arrays['t_list'] = t_list
+
+    header = {'format': FORMAT, 'version': VERSION, 'n_epochs': N, 'fields': sorted(arrays), **meta}
+    arrays['header'] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+
+    # written next to the file and renamed so that a crash never leaves a partial file
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(tmp, path)
+
+
+#-------------------------------------------------------------------------------------------#
+#                                        Reading                                            #
+#-------------------------------------------------------------------------------------------#
+
+def read_header(path):
+
+    header = json.loads(read_field(path, 'header', mmap=False).tobytes())
+    if header.get('format') != FORMAT or header.get('version', 0) > VERSION:
+        raise ValueError('%s: unsupported annotation format %s v%s' % (path, header.get('format'), header.get('version')))
+    return header
+
+
+def read_field(path, field, mmap=True):
+    '''
+    reads a single array of an annotation, memory-mapped when mmap is True
+    (only the zip entry of this field is read)
+    '''
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(field + '.npy')
+        if not mmap or info.compress_type != zipfile.ZIP_STORED:
+            with archive.open(info) as file:
+                return np.lib.format.read_array(file)
+
+    with open(path, 'rb') as file:
+        # local file header: 30 bytes followed by the file name and the extra field
+        file.seek(info.header_offset + 26)
+        n_name, n_extra = np.frombuffer(file.read(4), dtype='<u2')
+        file.seek(info.header_offset + 30 + int(n_name) + int(n_extra))
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    if shape == () or 0 in shape:
+        return read_field(path, field, mmap=False)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+def get_t_list(path, header=None):
+
+    header = header or read_header(path)
+    if 't_list' in header['fields']:
+        return read_field(path, 't_list', mmap=False)
+    t0 = float(read_field(path, 't0', mmap=False))
+    step = float(read_field(path, 'step', mmap=False))
+    return t0 + np.arange(header['n_epochs']) * step
+
+
+def load_annotation(path):
+    '''
+    Output:
+    - D <-- dictionnary with the keys 't_list', 'state' and 'state_updated' (as the legacy files)
+    '''
+    if path.endswith(LEGACY_EXTENSION):
+        return np.load(path, allow_pickle=True).item()
+    header = read_header(path)
+    D = {'t_list': get_t_list(path, header)}
+    for field in STATE_FIELDS:
+        D[field] = read_field(path, field, mmap=False)
+    return D
+
+
+def load_annotation_corpus(folder, fields=('state_updated',), names=None):
+    '''
+    reads the given fields of all the annotations of a folder
+
+    Outputs:
+    - names    <-- names of the recordings
+    - offsets  <-- epochs of recording k are offsets[k]:offsets[k+1] in the arrays
+    - arrays   <-- dictionnary field --> concatenated array of all the recordings
+    '''
+    names = list_annotated(folder) if names is None else names
+    parts = {field: [] for field in fields}
+    for name in names:
+        path = find_annotation(folder, name)
+        if path.endswith(LEGACY_EXTENSION):
+            D = load_annotation(path)
+            for field in fields:
+                parts[field].append(np.asarray(D[field]))
+        else:
+            for field in fields:
+                parts[field].append(get_t_list(path) if field == 't_list' else read_field(path, field))
+    arrays = {field: np.concatenate(parts[field]) if parts[field] else np.zeros(0) for field in fields}
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    if fields:
+        offsets[1:] = np.cumsum([len(part) for part in parts[fields[0]]])
+    return names, offsets, arrays
+
+
+#-------------------------------------------------------------------------------------------#
+#                                       Migration                                           #
+#-------------------------------------------------------------------------------------------#
+
+def migrate(folder, remove_legacy=False):
+    '''
+    converts the legacy pickled annotations of a folder to the .npz format
+    '''
+    converted = []
+    for file_name in sorted(os.listdir(folder)):
+        if not (file_name.startswith('D_') and file_name.endswith(LEGACY_EXTENSION)):
+            continue
+        legacy_path = os.path.join(folder, file_name)
+        path = annotation_path(folder, file_name)
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(legacy_path):
+            continue   # already converted
+        D = np.load(legacy_path, allow_pickle=True).item()
+        save_annotation(path, D['t_list'], D['state'], D['state_updated'])
+        # check that the conversion is lossless before removing anything
+        D_new = load_annotation(path)
+        for key in ('t_list', 'state', 'state_updated'):
+            if not np.array_equal(np.asarray(D[key], dtype=np.float64), D_new[key]):
+                raise ValueError('%s: %s differs after conversion' % (legacy_path, key))
+        if remove_legacy:
+            os.remove(legacy_path)
+        converted.append(path)
+    return converted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the pickled D_*.npy annotations to the versioned .npz format')
+    parser.add_argument('folders', nargs='+', help='folders of annotations (e.g. data_state_annotation/)')
+    parser.add_argument('--remove-legacy', action='store_true', help='remove the .npy files once converted')
+    args = parser.parse_args()
+    for folder in args.folders:
+        for path in migrate(folder, args.remove_legacy):
+            print('converted', path)
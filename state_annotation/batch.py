@@ -0,0 +1,321 @@
+'''
+Batch feature extraction over the annotated recordings
+
+The recordings are sent to a pool of processes (ProcessPoolExecutor). Each
+worker returns compact numpy arrays (one value per epoch for each feature and
+the annotated state) that are merged once at the end. A recording that fails
+or exceeds its timeout gives an error record (name, error, traceback, elapsed
+time) instead of being silently skipped. When a worker process dies (killed,
+crashed) the pool is restarted and the recordings that were in flight are run
+again one at a time: the one during which the pool breaks again gets the error
+record ('worker died'), the others are computed normally.
+
+    python -m state_annotation.batch data_state_annotation_07_01_2026 --out box_plot_data_07_01_2026/feature_store
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue as queues
+import signal
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+from Functions.detect_artifacts import find_artifacts
+from Functions.WaveletQuantileNormalization import WQN_3
+from Functions.profiling import profile as profile_stages, timed, merge_reports
+from state_annotation.compute import Compute
+from state_annotation.recording import Recording
+from state_annotation.feature_cache import FeatureCache
+from state_annotation.annotation_io import list_annotated, find_annotation, load_annotation
+from state_annotation.features import FEATURE_NAMES, N_STATES, get_features, artifact_epochs, stack_features, group_by_state
+from state_annotation.feature_store import FeatureStoreWriter
+
+FS = 128
+
+# parameters of the artifacts detection and correction
+LIST_DETECTION = [2*FS, 1*FS, [0.0004,0.012], "sym4", 4, "periodization"]
+LIST_WQN = ["sym4", "periodization", 30, 1]
+
+
+#-------------------------------------------------------------------------------------------#
+#                                    Single recording                                       #
+#-------------------------------------------------------------------------------------------#
+
+@timed()
+def correct_artifacts(y, index_mask):
+    '''
+    correction of the detected artifacts with the WQN algorithm
+    '''
+    if len(index_mask) != 0:
+        return WQN_3(y, index_mask, *LIST_WQN)
+    return y
+
+
+def extract_recording(name, annotation_folder='data_state_annotation', recording_folder='recordings_npy',
+                      fs=FS, artifacts=False, use_cache=True, profile=None):
+    '''
+    Inputs:
+    - name               <-- name of the recording (stem of the .npy file)
+    - annotation_folder  <-- folder of the D_ annotations
+    - recording_folder   <-- folder of the recordings
+    - artifacts          <-- when True the features are computed on the signal corrected by WQN
+    - use_cache          <-- reuse the features of the on-disk cache
+    - profile            <-- 'time' or 'memory': report of the stages in 'profile' (Functions/profiling.py)
+    Output:
+    - dictionnary with 'time', 'state', 'state_updated' (int8), 'artifact' (bool)
+      and the features (float32 columns of feature_matrix), one value per epoch
+    '''
+    if profile:
+        with profile_stages(memory=profile == 'memory') as profiler:
+            result = extract_recording(name, annotation_folder, recording_folder, fs, artifacts, use_cache)
+        result['profile'] = profiler.report()
+        return result
+
+    path_annotation = find_annotation(annotation_folder, name)
+    if path_annotation is None:
+        raise FileNotFoundError('no annotation for %s in %s' % (name, annotation_folder))
+    data_states = load_annotation(path_annotation)
+    path = os.path.join(recording_folder, name + '.npy')
+    recording = Recording(path, fs, drop_last=False, correct_offset=False)
+    y = recording.signal()
+    index_mask = find_artifacts(y, *LIST_DETECTION)
+    if artifacts:
+        y = correct_artifacts(y, index_mask)
+
+    C = Compute()
+    C.get_data(recording.t, y, fs, Ws = 30 * fs, step = 10 * fs, Ws_line_length = 30 * fs, step_line_length = 10 * fs)
+    if use_cache:
+        FeatureCache().run(C, path, drop_last=False, correct_offset=False, artifacts=artifacts)
+    else:
+        C.run()
+
+    state_updated = np.asarray(data_states['state_updated'])
+    features = get_features(C)
+    N = len(state_updated)
+    if len(features[FEATURE_NAMES[0]]) != N:
+        raise ValueError('the features have %d epochs, the annotation has %d' % (len(features[FEATURE_NAMES[0]]), N))
+
+    result = {'time': np.asarray(C.t_list, dtype=np.float64), 'state': np.asarray(C.state).astype(np.int8),
+              'state_updated': state_updated.astype(np.int8),
+              'artifact': artifact_epochs(index_mask, len(y), C.Ws, C.step, N)}
+    result.update(features)
+    return result
+
+
+def run_one(fct, item, kwargs):
+    '''
+    runs fct(item, **kwargs) in a worker and returns (item, result, error)
+    '''
+    t0 = time.perf_counter()
+    try:
+        return item, fct(item, **kwargs), None
+    except Exception as e:
+        error = {'name': item, 'error': repr(e), 'traceback': traceback.format_exc(),
+                 'elapsed': time.perf_counter() - t0}
+        return item, None, error
+
+
+#-------------------------------------------------------------------------------------------#
+#                                        Pool                                               #
+#-------------------------------------------------------------------------------------------#
+
+def report_pid(pids):
+    '''
+    initializer of the workers: sends the pid of the worker to the parent process
+    '''
+    pids.put(os.getpid())
+
+
+class Pool:
+    '''
+    ProcessPoolExecutor whose worker processes can be terminated (a running task cannot be cancelled)
+    '''
+
+    def __init__(self, n_workers):
+        self.pids = multiprocessing.Queue()
+        self.executor = ProcessPoolExecutor(max_workers=n_workers, initializer=report_pid, initargs=(self.pids,))
+
+    def submit(self, fct, *args):
+
+        return self.executor.submit(fct, *args)
+
+    def terminate(self):
+
+        while True:
+            try:
+                pid = self.pids.get(timeout=0.1)
+            except queues.Empty:
+                break
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:   # worker already stopped
+                pass
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.pids.close()
+
+
+def run_batch(fct, items, n_workers=None, timeout=None, verbose=True, **kwargs):
+    '''
+    runs fct(item, **kwargs) on every item in a pool of processes
+
+    Inputs:
+    - fct        <-- function (importable from the workers) returning a result per item
+    - items      <-- list of items (e.g. names of the recordings)
+    - n_workers  <-- number of processes (all the cores by default)
+    - timeout    <-- maximal time (s) for an item, counted from its start
+    Outputs:
+    - results    <-- dictionnary item --> result for the items that succeeded
+    - errors     <-- list of error records
+    '''
+    results, errors = {}, []
+    n_items = len(items)
+    t_start = time.perf_counter()
+    n_workers = n_workers or os.cpu_count()
+
+    def record(item, result, error, elapsed):
+        if error is None:
+            results[item] = result
+        else:
+            errors.append(error)
+        if verbose:
+            print('[%d/%d] %s %s (%.1f s)' % (len(results) + len(errors), n_items, item,
+                                              'ok' if error is None else 'failed: ' + error['error'], elapsed))
+
+    pool = Pool(n_workers)
+    pending = {}
+    queue = list(items)
+    suspects = []   # items in flight when a worker died, run again one at a time
+    try:
+        # only n_workers items are submitted at once so that the start time of an item is known
+        while queue or pending or suspects:
+            if suspects:
+                if not pending:
+                    item = suspects.pop(0)
+                    pending[pool.submit(run_one, fct, item, kwargs)] = (item, time.perf_counter())
+            else:
+                while queue and len(pending) < n_workers:
+                    item = queue.pop(0)
+                    pending[pool.submit(run_one, fct, item, kwargs)] = (item, time.perf_counter())
+            alone = len(pending) == 1   # when the pool breaks, the item in flight killed its worker
+            done, _ = wait(pending, timeout=1 if timeout else None, return_when=FIRST_COMPLETED)
+            now = time.perf_counter()
+            broken = []
+            for future in done:
+                item, t0 = pending.pop(future)
+                try:
+                    item, result, error = future.result()
+                except BrokenProcessPool:
+                    broken.append((item, t0, traceback.format_exc()))
+                    continue
+                record(item, result, error, now - t0)
+
+            if broken:
+                # a worker died (killed, crashed): the pool is unusable and every item in flight failed with it
+                broken += [(item, t0, '') for item, t0 in pending.values()]
+                pending = {}
+                for item, t0, trace in broken:
+                    if alone:
+                        record(item, None, {'name': item, 'error': 'worker died', 'traceback': trace, 'elapsed': now - t0}, now - t0)
+                    else:
+                        suspects.append(item)
+                pool.terminate()
+                pool = Pool(n_workers)
+                continue
+
+            late = [future for future, (item, t0) in pending.items() if timeout and now - t0 > timeout]
+            if late:
+                for future in late:
+                    item, t0 = pending.pop(future)
+                    errors.append({'name': item, 'error': 'timeout', 'traceback': '', 'elapsed': now - t0})
+                    if verbose:
+                        print('[%d/%d] %s failed: timeout after %.0f s' % (len(results) + len(errors), n_items, item, timeout))
+                # a running task cannot be cancelled: the pool is restarted and the other running items resubmitted
+                queue = [item for item, _ in pending.values()] + queue
+                pending = {}
+                pool.terminate()
+                pool = Pool(n_workers)
+    finally:
+        pool.terminate()
+
+    if verbose:
+        print('%d/%d recordings in %.1f s, %d errors' % (len(results), n_items, time.perf_counter() - t_start, len(errors)))
+    return results, errors
+
+
+def merge_results(results, names=None):
+    '''
+    concatenates the arrays of the results
+
+    Outputs:
+    - merged   <-- dictionnary key --> concatenated array
+    - offsets  <-- epochs of recording k are offsets[k]:offsets[k+1]
+    '''
+    names = sorted(results) if names is None else [name for name in names if name in results]
+    keys = ['time', 'state', 'state_updated', 'artifact'] + FEATURE_NAMES
+    merged = {key: np.concatenate([results[name][key] for name in names]) if names else np.zeros(0) for key in keys}
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(results[name]['state_updated']) for name in names])
+    return merged, offsets
+
+
+def write_store(results, names, folder):
+    '''
+    writes the results in a columnar feature store, recording by recording
+    '''
+    with FeatureStoreWriter(folder) as writer:
+        for name in names:
+            if name in results:
+                writer.append(name, results[name])
+
+
+def to_box_plot_dict(merged):
+    '''
+    dictionnary D['D_' + feature][state] = values (format of the former box_plot_data D.npy,
+    the lists are replaced by contiguous float32 slices of the matrix grouped by state)
+
+    Input:
+    - merged <-- dictionnary with 'state_updated' and the features (e.g. merge_results or FeatureStore.select)
+    '''
+    X_state, offsets = group_by_state(merged['state_updated'], stack_features(merged))
+    D = {}
+    for k, feature in enumerate(FEATURE_NAMES):
+        D['D_' + feature] = {i: X_state[offsets[i]:offsets[i + 1], k] for i in range(N_STATES)}
+    return D
+
+
+def save_errors(errors, path):
+
+    with open(path, 'w') as file:
+        json.dump(errors, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the features of the annotated recordings for the box plots')
+    parser.add_argument('folder', help='folder listing the annotated recordings (D_ files)')
+    parser.add_argument('--annotations', default='data_state_annotation', help='folder of the annotations')
+    parser.add_argument('--recordings', default='recordings_npy', help='folder of the recordings')
+    parser.add_argument('--out', default='box_plot_data_07_01_2026/feature_store', help='output feature store (folder)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (all cores by default)')
+    parser.add_argument('--timeout', type=float, default=600, help='maximal time per recording (s)')
+    parser.add_argument('--artifacts', action='store_true', help='compute the features on the WQN corrected signal')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the feature cache')
+    parser.add_argument('--profile', choices=['time', 'memory'], default=None,
+                        help='time (and peak memory) per stage of each recording, in <out>_profile.json (implies --no-cache)')
+    args = parser.parse_args()
+
+    names = list_annotated(args.folder)
+    results, errors = run_batch(extract_recording, names, args.workers, args.timeout,
+                                annotation_folder=args.annotations, recording_folder=args.recordings,
+                                artifacts=args.artifacts, use_cache=not (args.no_cache or args.profile), profile=args.profile)
+    write_store(results, names, args.out)
+    if args.profile:
+        reports = {name: results[name]['profile'] for name in names if name in results}
+        with open(args.out.rstrip('/') + '_profile.json', 'w') as file:
+            json.dump({'corpus': merge_reports(list(reports.values())), 'recordings': reports}, file, indent=1)
+    if errors:
+        save_errors(errors, args.out.rstrip('/') + '_errors.json')
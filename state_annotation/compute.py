@@ -1,14 +1,84 @@
+import threading
 import numpy as np
 from Functions.filter import get_filtered_signal
 import Functions.sliding_fct as sliding
 from Functions.compute_state import get_state_0_20
+from Functions.profiling import timed
+
+# frequency bands of the powers (delta, alpha, beta, gamma)
+BANDS = [[0.5,4],[7,14],[15,30],[30,45]]
+
+# how the states of the channels are combined in one state (get_aggregated_state)
+AGGREGATES = ['median', 'min', 'max', 'features']
+
+# precision policy: dtype of the signal, of the filtered signals and of the features
+# (float32 halves the memory and bandwidth, validated by state_annotation/precision_report.py)
+PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+
+# feature --> method computing it (with the other features of the same method), in the order of evaluate()
+# the features are computed on first access and kept until the next get_data, a method reads the
+# features it depends on as attributes so that only them are computed (C.state: power and suppressions)
+GETTERS = {'t_list': 'get_power', 'P_signals': 'get_power', 'prop_P_signals': 'get_power_prop',
+           'IES_prop': 'get_supp_ratio', 'alpha_supp_prop': 'get_supp_ratio', 'supp': 'get_supp_ratio',
+           'state': 'get_state', 'state_aggregated': 'get_aggregated_state',
+           'be': 'get_be', 'entropy': 'get_entropy', 't_line_length': 'get_line_length', 'line_length': 'get_line_length',
+           'freqs_quantiles': 'get_freqs_quantiles', 'f_central': 'get_f_main'}
 
 class Compute:
 
     def __init__(self):
         super().__init__()
-
-    def get_data(self, t, y, fs, Ws, step, Ws_line_length, step_line_length):
+        # a feature is computed once when it is read from several threads (see evaluate)
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        '''
+        the lock cannot be pickled (copy.deepcopy, pool of processes): it is dropped and recreated
+        '''
+        state = self.__dict__.copy()
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        '''
+        called for the attributes not set yet: computes a feature of GETTERS on first access
+        '''
+        if name not in GETTERS or 'y' not in self.__dict__:
+            raise AttributeError('%r object has no attribute %r' % (type(self).__name__, name))
+        with self._lock:
+            if name not in self.__dict__:   # computed meanwhile by another thread
+                getattr(self, GETTERS[name])()
+        return self.__dict__[name]
+
+    def evaluate(self, names=GETTERS):
+        '''
+        computes the features not computed yet (all of them by default), e.g. in a background thread
+        while the first ones are displayed
+        '''
+        for name in names:
+            if name == 'state_aggregated' and (self.aggregate is None or np.ndim(self.y) != 2):
+                continue
+            getattr(self, name)
+
+    def get_data(self, t, y, fs, Ws, step, Ws_line_length, step_line_length, bands=BANDS, aggregate=None, precision='float64'):
+        '''
+        t can be a time array or an implicit TimeAxis (see state_annotation/recording.py),
+        it is only indexed to get the time of the end of each window
+
+        y can be 1D or (channels, N): all the channels are computed at once and every feature
+        gets an axis of channels before the axis of the windows (P_signals: (bands, channels, windows)),
+        the state is computed per channel and combined in state_aggregated if aggregate is one of AGGREGATES
+
+        precision is one of PRECISIONS, an array y of another dtype is converted
+        '''
+        if precision not in PRECISIONS:
+            raise ValueError('precision %r is not one of %s' % (precision, list(PRECISIONS)))
+        if isinstance(y, np.ndarray) and y.dtype != PRECISIONS[precision]:
+            y = y.astype(PRECISIONS[precision])
 
         self.t = t
         self.y = y 
@@ -17,56 +87,90 @@ class Compute:
         self.step = step
         self.Ws_line_length = Ws_line_length
         self.step_line_length = step_line_length
-
+        self.bands = bands
+        self.aggregate = aggregate
+        self.precision = precision
+        # features of the previous data
+        for name in GETTERS:
+            self.__dict__.pop(name, None)
+
+    @timed()
     def get_power(self):
 
-        signals = get_filtered_signal(self.y, self.fs, [[0.5,4],[7,14],[15,30],[30,45]])
+        signals = get_filtered_signal(self.y, self.fs, self.bands)
         self.t_list, self.P_signals = sliding.power_nD(signals, self.t, self.Ws, self.step)
 
+    @timed()
     def get_power_prop(self):
 
         self.prop_P_signals = self.P_signals / np.sum(self.P_signals, axis = 0)
 
+    @timed()
     def get_supp_ratio(self):
 
         self.IES_prop, self.alpha_supp_prop = sliding.supp_power_prop(self.y, self.t, self.Ws, self.step, self.fs)[-2:]
         self.supp = self.alpha_supp_prop + 2 * self.IES_prop
 
+    @timed()
     def get_be(self):
 
         self.be = sliding.compute_block_entropy_k(self.y, self.t, self.Ws, self.step)[-1]
 
+    @timed()
     def get_entropy(self):
 
         self.entropy = sliding.compute_entropy(self.y, self.t, self.Ws, self.step)[-1]
 
+    @timed()
     def get_line_length(self):
 
         self.t_line_length, self.line_length = sliding.compute_line_length(self.y, self.t, self.Ws_line_length, self.step_line_length)
 
+    @timed()
     def get_freqs_quantiles(self):
 
         self.freqs_quantiles = sliding.compute_freqs_quantiles(self.y, self.t, self.Ws, self.step, self.fs)[-1]
 
+    @timed()
     def get_f_main(self):
 
         self.f_central = sliding.compute_central_frequency(self.y, self.t, self.fs, self.Ws, self.step)[-1]
 
+    @timed()
     def get_state(self):
 
         N = len(self.t_list)
-        self.state = np.zeros(N)
-        for i in range(N):
-            self.state[i] = get_state_0_20(self.supp[i], self.prop_P_signals[:, i])
+        state = np.zeros(np.shape(self.supp)[:-1] + (N,))
+        for index in np.ndindex(state.shape):
+            state[index] = get_state_0_20(self.supp[index], self.prop_P_signals[(slice(None),) + index])
+        # set once complete (read by other threads)
+        self.state = state
+
+    @timed()
+    def get_aggregated_state(self, how=None):
+        '''
+        one state per window from the states of the channels (how: aggregate of get_data, median by default)
+        - median    <-- lower median of the states of the channels
+        - min, max  <-- deepest, lightest state of the channels
+        - features  <-- state of the suppressions and powers averaged over the channels
+        '''
+        how = how or self.aggregate or 'median'
+        if how == 'median':
+            self.state_aggregated = np.quantile(self.state, 0.5, axis=0, method='lower')
+        elif how == 'min':
+            self.state_aggregated = np.min(self.state, axis=0)
+        elif how == 'max':
+            self.state_aggregated = np.max(self.state, axis=0)
+        elif how == 'features':
+            supp = np.mean(self.supp, axis=0)
+            P = np.mean(self.P_signals, axis=1)
+            prop = P / np.sum(P, axis=0)
+            self.state_aggregated = np.array([get_state_0_20(supp[i], prop[:, i]) for i in range(len(supp))])
+        else:
+            raise ValueError('aggregate %r is not one of %s' % (how, AGGREGATES))
 
     def run(self):
-
-        self.get_power()
-        self.get_power_prop()
-        self.get_supp_ratio()
-        self.get_be()
-        self.get_entropy()
-        self.get_line_length()
-        self.get_freqs_quantiles()
-        self.get_f_main()
-        self.get_state()
\ No newline at end of file
+        '''
+        computes all the features (the ones already read are kept)
+        '''
+        self.evaluate()
@@ -0,0 +1,176 @@
+'''
+Persistent cache of the features computed by Compute
+
+An entry is keyed by a content hash of the recording (.npy file) and a hash of
+the parameters (fs, Ws, step, Ws_line_length, step_line_length, preprocessing)
+and of CODE_VERSION. Each entry is a folder with one .npy per Compute attribute,
+loaded back memory-mapped. When the cache grows above max_bytes the least
+recently used entries are removed.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import numpy as np
+
+# to increment when the computation of the features changes so that old entries are not reused
+CODE_VERSION = 1
+
+# attributes of Compute stored in an entry
+FEATURES = ['t_list', 'P_signals', 'prop_P_signals', 'IES_prop', 'alpha_supp_prop', 'supp',
+            'be', 'entropy', 't_line_length', 'line_length', 'freqs_quantiles', 'f_central', 'state']
+
+# content hashes already computed in this process: (path, size, mtime) -> hash
+_content_hashes = {}
+
+
+def content_hash(path, chunk_size=2**20):
+    '''
+    sha1 of the content of a file, read chunk by chunk
+    '''
+    stat = os.stat(path)
+    id_file = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if id_file not in _content_hashes:
+        h = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                h.update(chunk)
+        _content_hashes[id_file] = h.hexdigest()
+    return _content_hashes[id_file]
+
+
+def params_hash(params):
+    '''
+    sha1 of the parameters (dict of json serializable values) and of the code version
+    '''
+    text = json.dumps({'code_version': CODE_VERSION, **params}, sort_keys=True, default=float)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def compute_params(C, **preprocessing):
+    '''
+    parameters of a Compute object that change its features
+    '''
+    params = {'fs': C.fs, 'Ws': C.Ws, 'step': C.step,
+              'Ws_line_length': C.Ws_line_length, 'step_line_length': C.step_line_length, 'bands': C.bands}
+    # only when not the default, so that the float64 entries keep their key
+    if getattr(C, 'precision', 'float64') != 'float64':
+        params['precision'] = C.precision
+    params.update(preprocessing)
+    return params
+
+
+class FeatureCache:
+    '''
+    Inputs:
+    - folder     <-- folder of the cache entries
+    - max_bytes  <-- maximal size of the cache on disk
+    '''
+
+    def __init__(self, folder='feature_cache/', max_bytes=2 * 2**30):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def key(self, path, params):
+
+        return content_hash(path)[:20] + '_' + params_hash(params)[:20]
+
+    def entry_path(self, key):
+
+        return os.path.join(self.folder, key)
+
+    def load(self, key, C):
+        '''
+        sets the cached features as attributes of C, returns False if there is no entry
+        '''
+        entry = self.entry_path(key)
+        if not os.path.isfile(os.path.join(entry, 'params.json')):
+            return False
+        try:
+            features = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in FEATURES}
+        except (OSError, ValueError):   # incomplete or corrupted entry
+            shutil.rmtree(entry, ignore_errors=True)
+            return False
+        for name, value in features.items():
+            setattr(C, name, value)
+        os.utime(entry)  # marks the entry as recently used
+        return True
+
+    def store(self, key, C, params):
+        '''
+        writes the features of C in a temporary folder renamed once complete
+        '''
+        entry = self.entry_path(key)
+        tmp = entry + '.tmp%d' % os.getpid()
+        os.makedirs(tmp, exist_ok=True)
+        for name in FEATURES:
+            np.save(os.path.join(tmp, name + '.npy'), np.asarray(getattr(C, name)))
+        with open(os.path.join(tmp, 'params.json'), 'w') as file:
+            json.dump({'code_version': CODE_VERSION, **params}, file, default=float)
+        try:
+            os.replace(tmp, entry)
+        except OSError:  # entry written meanwhile by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def run(self, C, path, background=False, **preprocessing):
+        '''
+        loads the features of C from the cache or runs C and stores them
+
+        Inputs:
+        - C              <-- Compute object on which get_data was already called
+        - path           <-- path of the .npy recording C was given
+        - background     <-- if not cached, the features are evaluated by a thread and stored once complete,
+                             the ones read meanwhile are computed on demand (Compute.evaluate)
+        - preprocessing  <-- options applied to the recording before C (e.g. drop_last, correct_offset)
+        Output:
+        - the thread evaluating the features (None when they were cached or background is False)
+        '''
+        params = compute_params(C, **preprocessing)
+        key = self.key(path, params)
+        if self.load(key, C):
+            return None
+        if not background:
+            self.complete(key, C, params)
+            return None
+        thread = threading.Thread(target=self.complete, args=(key, C, params), daemon=True)
+        thread.start()
+        return thread
+
+    def complete(self, key, C, params):
+
+        C.run()
+        self.store(key, C, params)
+
+    def entries(self):
+        '''
+        list of (last use, size, path) of the entries
+        '''
+        if not os.path.isdir(self.folder):
+            return []
+        L = []
+        for name in os.listdir(self.folder):
+            entry = self.entry_path(name)
+            if not os.path.isdir(entry) or '.tmp' in name:
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry))
+            L.append((os.stat(entry).st_mtime, size, entry))
+        return L
+
+    def evict(self):
+        '''
+        removes the least recently used entries until the cache is below max_bytes
+        '''
+        L = sorted(self.entries())
+        total = sum(size for _, size, _ in L)
+        for _, size, entry in L:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
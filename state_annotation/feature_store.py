@@ -0,0 +1,184 @@
+'''
+Columnar store of the features of the annotated epochs (replaces the dict-of-lists D.npy)
+
+One row per epoch with the columns:
+- recording_id   <-- int32, index in meta['recordings']
+- time           <-- float64, time of the end of the window
+- state          <-- int8, state from get_state_0_20
+- state_updated  <-- int8, state of the annotator
+- artifact       <-- bool, an artifact was detected in the window
+- features       <-- float32 matrix (n_rows, n_features) in Fortran order, so
+                     that each feature column is contiguous on disk
+
+Every column is a .npy file of the store folder and is opened memory-mapped,
+so a column or a set of rows can be read without loading the whole store and
+(X, y) for the classifier are views of the files (no copy).
+Rows are appended recording by recording in temporary column files and
+packed into the .npy files on close.
+'''
+
+import json
+import os
+import shutil
+import numpy as np
+
+from state_annotation.features import FEATURE_NAMES
+
+VERSION = 1
+COLUMNS = {'recording_id': np.int32, 'time': np.float64, 'state': np.int8, 'state_updated': np.int8, 'artifact': np.bool_}
+
+
+def write_npy_from_parts(path, parts, dtype, n_rows, fortran_order=False):
+    '''
+    writes a .npy file whose data is the concatenation of raw binary files (copied chunk by chunk)
+    '''
+    n_columns = len(parts) if fortran_order else None
+    shape = (n_rows, n_columns) if fortran_order else (n_rows,)
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': fortran_order, 'shape': shape}
+    with open(path, 'wb') as file:
+        np.lib.format.write_array_header_1_0(file, header)
+        for part in parts:
+            with open(part, 'rb') as file_part:
+                shutil.copyfileobj(file_part, file, 2**20)
+
+
+class FeatureStoreWriter:
+    '''
+    Inputs:
+    - folder    <-- folder of the store (replaced on close)
+    - features  <-- names of the feature columns
+    '''
+
+    def __init__(self, folder, features=FEATURE_NAMES):
+        self.folder = folder
+        self.features = list(features)
+        self.tmp = folder.rstrip('/') + '.tmp'
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        os.makedirs(self.tmp)
+        self.files = {column: open(self.part(column), 'wb') for column in list(COLUMNS) + self.features}
+        self.recordings = []
+        self.n_rows = 0
+
+    def part(self, column):
+
+        return os.path.join(self.tmp, column + '.part')
+
+    def append(self, name, columns):
+        '''
+        appends the epochs of a recording
+
+        Inputs:
+        - name     <-- name of the recording
+        - columns  <-- dictionnary column --> 1D array (one value per epoch) for every column of COLUMNS
+                       and every feature, 'recording_id' is set here
+        '''
+        missing = [column for column in list(COLUMNS) + self.features if column != 'recording_id' and column not in columns]
+        if missing:
+            raise KeyError('recording %r has no column %s' % (name, ', '.join(missing)))
+        n = len(columns['state_updated'])
+        recording_id = len(self.recordings)
+        self.recordings.append(name)
+        columns = dict(columns, recording_id=np.full(n, recording_id))
+        for column, dtype in COLUMNS.items():
+            self.files[column].write(np.ascontiguousarray(columns[column], dtype=dtype).tobytes())
+        for feature in self.features:
+            self.files[feature].write(np.ascontiguousarray(columns[feature], dtype=np.float32).tobytes())
+        self.n_rows += n
+
+    def close(self):
+        '''
+        packs the column files into the .npy files of the store
+        '''
+        for file in self.files.values():
+            file.close()
+        for column, dtype in COLUMNS.items():
+            write_npy_from_parts(os.path.join(self.tmp, column + '.npy'), [self.part(column)], dtype, self.n_rows)
+        write_npy_from_parts(os.path.join(self.tmp, 'features.npy'), [self.part(f) for f in self.features],
+                             np.float32, self.n_rows, fortran_order=True)
+        for column in list(COLUMNS) + self.features:
+            os.remove(self.part(column))
+        meta = {'version': VERSION, 'n_rows': self.n_rows, 'features': self.features, 'recordings': self.recordings}
+        with open(os.path.join(self.tmp, 'meta.json'), 'w') as file:
+            json.dump(meta, file, indent=1)
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.replace(self.tmp, self.folder)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for file in self.files.values():
+                file.close()
+            shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class FeatureStore:
+    '''
+    Read access to a store, every column is memory-mapped
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, 'meta.json')) as file:
+            self.meta = json.load(file)
+        if self.meta['version'] > VERSION:
+            raise ValueError('%s: unsupported feature store version %s' % (folder, self.meta['version']))
+        self.features = self.meta['features']
+        self.recordings = self.meta['recordings']
+        self.n_rows = self.meta['n_rows']
+        self._columns = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def X(self):
+        '''
+        (n_rows, n_features) float32 memmap
+        '''
+        return self.column('features')
+
+    def column(self, name):
+        '''
+        memmap of a column (a feature name gives its column of X)
+        '''
+        if name in self.features:
+            return self.X[:, self.features.index(name)]
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.folder, name + '.npy'), mmap_mode='r')
+        return self._columns[name]
+
+    def rows(self, states=None, recordings=None, artifact=None, label='state_updated'):
+        '''
+        indices of the rows with the given states / recordings / artifact flag
+        '''
+        mask = np.ones(self.n_rows, dtype=bool)
+        if states is not None:
+            mask &= np.isin(self.column(label), list(states))
+        if recordings is not None:
+            ids = [self.recordings.index(name) for name in recordings]
+            mask &= np.isin(self.column('recording_id'), ids)
+        if artifact is not None:
+            mask &= self.column('artifact') == artifact
+        return np.flatnonzero(mask)
+
+    def select(self, columns, **kwargs):
+        '''
+        dictionnary column --> values of the selected rows (only these columns are read)
+        '''
+        if not kwargs:
+            return {name: self.column(name) for name in columns}
+        index = self.rows(**kwargs)
+        return {name: np.asarray(self.column(name)[index]) for name in columns}
+
+    def Xy(self, label='state_updated', **kwargs):
+        '''
+        (X, y) for the classifier: views of the files without selection, copies of the selected rows otherwise
+        '''
+        if not kwargs:
+            return self.X, self.column(label)
+        index = self.rows(label=label, **kwargs)
+        return np.asarray(self.X[index]), np.asarray(self.column(label)[index])
@@ -0,0 +1,154 @@
+'''
+Features of the box plots (one value per epoch) computed from a Compute object
+'''
+
+import numpy as np
+
+from Functions.jit import kernel
+
+# names of the features, the box plot dictionnaries use 'D_' + name as key
+FEATURE_NAMES = ['prop_delta', 'prop_alpha', 'prop_beta', 'prop_gamma',
+                 'alpha_delta', 'beta_delta', 'gamma_delta', 'beta_alpha', 'gamma_alpha', 'gamma_beta', 'hf_lf',
+                 '50_q', '75_q', '85_q', '95_q',
+                 'supp', 'line_length', 'entropy', 'be', 'f_central']
+
+N_STATES = 22
+
+# name of the file of each feature in box_plot_data/ (when it is not the feature name)
+FILE_NAMES = {'50_q': 'f_50_q', '75_q': 'f_75_q', '85_q': 'f_85_q', '95_q': 'f_95_q'}
+
+
+# ratios of the band proportions: name --> (rows of the numerator, rows of the denominator) in C.prop_P_signals
+RATIOS = {'alpha_delta': ([1], [0]), 'beta_delta': ([2], [0]), 'gamma_delta': ([-1], [0]),
+          'beta_alpha': ([2], [1]), 'gamma_alpha': ([-1], [1]), 'gamma_beta': ([-1], [2]),
+          'hf_lf': ([-1, 2], [1, 0])}
+
+
+def feature_matrix(C, names=FEATURE_NAMES):
+    '''
+    Input:
+    - C      <-- Compute object after run()
+    - names  <-- names of the features (columns)
+    Output:
+    - X      <-- float32 matrix (n_epochs, n_features) in Fortran order (each feature column is contiguous),
+                 the ratios are computed directly into their column
+    '''
+    P = np.asarray(C.prop_P_signals, dtype=np.float32)
+    columns = {'prop_delta': P[0], 'prop_alpha': P[1], 'prop_beta': P[2], 'prop_gamma': P[-1],
+               '50_q': C.freqs_quantiles[0], '75_q': C.freqs_quantiles[1],
+               '85_q': C.freqs_quantiles[2], '95_q': C.freqs_quantiles[-1],
+               'supp': C.supp, 'line_length': C.line_length, 'entropy': C.entropy, 'be': C.be,
+               'f_central': C.f_central}
+
+    n = P.shape[1]
+    X = np.empty((n, len(names)), dtype=np.float32, order='F')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k, name in enumerate(names):
+            if name in RATIOS:
+                numerator, denominator = RATIOS[name]
+                np.divide(P[numerator].sum(axis=0), P[denominator].sum(axis=0), out=X[:, k])
+                continue
+            values = np.asarray(columns[name])
+            if len(values) != n:
+                raise ValueError('%s has %d epochs, the band proportions have %d' % (name, len(values), n))
+            X[:, k] = values
+    return X
+
+
+def get_features(C):
+    '''
+    Input:
+    - C  <-- Compute object after run()
+    Output:
+    - dictionnary feature name --> 1D float32 array (one value per epoch, column of feature_matrix)
+    '''
+    X = feature_matrix(C)
+    return {name: X[:, k] for k, name in enumerate(FEATURE_NAMES)}
+
+
+def stack_features(columns, names=FEATURE_NAMES):
+    '''
+    float32 matrix (n_rows, n_features) in Fortran order from a dictionnary feature name --> 1D array
+    '''
+    n = len(columns[names[0]]) if names else 0
+    X = np.empty((n, len(names)), dtype=np.float32, order='F')
+    for k, name in enumerate(names):
+        X[:, k] = columns[name]
+    return X
+
+
+def group_by_state(state, X, n_states=N_STATES):
+    '''
+    groups the rows of X by state with a single stable sort
+
+    Inputs:
+    - state    <-- state of each row (rows with a state outside [0, n_states) are dropped)
+    - X        <-- matrix (n_rows, n_features)
+    Outputs:
+    - X_state  <-- rows of X sorted by state (original order kept within a state), Fortran order
+    - offsets  <-- rows of state i are X_state[offsets[i]:offsets[i+1]]
+    '''
+    state = np.asarray(state).astype(np.intp)
+    valid = (state >= 0) & (state < n_states)
+    index = np.arange(len(state)) if valid.all() else np.flatnonzero(valid)
+    order = index[np.argsort(state[index], kind='stable')]
+    offsets = np.zeros(n_states + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(state[index], minlength=n_states))
+    X_state = np.empty((len(order), X.shape[1]), dtype=X.dtype, order='F')
+    for k in range(X.shape[1]):
+        np.take(X[:, k], order, out=X_state[:, k])
+    return X_state, offsets
+
+
+def artifact_epochs(index_mask, N, Ws, step, n_epochs):
+    '''
+    flag of the windows (start i*step, length Ws) that overlap an artifact
+
+    Inputs:
+    - index_mask  <-- output of find_artifacts (start and end of each artifact)
+    - N           <-- number of samples of the signal
+    Output:
+    - boolean array of length n_epochs
+    '''
+    mask = np.zeros(N + 1, dtype=np.int32)
+    for k in range(0, len(index_mask) - 1, 2):
+        mask[index_mask[k]:index_mask[k + 1] + 1] = 1
+    count = np.concatenate(([0], np.cumsum(mask)))
+    start = np.arange(n_epochs) * step
+    stop = np.minimum(start + Ws, N)
+    return count[stop] - count[start] > 0
+
+
+def smooth_last3(arr):
+    """Smooth a 1D array using the average of the last 3 values (including current).
+    Handles edge cases at the start."""
+    arr = np.asarray(arr, dtype=float)
+
+    return trailing_mean3(arr)
+
+
+def trailing_mean3_numpy(arr):
+    '''
+    mean of arr[i-2:i+1] at each position i (of the available values at the start)
+    '''
+    smoothed = arr.copy()
+    if len(arr) > 1:
+        smoothed[1] = (arr[0] + arr[1]) / 2
+    # sums of the shifted arrays (same order of the additions as np.mean)
+    smoothed[2:] = (arr[:-2] + arr[1:-1] + arr[2:]) / 3
+
+    return smoothed
+
+
+@kernel(trailing_mean3_numpy)
+def trailing_mean3(arr):
+    '''
+    mean of arr[i-2:i+1] at each position i (of the available values at the start)
+    '''
+    smoothed = arr.copy()
+    if len(arr) > 1:
+        smoothed[1] = (arr[0] + arr[1]) / 2
+    for i in range(2, len(arr)):
+        smoothed[i] = (arr[i - 2] + arr[i - 1] + arr[i]) / 3
+
+    return smoothed
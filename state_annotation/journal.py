@@ -0,0 +1,273 @@
+'''
+Append-only journal of the edits of the state list
+
+Every edit of the annotation (drag of a point or group move) is appended to a
+small binary file as runs of (start, stop, old value, new value) followed by a
+commit record. The file is flushed on every edit and fsynced by batches, so a
+crash loses at most the last non committed edit. Reopening the recording
+replays the journal on the saved state list, and the undo/redo stacks are
+rebuilt from it. Compaction writes the main annotation file and restarts the
+journal with the undo history only.
+
+File layout:
+- header  <-- b'EEGJ', version (uint16), length of the state list (uint32)
+- records <-- op (uint8), start (uint32), stop (uint32), old (int8), new (int8)
+'''
+
+import os
+import struct
+import time
+import numpy as np
+
+MAGIC = b'EEGJ'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+RECORD = struct.Struct('<BIIbb')
+
+# record types
+OP_RUN = 0      # run of an edit not yet committed
+OP_COMMIT = 1   # end of an edit
+OP_UNDO = 2
+OP_REDO = 3
+OP_HISTORY = 4  # run of an edit already applied to the main file (kept for undo)
+OP_HISTORY_COMMIT = 5
+
+
+def get_runs(indices, old, new):
+    '''
+    splits an edit into runs of contiguous indices with the same old value
+
+    Inputs:
+    - indices <-- positions changed (sorted)
+    - old     <-- values before the edit at these positions
+    - new     <-- value after the edit
+    Outputs:
+    - runs    <-- list of (start, stop, old, new), stop excluded
+    '''
+    runs = []
+    for index, value in zip(indices, old):
+        index, value = int(index), int(value)
+        if runs and runs[-1][1] == index and runs[-1][2] == value:
+            runs[-1][1] = index + 1
+        else:
+            runs.append([index, index + 1, value, int(new)])
+    return [tuple(run) for run in runs]
+
+
+def apply_runs(state, runs, undo=False):
+    '''
+    sets the new values of the runs in state (or the old ones when undo is True)
+    '''
+    for start, stop, old, new in runs:
+        state[start:stop] = old if undo else new
+
+
+class EditJournal:
+    '''
+    Inputs:
+    - path           <-- path of the journal file
+    - N              <-- length of the state list
+    - sync_every     <-- number of records written before a fsync
+    - sync_interval  <-- maximal time (s) between a write and its fsync
+    - max_history    <-- number of edits kept in the undo stack
+    '''
+
+    def __init__(self, path, N, sync_every=64, sync_interval=1.0, max_history=1000):
+        self.path = path
+        self.N = N
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.max_history = max_history
+        self.undo_stack = []
+        self.redo_stack = []
+        self.n_edits = 0       # edits written since the last compaction
+        self.pending = 0       # records written since the last fsync
+        self.last_sync = time.monotonic()
+        self.file = None
+
+    #-------------------------------------------------------#
+    #-------------------- open / replay --------------------#
+    #-------------------------------------------------------#
+
+    def open(self, state):
+        '''
+        replays the existing journal on state (in place) and opens it for appending
+
+        Output:
+        - number of edits replayed
+        '''
+        n_replayed = 0
+        if os.path.isfile(self.path):
+            n_replayed, valid_size = self.replay(state)
+            if valid_size is None:   # journal of another recording or unreadable: kept aside
+                os.replace(self.path, self.path + '.stale')
+            else:
+                with open(self.path, 'r+b') as file:  # removes a partially written edit
+                    file.truncate(valid_size)
+        if not os.path.isfile(self.path):
+            self.write_new(self.path, [])
+        self.file = open(self.path, 'ab')
+        self.n_edits = n_replayed
+        return n_replayed
+
+    def replay(self, state):
+        '''
+        Outputs:
+        - n_replayed  <-- number of edits, undo and redo applied
+        - valid_size  <-- size of the file up to the last complete record (None if not valid)
+        '''
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        if len(data) < HEADER.size:
+            return 0, None
+        magic, version, N = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or N != self.N:
+            return 0, None
+
+        n_replayed = 0
+        valid_size = HEADER.size
+        runs = []
+        for pos in range(HEADER.size, len(data) - RECORD.size + 1, RECORD.size):
+            op, start, stop, old, new = RECORD.unpack_from(data, pos)
+            if op in (OP_RUN, OP_HISTORY):
+                runs.append((start, stop, old, new))
+                continue
+            if op == OP_COMMIT:
+                apply_runs(state, runs)
+                self.push(runs)
+                self.redo_stack = []
+            elif op == OP_HISTORY_COMMIT:
+                self.push(runs)
+            elif op == OP_UNDO:
+                self._undo(state)
+            elif op == OP_REDO:
+                self._redo(state)
+            if op != OP_HISTORY_COMMIT:
+                n_replayed += 1
+            runs = []
+            valid_size = pos + RECORD.size
+        return n_replayed, valid_size
+
+    def write_new(self, path, history):
+        '''
+        writes a journal with only a header and the (already applied) history
+        '''
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, self.N))
+            for runs in history:
+                for run in runs:
+                    file.write(RECORD.pack(OP_HISTORY, *run))
+                file.write(RECORD.pack(OP_HISTORY_COMMIT, 0, 0, 0, 0))
+            file.flush()
+            os.fsync(file.fileno())
+
+    #-------------------------------------------------------#
+    #------------------ edits / undo / redo ----------------#
+    #-------------------------------------------------------#
+
+    def record(self, indices, old, new):
+        '''
+        appends an edit (already applied on the state list by the caller)
+
+        Inputs:
+        - indices <-- positions changed
+        - old     <-- values before the edit at these positions
+        - new     <-- value after the edit
+        '''
+        indices = np.asarray(indices)
+        old = np.asarray(old)
+        changed = old != new
+        if not np.any(changed):
+            return
+        order = np.argsort(indices[changed], kind='stable')
+        runs = get_runs(indices[changed][order], old[changed][order], new)
+        self.write(b''.join(RECORD.pack(OP_RUN, *run) for run in runs) + RECORD.pack(OP_COMMIT, 0, 0, 0, 0), len(runs) + 1)
+        self.push(runs)
+        self.redo_stack = []
+        self.n_edits += 1
+
+    def undo(self, state):
+        '''
+        Output:
+        - runs changed in state (None if there is nothing to undo)
+        '''
+        runs = self._undo(state)
+        if runs is not None:
+            self.write(RECORD.pack(OP_UNDO, 0, 0, 0, 0), 1)
+            self.n_edits += 1
+        return runs
+
+    def redo(self, state):
+
+        runs = self._redo(state)
+        if runs is not None:
+            self.write(RECORD.pack(OP_REDO, 0, 0, 0, 0), 1)
+            self.n_edits += 1
+        return runs
+
+    def _undo(self, state):
+        if not self.undo_stack:
+            return None
+        runs = self.undo_stack.pop()
+        apply_runs(state, runs, undo=True)
+        self.redo_stack.append(runs)
+        return runs
+
+    def _redo(self, state):
+        if not self.redo_stack:
+            return None
+        runs = self.redo_stack.pop()
+        apply_runs(state, runs)
+        self.undo_stack.append(runs)
+        return runs
+
+    def push(self, runs):
+        self.undo_stack.append(runs)
+        if len(self.undo_stack) > self.max_history:
+            del self.undo_stack[0]
+
+    #-------------------------------------------------------#
+    #------------------ writing / compaction ---------------#
+    #-------------------------------------------------------#
+
+    def write(self, data, n_records):
+        if self.file is None:
+            return
+        self.file.write(data)
+        self.file.flush()    # in the OS buffers: survives a crash of the app
+        self.pending += n_records
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        '''
+        fsync of the records written since the last call (survives a crash of the OS)
+        '''
+        if self.file is None or self.pending == 0:
+            return
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def compact(self, save_fct):
+        '''
+        writes the main annotation file with save_fct() and restarts the journal
+        with the undo history (the redo stack is dropped)
+        '''
+        self.sync()
+        save_fct()
+        tmp = self.path + '.tmp'
+        self.write_new(tmp, self.undo_stack)
+        if self.file is not None:
+            self.file.close()
+        os.replace(tmp, self.path)
+        self.file = open(self.path, 'ab')
+        self.redo_stack = []
+        self.n_edits = 0
+
+    def close(self):
+        if self.file is None:
+            return
+        self.sync()
+        self.file.close()
+        self.file = None
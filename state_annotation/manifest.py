@@ -0,0 +1,145 @@
+'''
+Incremental rebuild of the feature store of the annotated corpus
+
+The manifest (manifest.json in the parts folder of the store) records for each
+recording the content hash of the recording, the hash of its annotation, the
+hash of the parameters, the file where its rows are saved and the file of the
+quantile sketches of its features (state_annotation/sketch.py). A rebuild only
+recomputes the recordings that are new or whose recording, annotation or
+parameters changed, drops the recordings that are no longer annotated and
+repacks the store from the saved rows of all the others. The merged sketches of
+all the recordings are saved in the store (sketches.npz) for the box plots.
+
+    python -m state_annotation.manifest data_state_annotation_07_01_2026 --out box_plot_data_07_01_2026/feature_store
+'''
+
+import argparse
+import json
+import os
+import numpy as np
+
+from state_annotation.annotation_io import list_annotated, find_annotation
+from state_annotation.feature_cache import content_hash, params_hash
+from state_annotation.feature_store import FeatureStoreWriter
+from state_annotation.features import stack_features
+from state_annotation.sketch import FeatureSketches
+from state_annotation.batch import FS, extract_recording, run_batch, save_errors
+
+VERSION = 2
+
+
+class Manifest:
+
+    def __init__(self, path):
+        self.path = path
+        self.recordings = {}
+        if os.path.isfile(path):
+            with open(path) as file:
+                data = json.load(file)
+            if data.get('version') == VERSION:
+                self.recordings = data['recordings']
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'version': VERSION, 'recordings': self.recordings}, file, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def is_current(self, name, entry):
+        '''
+        True if the saved rows of the recording were computed from the same inputs
+        '''
+        saved = self.recordings.get(name)
+        if saved is None or not (os.path.isfile(saved['output']) and os.path.isfile(saved['sketch'])):
+            return False
+        return all(saved[key] == entry[key] for key in ('recording_hash', 'annotation_hash', 'params_hash'))
+
+
+def rebuild_store(folder, store_folder, annotation_folder='data_state_annotation', recording_folder='recordings_npy',
+                  fs=FS, artifacts=False, n_workers=None, timeout=600, verbose=True):
+    '''
+    Inputs:
+    - folder             <-- folder listing the annotated recordings (D_ files)
+    - store_folder       <-- folder of the feature store, the rows of each recording are kept in store_folder + '_parts'
+    - annotation_folder  <-- folder of the annotations
+    - recording_folder   <-- folder of the recordings
+    Output:
+    - errors             <-- error records of the recordings that failed (their rows are dropped)
+    '''
+    parts_folder = store_folder.rstrip('/') + '_parts'
+    os.makedirs(parts_folder, exist_ok=True)
+    manifest = Manifest(os.path.join(parts_folder, 'manifest.json'))
+    params = {'fs': fs, 'Ws': 30 * fs, 'step': 10 * fs, 'artifacts': artifacts}
+
+    #--- recordings to compute
+    names = list_annotated(folder)
+    entries, stale, errors = {}, [], []
+    for name in names:
+        path_annotation = find_annotation(annotation_folder, name)
+        path_recording = os.path.join(recording_folder, name + '.npy')
+        if path_annotation is None or not os.path.isfile(path_recording):
+            errors.append({'name': name, 'error': 'missing recording or annotation', 'traceback': '', 'elapsed': 0})
+            continue
+        entries[name] = {'recording_hash': content_hash(path_recording), 'annotation_hash': content_hash(path_annotation),
+                         'params_hash': params_hash(params), 'output': os.path.join(parts_folder, name + '.npz'),
+                         'sketch': os.path.join(parts_folder, name + '_sketch.npz')}
+        if not manifest.is_current(name, entries[name]):
+            stale.append(name)
+    deleted = [name for name in manifest.recordings if name not in entries]
+    if verbose:
+        print('%d recordings: %d to compute, %d up to date, %d removed' % (len(names), len(stale), len(entries) - len(stale), len(deleted)))
+
+    #--- compute the new or changed recordings
+    results = {}
+    if stale:
+        results, batch_errors = run_batch(extract_recording, stale, n_workers, timeout, verbose,
+                                          annotation_folder=annotation_folder, recording_folder=recording_folder,
+                                          fs=fs, artifacts=artifacts)
+        errors += batch_errors
+    for name, result in results.items():
+        with open(entries[name]['output'], 'wb') as file:
+            np.savez(file, **result)
+        sketches = FeatureSketches()
+        sketches.update(result['state_updated'], stack_features(result))
+        sketches.save(entries[name]['sketch'])
+        manifest.recordings[name] = dict(entries[name], n_rows=len(result['state_updated']))
+
+    #--- drop the removed recordings and the ones that failed
+    dropped = []
+    for name in deleted + [error['name'] for error in errors]:
+        entry = manifest.recordings.pop(name, None)
+        if entry is not None:
+            dropped.append(name)
+            for path in (entry['output'], entry['sketch']):
+                if os.path.isfile(path):
+                    os.remove(path)
+    manifest.save()
+
+    #--- pack the store from the saved rows
+    if results or dropped or not os.path.isdir(store_folder):
+        sketches = FeatureSketches()
+        with FeatureStoreWriter(store_folder) as writer:
+            for name in names:
+                if name in manifest.recordings:
+                    with np.load(manifest.recordings[name]['output']) as part:
+                        writer.append(name, part)
+                    sketches.merge(FeatureSketches.load(manifest.recordings[name]['sketch']))
+        sketches.save(os.path.join(store_folder, 'sketches.npz'))
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the feature store with the new or changed annotated recordings')
+    parser.add_argument('folder', help='folder listing the annotated recordings (D_ files)')
+    parser.add_argument('--annotations', default='data_state_annotation', help='folder of the annotations')
+    parser.add_argument('--recordings', default='recordings_npy', help='folder of the recordings')
+    parser.add_argument('--out', default='box_plot_data_07_01_2026/feature_store', help='feature store (folder)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (all cores by default)')
+    parser.add_argument('--timeout', type=float, default=600, help='maximal time per recording (s)')
+    parser.add_argument('--artifacts', action='store_true', help='compute the features on the WQN corrected signal')
+    args = parser.parse_args()
+
+    errors = rebuild_store(args.folder, args.out, args.annotations, args.recordings,
+                           artifacts=args.artifacts, n_workers=args.workers, timeout=args.timeout)
+    if errors:
+        save_errors(errors, args.out.rstrip('/') + '_errors.json')
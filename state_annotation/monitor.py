@@ -0,0 +1,323 @@
+'''
+Monitoring service of several EEG streams (one per bed) on a local socket
+
+The service (asyncio) accepts connections on a TCP port of localhost or on a
+Unix socket. A producer opens a stream and sends chunks of samples, each stream
+has its RealtimeEngine (realtime.py) that keeps the ring buffer and returns the
+jobs of the completed windows, the jobs are computed in a bounded process pool
+and the records are pushed in order to the subscribers of the stream.
+
+Backpressure: a stream holds at most `max_pending` jobs in the pool, beyond
+that the service stops reading its connection until a record is published, so
+a fast producer is slowed down instead of filling the memory. The latency of a
+record is the time between the arrival of the chunk that completed its window
+(+ halo) and its publication, per stream metrics are sent on request.
+
+Messages: 8 bytes (length of the JSON header, length of the payload, uint32
+little endian), the JSON header and the payload (float64 samples of a chunk).
+- producer:   {'type': 'open', 'stream': id, 'fs': 128, ...Compute parameters}, {'type': 'chunk', 'stream': id} + samples,
+              {'type': 'close', 'stream': id}
+- subscriber: {'type': 'subscribe', 'stream': id or '*'}, {'type': 'metrics'}
+- service:    {'type': 'record', 'stream': id, ...record}, {'type': 'closed', 'stream': id}, {'type': 'metrics', ...}, {'type': 'error', ...}
+
+    python -m state_annotation.monitor serve --port 8765 --workers 4
+    python -m state_annotation.monitor replay recordings_npy/EEG_data_000063172.npy recordings_npy/EEG_data_000351929.npy --speed 60
+'''
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from state_annotation.realtime import RealtimeEngine, compute_job
+from state_annotation.recording import Recording
+
+HEADER = struct.Struct('<II')
+PORT = 8765
+
+
+#-------------------------------------------------------------------------------------------#
+#                                        Messages                                           #
+#-------------------------------------------------------------------------------------------#
+
+async def read_message(reader):
+
+    n_header, n_payload = HEADER.unpack(await reader.readexactly(HEADER.size))
+    header = json.loads(await reader.readexactly(n_header))
+    payload = await reader.readexactly(n_payload) if n_payload else b''
+    return header, payload
+
+
+def write_message(writer, header, payload=b''):
+
+    header = json.dumps(header).encode()
+    writer.write(HEADER.pack(len(header), len(payload)) + header + payload)
+
+
+def to_json(record):
+    '''
+    record with the numpy values converted to lists and floats
+    '''
+    return {key: value.tolist() if isinstance(value, np.ndarray) else
+            value.item() if isinstance(value, np.generic) else value for key, value in record.items()}
+
+
+async def open_connection(host='127.0.0.1', port=PORT, path=None):
+
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+
+#-------------------------------------------------------------------------------------------#
+#                                        Service                                            #
+#-------------------------------------------------------------------------------------------#
+
+class Stream:
+
+    def __init__(self, name, engine, max_pending):
+        self.name = name
+        self.engine = engine
+        self.queue = asyncio.Queue(maxsize=max_pending)   # (future of a job, arrival time) in order, None at the end
+        self.latencies = collections.deque(maxlen=1000)
+        self.n_samples = 0
+        self.n_records = 0
+        self.closing = False
+        self.publisher = None
+
+    def metrics(self):
+
+        metrics = {'n_samples': self.n_samples, 'n_records': self.n_records, 'pending': self.queue.qsize()}
+        if self.latencies:
+            latencies = np.array(self.latencies)
+            metrics['latency'] = {'mean': float(latencies.mean()), 'p95': float(np.percentile(latencies, 95)),
+                                  'max': float(latencies.max())}
+        return metrics
+
+
+class MonitorService:
+    '''
+    Inputs:
+    - n_workers    <-- processes of the pool computing the windows
+    - max_pending  <-- jobs of a stream in the pool before its connection stops being read
+    '''
+
+    def __init__(self, n_workers=None, max_pending=8):
+        self.pool = ProcessPoolExecutor(max_workers=n_workers or os.cpu_count())
+        self.max_pending = max_pending
+        self.streams = {}
+        self.subscribers = collections.defaultdict(set)   # stream name or '*' --> writers
+
+    async def open_stream(self, header):
+
+        name = header['stream']
+        if name in self.streams:
+            raise ValueError('stream %s is already open' % name)
+        params = {key: header[key] for key in ('fs', 'Ws', 'step', 'Ws_line_length', 'step_line_length', 'bands', 'halo', 't0')
+                  if key in header}
+        stream = Stream(name, RealtimeEngine(**params), self.max_pending)
+        stream.publisher = asyncio.create_task(self.publish_stream(stream))
+        self.streams[name] = stream
+        return stream
+
+    async def submit(self, stream, jobs, t_arrival):
+
+        loop = asyncio.get_running_loop()
+        for job in jobs:
+            # blocks when the stream has max_pending jobs in the pool (backpressure)
+            await stream.queue.put((loop.run_in_executor(self.pool, compute_job, job), t_arrival))
+
+    async def close_stream(self, stream):
+
+        if stream.closing:
+            return
+        stream.closing = True
+        await self.submit(stream, stream.engine.finish(), time.monotonic())
+        await stream.queue.put(None)
+        await stream.publisher
+
+    async def publish_stream(self, stream):
+        '''
+        publishes the records of a stream in order
+        '''
+        while True:
+            item = await stream.queue.get()
+            if item is None:
+                break
+            future, t_arrival = item
+            record = await future
+            record['stream'] = stream.name
+            record['latency'] = time.monotonic() - t_arrival
+            stream.latencies.append(record['latency'])
+            stream.n_records += 1
+            await self.publish(stream.name, dict(to_json(record), type='record'))
+        await self.publish(stream.name, {'type': 'closed', 'stream': stream.name, 'metrics': stream.metrics()})
+        del self.streams[stream.name]
+
+    async def publish(self, name, message):
+
+        for writer in list(self.subscribers[name] | self.subscribers['*']):
+            try:
+                write_message(writer, message)
+                await writer.drain()
+            except (ConnectionError, RuntimeError):
+                self.unsubscribe(writer)
+
+    def unsubscribe(self, writer):
+
+        for writers in self.subscribers.values():
+            writers.discard(writer)
+
+    def metrics(self):
+
+        return {'type': 'metrics', 'streams': {name: stream.metrics() for name, stream in self.streams.items()}}
+
+    async def handle(self, reader, writer):
+        '''
+        connection of a producer and/or subscriber
+        '''
+        owned = []
+        try:
+            while True:
+                header, payload = await read_message(reader)
+                try:
+                    kind = header['type']
+                    if kind == 'chunk':
+                        stream = self.streams[header['stream']]
+                        samples = np.frombuffer(payload, dtype='<f8')
+                        stream.n_samples += len(samples)
+                        await self.submit(stream, stream.engine.feed(samples), time.monotonic())
+                    elif kind == 'open':
+                        owned.append(await self.open_stream(header))
+                        write_message(writer, {'type': 'opened', 'stream': header['stream']})
+                    elif kind == 'close':
+                        await self.close_stream(self.streams[header['stream']])
+                    elif kind == 'subscribe':
+                        self.subscribers[header.get('stream', '*')].add(writer)
+                    elif kind == 'metrics':
+                        write_message(writer, self.metrics())
+                    else:
+                        raise ValueError('unknown message type %r' % kind)
+                except (KeyError, ValueError) as e:
+                    write_message(writer, {'type': 'error', 'error': repr(e), 'request': header.get('type')})
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.unsubscribe(writer)
+            # the streams of a producer that left are ended
+            for stream in owned:
+                await self.close_stream(stream)
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=PORT, path=None, ready=None):
+        '''
+        serves until cancelled, on the Unix socket `path` if given, else on host:port
+        '''
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+#-------------------------------------------------------------------------------------------#
+#                                      Replay client                                        #
+#-------------------------------------------------------------------------------------------#
+
+async def replay(path, stream=None, speed=1.0, chunk=1.0, fs=128, host='127.0.0.1', port=PORT, unix_path=None,
+                 verbose=True, **params):
+    '''
+    streams a recording (.npy) to the service as a device would and collects its records
+
+    Inputs:
+    - speed   <-- 1 for real time, 60 for one minute of signal per second, 0 as fast as possible
+    - chunk   <-- duration (s) of the chunks sent
+    - params  <-- parameters of the RealtimeEngine (Ws, step, halo, ...)
+    Output:
+    - records of the stream (in order) and the metrics sent with the end of the stream
+    '''
+    recording = Recording(path, fs)
+    stream = stream or os.path.splitext(os.path.basename(path))[0]
+    reader, writer = await open_connection(host, port, unix_path)
+    write_message(writer, {'type': 'subscribe', 'stream': stream})
+    write_message(writer, dict(params, type='open', stream=stream, fs=fs))
+    await writer.drain()
+
+    records, metrics = [], {}
+
+    async def receive():
+        while True:
+            header, _ = await read_message(reader)
+            if header['type'] == 'record' and header['stream'] == stream:
+                records.append(header)
+                if verbose and header['kind'] == 'window':
+                    print('%s t=%.0f s state=%d latency=%.3f s' % (stream, header['t'], header['state'], header['latency']))
+            elif header['type'] == 'closed' and header['stream'] == stream:
+                metrics.update(header['metrics'])
+                return
+            elif header['type'] == 'error':
+                raise RuntimeError(header['error'])
+
+    receiver = asyncio.create_task(receive())
+    t_start = time.monotonic()
+    size = max(1, int(chunk * fs))
+    for start, samples in recording.chunks(size):
+        write_message(writer, {'type': 'chunk', 'stream': stream}, np.ascontiguousarray(samples, dtype='<f8').tobytes())
+        await writer.drain()
+        if receiver.done():
+            break
+        if speed > 0:
+            await asyncio.sleep(max(0, t_start + (start + len(samples)) / fs / speed - time.monotonic()))
+    write_message(writer, {'type': 'close', 'stream': stream})
+    await writer.drain()
+    await receiver
+    writer.close()
+    return records, metrics
+
+
+async def replay_files(paths, **kwargs):
+    '''
+    replays several recordings at once (one stream per file)
+    '''
+    return await asyncio.gather(*[replay(path, **kwargs) for path in paths])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monitoring service of EEG streams and replay client')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the service')
+    serve.add_argument('--workers', type=int, default=None, help='processes computing the windows (all cores by default)')
+    serve.add_argument('--max-pending', type=int, default=8, help='jobs of a stream in the pool before backpressure')
+    client = commands.add_parser('replay', help='stream recordings to the service')
+    client.add_argument('files', nargs='+', help='recordings (.npy), one stream per file')
+    client.add_argument('--speed', type=float, default=1.0, help='1 real time, 0 as fast as possible')
+    client.add_argument('--chunk', type=float, default=1.0, help='duration of a chunk (s)')
+    client.add_argument('--fs', type=int, default=128, help='sampling frequency')
+    client.add_argument('--halo', type=int, default=None, help='halo of the band filters (samples)')
+    for command in (serve, client):
+        command.add_argument('--host', default='127.0.0.1')
+        command.add_argument('--port', type=int, default=PORT)
+        command.add_argument('--unix', default=None, help='Unix socket instead of TCP')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        service = MonitorService(args.workers, args.max_pending)
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    else:
+        params = {} if args.halo is None else {'halo': args.halo}
+        results = asyncio.run(replay_files(args.files, speed=args.speed, chunk=args.chunk, fs=args.fs,
+                                           host=args.host, port=args.port, unix_path=args.unix, **params))
+        for path, (records, metrics) in zip(args.files, results):
+            print(path, json.dumps(metrics))
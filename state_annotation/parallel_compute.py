@@ -0,0 +1,185 @@
+'''
+Compute on several cores for a single long recording
+
+The windows are split in consecutive chunks (aligned on the window grid of
+each feature) that are computed by a pool of processes. The signal is put once
+in shared memory (multiprocessing.shared_memory) and every worker reads the
+samples of its chunk from it, so nothing but the per-window outputs is sent
+between the processes. The outputs of the chunks are concatenated in order.
+
+All the features but the powers of the bands only depend on the samples of
+their window, so they are identical to the serial Compute. The bands are
+filtered forward-backward on the whole signal in Compute: a chunk is filtered
+with `halo` extra samples on each side, after which the transient of the
+filter has vanished (the powers equal the serial ones to ~1e-12 relative with
+the default halo of 120 s).
+
+    C = ParallelCompute(n_workers=8)
+    C.get_data(t, y, fs, Ws, step, Ws_line_length, step_line_length)
+    C.run()
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+import Functions.sliding_fct as sliding
+from Functions.filter import get_filtered_signal
+from state_annotation.compute import Compute, PRECISIONS
+
+HALO = 120   # s
+
+
+def window_count(N, Ws, step, last=False):
+    '''
+    number of windows of the sliding functions (last=True for range(0, N - Ws + 1, step))
+    '''
+    return len(range(0, N - Ws + int(last), step))
+
+
+def split(n, n_chunks):
+    '''
+    list of (first, stop) indices of n_chunks consecutive chunks of range(n)
+    '''
+    bounds = np.linspace(0, n, n_chunks + 1).astype(int)
+    return [(int(bounds[k]), int(bounds[k + 1])) for k in range(n_chunks)]
+
+
+def chunk_features(read, N, fs, params, ranges, halo):
+    '''
+    features of the windows ranges[family] = (first, stop) of a chunk
+
+    Inputs:
+    - read    <-- function read(lo, hi) returning the samples lo:hi of the signal (copy in the dtype of the precision)
+    - N       <-- number of samples of the signal
+    - params  <-- Ws, step, Ws_line_length, step_line_length, bands
+    - halo    <-- samples filtered on each side of the chunk
+    The samples of the windows [first, stop) are y[first * step:(stop - 1) * step + Ws + 1],
+    the sliding functions give the same windows on this slice.
+    '''
+    def get_slice(first, stop, Ws, step):
+        lo, hi = first * step, min(N, (stop - 1) * step + Ws + 1)
+        return lo, hi, read(lo, hi)
+
+    out = {}
+    Ws, step = params['Ws'], params['step']
+    first, stop = ranges['main']
+    if stop > first:
+        n = stop - first
+        lo, hi, sub = get_slice(first, stop, Ws, step)
+        t = np.zeros(len(sub) + 1)
+        IES, alpha_supp = sliding.supp_power_prop(sub, t, Ws, step, fs)[-2:]
+        out['IES_prop'], out['alpha_supp_prop'] = IES[:n], alpha_supp[:n]
+        out['freqs_quantiles'] = sliding.compute_freqs_quantiles(sub, t, Ws, step, fs)[-1][:, :n]
+        out['f_central'] = sliding.compute_central_frequency(sub, t, fs, Ws, step)[-1][:n]
+        # the bands are filtered with a halo around the chunk
+        flo, fhi = max(0, lo - halo), min(N, hi + halo)
+        signals = get_filtered_signal(read(flo, fhi), fs, params['bands'])[:, lo - flo:hi - flo]
+        out['P_signals'] = sliding.power_nD(signals, t, Ws, step)[1][:, :n]
+        del signals
+
+    first, stop = ranges['entropy']
+    if stop > first:
+        n = stop - first
+        sub = get_slice(first, stop, Ws, step)[-1]
+        t = np.zeros(len(sub) + 1)
+        out['entropy'] = sliding.compute_entropy(sub, t, Ws, step)[-1][:n]
+        out['be'] = sliding.compute_block_entropy_k(sub, t, Ws, step)[-1][:n]
+
+    first, stop = ranges['line_length']
+    if stop > first:
+        n = stop - first
+        Ws_ll, step_ll = params['Ws_line_length'], params['step_line_length']
+        sub = get_slice(first, stop, Ws_ll, step_ll)[-1]
+        out['line_length'] = sliding.compute_line_length(sub, np.zeros(len(sub) + 1), Ws_ll, step_ll)[-1][:n]
+    return out
+
+
+def compute_chunk(shm_name, N, dtype, fs, params, ranges, halo):
+    '''
+    chunk_features on the signal (of the given dtype) in shared memory, run in a worker
+    '''
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        y = np.ndarray((N,), dtype=dtype, buffer=shm.buf)
+        return chunk_features(lambda lo, hi: np.array(y[lo:hi]), N, fs, params, ranges, halo)
+    finally:
+        shm.close()
+
+
+class ParallelCompute(Compute):
+    '''
+    Compute whose run() splits the windows in chunks computed by a pool of processes
+
+    Inputs:
+    - n_workers  <-- number of processes (all the cores by default)
+    - n_chunks   <-- number of chunks (2 per process by default, to balance the load)
+    - halo       <-- samples filtered on each side of a chunk (HALO seconds by default)
+    '''
+
+    def __init__(self, n_workers=None, n_chunks=None, halo=None):
+        super().__init__()
+        self.n_workers = n_workers or os.cpu_count()
+        self.n_chunks = n_chunks or 2 * self.n_workers
+        self.halo = halo
+
+    def window_counts(self):
+
+        if getattr(self.y, 'ndim', 1) != 1:   # (a Recording is read by chunks, never as an array)
+            raise ValueError('%s computes a single channel, use Compute for (channels, N) signals' % type(self).__name__)
+        N = len(self.y)
+        return {'main': window_count(N, self.Ws, self.step),
+                'entropy': window_count(N, self.Ws, self.step, last=True),
+                'line_length': window_count(N, self.Ws_line_length, self.step_line_length)}
+
+    def chunk_params(self):
+
+        return {'Ws': self.Ws, 'step': self.step, 'Ws_line_length': self.Ws_line_length,
+                'step_line_length': self.step_line_length, 'bands': self.bands}
+
+    def get_halo(self):
+
+        return int(self.halo if self.halo is not None else HALO * self.fs)
+
+    def run(self):
+
+        N = len(self.y)
+        counts = self.window_counts()
+        n_chunks = max(1, min(self.n_chunks, counts['main']))
+        chunks = [dict(zip(counts, ranges)) for ranges in zip(*[split(n, n_chunks) for n in counts.values()])]
+        halo = self.get_halo()
+        params = self.chunk_params()
+
+        dtype = np.dtype(PRECISIONS[self.precision])
+        shm = shared_memory.SharedMemory(create=True, size=max(1, N * dtype.itemsize))
+        try:
+            np.ndarray((N,), dtype=dtype, buffer=shm.buf)[:] = self.y
+            with ProcessPoolExecutor(max_workers=min(self.n_workers, n_chunks)) as executor:
+                futures = [executor.submit(compute_chunk, shm.name, N, dtype, self.fs, params, ranges, halo) for ranges in chunks]
+                outs = [future.result() for future in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+        self.stitch(outs, counts)
+
+    def stitch(self, outs, counts):
+        '''
+        sets the features from the outputs of the chunks (in order)
+        '''
+        def stitch(name, axis=0):
+            parts = [out[name] for out in outs if name in out]
+            return np.concatenate(parts, axis=axis) if parts else np.zeros(0)
+
+        self.t_list = [self.t[self.Ws + i * self.step] for i in range(counts['main'])]
+        self.P_signals = stitch('P_signals', axis=1) if counts['main'] else np.zeros((len(self.bands), 0))
+        self.IES_prop, self.alpha_supp_prop = stitch('IES_prop'), stitch('alpha_supp_prop')
+        self.supp = self.alpha_supp_prop + 2 * self.IES_prop
+        self.freqs_quantiles = stitch('freqs_quantiles', axis=1) if counts['main'] else np.zeros((4, 0))
+        self.f_central = stitch('f_central')
+        self.entropy, self.be = stitch('entropy'), stitch('be')
+        self.t_line_length = [self.t[self.Ws_line_length + i * self.step_line_length] for i in range(counts['line_length'])]
+        self.line_length = stitch('line_length')
+
+        self.get_power_prop()
+        self.get_state()
@@ -0,0 +1,161 @@
+'''
+Validation of the float32 precision policy of Compute on the corpus
+
+Each recording is computed twice, in float64 (reference) and in float32 (from
+Recording.signal through the filters, powers, spectrograms and features), and
+the report gives for every feature of get_features the deltas between the two,
+the agreement of the states (get_state_0_20) and the time and peak memory
+(tracemalloc) of each precision.
+
+The deltas are normalized by the standard deviation of the float64 feature on
+the recording (several features are often 0, e.g. supp), the frequency
+quantiles take discrete values (Welch bins) so their deltas are counted as the
+proportion of epochs that changed. The entropies are histograms of the z-scored
+window: the rounding of the signal to float32 moves the samples lying on a bin
+edge (computing the histograms in float64 does not change it), hence their own
+tolerance.
+
+    python -m state_annotation.precision_report recordings_npy --out precision_report.json
+'''
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from state_annotation.compute import Compute
+from state_annotation.features import FEATURE_NAMES, get_features
+from state_annotation.recording import Recording
+
+# features taking discrete values, compared by the proportion of epochs that changed
+DISCRETE = ['50_q', '75_q', '85_q', '95_q']
+
+TOLERANCES = {'p99': 1e-2,              # 99th percentile of |delta| / std of the feature
+              'max': 0.25,              # maximum of |delta| / std of the feature
+              'changed': 0.01,          # proportion of epochs changed (discrete features)
+              'state_agreement': 0.99}  # proportion of epochs with the same state
+
+# tolerances of the features that differ from TOLERANCES
+FEATURE_TOLERANCES = {'entropy': {'p99': 0.1}, 'be': {'p99': 0.1}}
+
+
+def run_precision(recording, fs, precision, **params):
+    '''
+    Compute of a recording in the given precision, with its time (s) and peak memory (bytes)
+    '''
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    y = recording.signal(dtype=np.float32 if precision == 'float32' else np.float64)
+    C = Compute()
+    C.get_data(recording.t, y, fs, precision=precision, **params)
+    C.run()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return C, elapsed, peak
+
+
+def compare(C_ref, C):
+    '''
+    deltas of the features and agreement of the states of C against C_ref
+    '''
+    ref, features = get_features(C_ref), get_features(C)
+    out = {}
+    for name in FEATURE_NAMES:
+        a, b = ref[name].astype(np.float64), features[name].astype(np.float64)
+        finite = np.isfinite(a) & np.isfinite(b)
+        delta = np.abs(a[finite] - b[finite])
+        scale = np.std(a[finite]) if finite.any() else 0.
+        scale = scale if scale > 0 else 1.
+        out[name] = {'p99': float(np.percentile(delta, 99) / scale) if delta.size else 0.,
+                     'max': float(delta.max() / scale) if delta.size else 0.,
+                     'changed': float(np.mean(delta > 0)) if delta.size else 0.,
+                     # same non finite values (ratios of zero powers)
+                     'nonfinite_mismatch': int(np.sum(np.isfinite(a) != np.isfinite(b)))}
+    agreement = float(np.mean(np.asarray(C_ref.state) == np.asarray(C.state))) if len(C_ref.state) else 1.
+    return out, agreement
+
+
+def check(features, agreement, tolerances=TOLERANCES, feature_tolerances=FEATURE_TOLERANCES):
+    '''
+    list of the tolerances exceeded (empty when the recording passes)
+    '''
+    failures = []
+    for name, deltas in features.items():
+        limits = dict(tolerances, **feature_tolerances.get(name, {}))
+        if name in DISCRETE:
+            if deltas['changed'] > limits['changed']:
+                failures.append('%s: %.3f of the epochs changed' % (name, deltas['changed']))
+            continue
+        for key in ('p99', 'max'):
+            if deltas[key] > limits[key]:
+                failures.append('%s: %s delta %.2e' % (name, key, deltas[key]))
+        if deltas['nonfinite_mismatch']:
+            failures.append('%s: %d non finite values differ' % (name, deltas['nonfinite_mismatch']))
+    if agreement < tolerances['state_agreement']:
+        failures.append('state agreement %.4f' % agreement)
+    return failures
+
+
+def report(paths, fs=128, tolerances=TOLERANCES, verbose=True):
+    '''
+    Output:
+    - dictionnary with the results of each recording, the worst values on the corpus and 'passed'
+    '''
+    params = {'Ws': 30 * fs, 'step': 10 * fs, 'Ws_line_length': 30 * fs, 'step_line_length': 10 * fs}
+    recordings = {}
+    for path in paths:
+        recording = Recording(path, fs)
+        C64, t64, m64 = run_precision(recording, fs, 'float64', **params)
+        C32, t32, m32 = run_precision(recording, fs, 'float32', **params)
+        features, agreement = compare(C64, C32)
+        failures = check(features, agreement, tolerances)
+        name = os.path.splitext(os.path.basename(path))[0]
+        recordings[name] = {'epochs': len(C64.t_list), 'state_agreement': agreement,
+                            'time': {'float64': t64, 'float32': t32},
+                            'peak_memory': {'float64': m64, 'float32': m32},
+                            'features': features, 'failures': failures}
+        if verbose:
+            print('%-45s %5d epochs  states %.4f  time %.2f -> %.2f s  memory %.1f -> %.1f MB  %s'
+                  % (name, len(C64.t_list), agreement, t64, t32, m64 / 2**20, m32 / 2**20,
+                     'ok' if not failures else '; '.join(failures)))
+
+    n_epochs = sum(r['epochs'] for r in recordings.values())
+    corpus = {'recordings': len(recordings), 'epochs': n_epochs,
+              'state_agreement': sum(r['state_agreement'] * r['epochs'] for r in recordings.values()) / max(1, n_epochs),
+              'time': {p: sum(r['time'][p] for r in recordings.values()) for p in ('float64', 'float32')},
+              'peak_memory': {p: max((r['peak_memory'][p] for r in recordings.values()), default=0) for p in ('float64', 'float32')},
+              'features': {name: {key: max((r['features'][name][key] for r in recordings.values()), default=0)
+                                  for key in ('p99', 'max', 'changed')} for name in FEATURE_NAMES}}
+    return {'tolerances': tolerances, 'feature_tolerances': FEATURE_TOLERANCES, 'corpus': corpus, 'recordings': recordings,
+            'passed': all(not r['failures'] for r in recordings.values())}
+
+
+def print_corpus(result):
+
+    corpus = result['corpus']
+    print('\n%d recordings, %d epochs, state agreement %.4f' % (corpus['recordings'], corpus['epochs'], corpus['state_agreement']))
+    print('time %.1f -> %.1f s, peak memory %.1f -> %.1f MB' % (corpus['time']['float64'], corpus['time']['float32'],
+          corpus['peak_memory']['float64'] / 2**20, corpus['peak_memory']['float32'] / 2**20))
+    print('%-12s %10s %10s %10s' % ('feature', 'p99', 'max', 'changed'))
+    for name, deltas in corpus['features'].items():
+        print('%-12s %10.2e %10.2e %10.4f' % (name, deltas['p99'], deltas['max'], deltas['changed']))
+    print('passed' if result['passed'] else 'FAILED')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validation report of the float32 precision policy')
+    parser.add_argument('folder', nargs='?', default='recordings_npy', help='folder of the recordings (.npy)')
+    parser.add_argument('--fs', type=int, default=128, help='sampling frequency')
+    parser.add_argument('--out', default='precision_report.json', help='report (json)')
+    args = parser.parse_args()
+
+    result = report(sorted(glob.glob(os.path.join(args.folder, '*.npy'))), args.fs)
+    with open(args.out, 'w') as file:
+        json.dump(result, file, indent=1)
+    print_corpus(result)
+    sys.exit(0 if result['passed'] else 1)
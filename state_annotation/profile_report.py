@@ -0,0 +1,78 @@
+'''
+Profiling report of the batch extraction: time and peak memory per stage
+
+The annotated recordings are computed by batch.extract_recording with its
+profile option (the stages recorded inside Functions.profiling.profile, without
+the feature cache) in the pool of batch.run_batch, as with the --profile option
+of state_annotation/batch.py. The stages are the get_* methods of Compute and
+the helpers they call (filters, sliding windows, suppressions and their steps,
+ground check, artifacts detection and WQN correction), see Functions/profiling.py.
+The report (json) has the stages of each recording and a corpus summary (times
+summed, share of the total time, maximal peaks, seconds per hour of signal).
+
+    python -m state_annotation.profile_report data_state_annotation_07_01_2026 --memory --out profile_report.json
+'''
+
+import argparse
+import json
+
+from Functions.profiling import merge_reports
+from state_annotation.annotation_io import list_annotated
+from state_annotation.batch import FS, extract_recording, run_batch
+
+
+def recording_report(result):
+    '''
+    Output:
+    - report of the stages of an extract_recording result with its number of epochs and its duration (h)
+    '''
+    report = dict(result['profile'])
+    report['epochs'] = len(result['state_updated'])
+    report['hours'] = float(result['time'][-1]) / 3600 if len(result['time']) else 0.
+    return report
+
+
+def corpus_report(reports):
+    '''
+    reports of the recordings (name --> report) and their corpus summary
+    '''
+    corpus = merge_reports(list(reports.values()))
+    corpus['hours'] = sum(report['hours'] for report in reports.values())
+    corpus['seconds_per_hour'] = corpus['time'] / corpus['hours'] if corpus['hours'] else 0.
+    return {'corpus': corpus, 'recordings': reports}
+
+
+def print_summary(corpus, n=15):
+
+    print('%d recordings, %.1f h of signal in %.1f s (%.1f s per hour)'
+          % (corpus['recordings'], corpus['hours'], corpus['time'], corpus['seconds_per_hour']))
+    print('%-28s %8s %10s %10s %7s %10s' % ('stage', 'calls', 'time (s)', 'self (s)', 'share', 'peak (MB)'))
+    stages = sorted(corpus['by_name'].items(), key=lambda item: -item[1]['self_time'])
+    for name, values in stages[:n]:
+        peak = '%10.1f' % (values['peak'] / 2**20) if 'peak' in values else '%10s' % '-'
+        print('%-28s %8d %10.2f %10.2f %6.1f%% %s' % (name, values['calls'], values['time'], values['self_time'],
+                                                    100 * values['share'], peak))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time and memory per stage of the batch extraction')
+    parser.add_argument('folder', help='folder listing the annotated recordings (D_ files)')
+    parser.add_argument('--annotations', default='data_state_annotation', help='folder of the annotations')
+    parser.add_argument('--recordings', default='recordings_npy', help='folder of the recordings')
+    parser.add_argument('--fs', type=int, default=FS, help='sampling frequency')
+    parser.add_argument('--memory', action='store_true', help='peak memory per stage (tracemalloc, slower)')
+    parser.add_argument('--artifacts', action='store_true', help='compute on the WQN corrected signal')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (all cores by default)')
+    parser.add_argument('--timeout', type=float, default=600, help='maximal time per recording (s)')
+    parser.add_argument('--out', default='profile_report.json', help='report (json)')
+    args = parser.parse_args()
+
+    names = list_annotated(args.folder)
+    results, errors = run_batch(extract_recording, names, args.workers, args.timeout,
+                                annotation_folder=args.annotations, recording_folder=args.recordings, fs=args.fs,
+                                artifacts=args.artifacts, use_cache=False, profile='memory' if args.memory else 'time')
+    result = corpus_report({name: recording_report(results[name]) for name in names if name in results})
+    result['errors'] = errors
+    with open(args.out, 'w') as file:
+        json.dump(result, file, indent=1)
+    print_summary(result['corpus'])
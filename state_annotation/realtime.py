@@ -0,0 +1,286 @@
+'''
+Real-time features and states of a stream (e.g. the eeg_producer device)
+
+The samples are pushed by chunks of any length in a ring buffer. Each time the
+samples of a new window are available (every `step` samples) the engine emits
+the features of Compute and the state of get_state_0_20 for this window,
+computed from the buffer and from state kept between the updates:
+- cumulative sums (ring) of |diff| and of the zero crossings, the line length
+  and the central frequency of a window are a difference of two values
+- a cache of the Welch segment periodograms: each segment is computed once
+  when its samples arrive and the PSD of a window is the mean of its segments
+- the suppressions and entropies only depend on the samples of the window and
+  are computed on it (bounded cost)
+- the band powers: Compute filters forward-backward the whole recording, which
+  no causal filter reproduces. The window is filtered with `halo` samples on
+  each side (60 s by default, ~1e-12 relative to the offline powers), so a
+  window is emitted `halo` after its end. A shorter halo lowers this delay at
+  the cost of precision (20 s: ~1e-8 on the delta band).
+
+The cost of an update does not depend on the time already streamed, its
+latency is measured (latency_stats). feed() only updates the state of the
+engine and returns the jobs of the completed windows, compute_job() computes a
+job without the engine (e.g. in a process pool, see monitor.py). After flush()
+the outputs equal the offline Compute on the same samples.
+
+    engine = RealtimeEngine(fs=128)
+    for chunk in stream:
+        for record in engine.push(chunk):
+            print(record['t'], record['state'])
+    records = engine.flush()
+'''
+
+import time
+import numpy as np
+from scipy.signal import get_window, welch
+
+from Functions.suppressions import detect_suppressions_power
+from Functions.filter import get_filtered_signal
+from Functions.compute_state import get_state_0_20
+from Functions.sliding_fct import compute_entropy, compute_block_entropy_k
+from state_annotation.compute import BANDS
+
+HALO = 60   # s
+
+
+class RingBuffer:
+    '''
+    Ring buffer of the last `capacity` values, written twice so that any
+    range of at most capacity values is a contiguous view (no copy)
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(2 * capacity)
+        self.n = 0   # number of values written since the start
+
+    def extend(self, values):
+
+        for start in range(0, len(values), self.capacity):
+            part = values[start:start + self.capacity]
+            i = self.n % self.capacity
+            k = min(len(part), self.capacity - i)
+            for offset in (0, self.capacity):
+                self.buffer[offset + i:offset + i + k] = part[:k]
+                self.buffer[offset:offset + len(part) - k] = part[k:]
+            self.n += len(part)
+
+    def get(self, start, stop):
+        '''
+        values of the absolute indices start:stop (view)
+        '''
+        if start < self.n - self.capacity or stop > self.n:
+            raise IndexError('samples %d:%d are not in the buffer' % (start, stop))
+        i = start % self.capacity
+        return self.buffer[i:i + stop - start]
+
+
+class RealtimeEngine:
+    '''
+    Inputs:
+    - fs, Ws, step, Ws_line_length, step_line_length, bands  <-- parameters of Compute (samples)
+    - halo  <-- samples filtered after and before a window for the band powers (HALO seconds by default)
+    - t0    <-- time of the first sample
+    '''
+
+    def __init__(self, fs=128, Ws=None, step=None, Ws_line_length=None, step_line_length=None, bands=BANDS, halo=None, t0=0):
+        self.fs = fs
+        self.Ws = Ws or 30 * fs
+        self.step = step or 10 * fs
+        self.Ws_line_length = Ws_line_length or self.Ws
+        self.step_line_length = step_line_length or self.step
+        self.bands = bands
+        self.halo = int(halo if halo is not None else HALO * fs)
+        self.t0 = t0
+
+        capacity = max(self.Ws, self.Ws_line_length) + 2 * self.halo + 2 * max(self.step, self.step_line_length)
+        self.y = RingBuffer(capacity)
+        self.cum_abs_diff = RingBuffer(capacity)     # cum_abs_diff[k] = sum of |y[j+1] - y[j]| for j < k
+        self.cum_crossings = RingBuffer(capacity)    # same for the sign changes
+        self.last = None                             # last sample and sums, to continue the cumulative sums
+
+        # Welch segments (as scipy.signal.welch with the default nperseg)
+        self.nperseg = 256
+        self.hop = self.nperseg // 2
+        self.window = get_window('hann', self.nperseg)
+        self.scale = 1 / (fs * np.sum(self.window ** 2))
+        self.segments = {}   # index of the segment (start = index * hop) --> periodogram
+        self.n_segments = 0
+
+        self.i_window = 0        # next window of the main grid
+        self.i_line_length = 0   # next window of the line length
+        self.latencies = []
+
+    #-------------------------------------------------------------------------------------------#
+    #                                       Ingestion                                           #
+    #-------------------------------------------------------------------------------------------#
+
+    def push(self, samples):
+        '''
+        adds samples to the stream and computes the windows they complete
+        Output:
+        - records of the windows completed by these samples
+        '''
+        return self.compute(self.feed(samples))
+
+    def flush(self):
+        '''
+        end of the stream: computes the last windows (their band powers are filtered with the samples available)
+        '''
+        return self.compute(self.finish())
+
+    def feed(self, samples):
+        '''
+        adds samples to the stream
+        Output:
+        - jobs of the windows completed by these samples (see compute_job, they can be sent to other processes)
+        '''
+        samples = np.asarray(samples, dtype=np.float64)
+        jobs = []
+        # by pieces of at most step samples so that the buffer always holds the pending windows
+        size = min(self.step, self.step_line_length)
+        for start in range(0, len(samples), size):
+            self.ingest(samples[start:start + size])
+            jobs += self.jobs(final=False)
+        return jobs
+
+    def finish(self):
+        '''
+        jobs of the last windows at the end of the stream
+        '''
+        return self.jobs(final=True)
+
+    def compute(self, jobs):
+
+        records = []
+        for job in jobs:
+            t_start = time.perf_counter()
+            records.append(compute_job(job))
+            if job['kind'] == 'window':
+                self.latencies.append(time.perf_counter() - t_start)
+        return records
+
+    def ingest(self, samples):
+
+        if len(samples) == 0:
+            return
+        previous = samples[:1] if self.last is None else [self.last[0]]
+        diff = np.diff(np.concatenate((previous, samples)))
+        crossings = np.diff(np.sign(np.concatenate((previous, samples)))) != 0
+        s_abs, s_cross = (0.0, 0.0) if self.last is None else self.last[1:]
+        cum_abs = s_abs + np.cumsum(np.abs(diff))
+        cum_cross = s_cross + np.cumsum(crossings)
+        if self.last is None:   # cum[0] = 0
+            cum_abs[0] = cum_cross[0] = 0.0
+        self.y.extend(samples)
+        self.cum_abs_diff.extend(cum_abs)
+        self.cum_crossings.extend(cum_cross)
+        self.last = (samples[-1], cum_abs[-1], cum_cross[-1])
+
+        # periodograms of the segments completed by these samples
+        while (self.n_segments * self.hop + self.nperseg) <= self.y.n:
+            seg = self.y.get(self.n_segments * self.hop, self.n_segments * self.hop + self.nperseg)
+            psd = np.abs(np.fft.rfft((seg - seg.mean()) * self.window)) ** 2 * self.scale
+            psd[1:-1] *= 2
+            self.segments[self.n_segments] = psd
+            self.n_segments += 1
+        # segments that no pending window needs anymore
+        oldest = min(self.i_window * self.step, self.i_line_length * self.step_line_length) // self.hop
+        for index in [index for index in self.segments if index < oldest]:
+            del self.segments[index]
+
+    #-------------------------------------------------------------------------------------------#
+    #                                        Windows                                            #
+    #-------------------------------------------------------------------------------------------#
+
+    def jobs(self, final):
+
+        jobs = []
+        N = self.y.n
+        # a window [s, s + Ws) exists when s < N - Ws (as the sliding functions)
+        while True:
+            s = self.i_window * self.step
+            if not (s + self.Ws < N and (final or s + self.Ws + self.halo <= N)):
+                break
+            jobs.append(self.window_job(s, N))
+            self.i_window += 1
+        while True:
+            s = self.i_line_length * self.step_line_length
+            if not s + self.Ws_line_length < N:
+                break
+            jobs.append(self.line_length_job(s))
+            self.i_line_length += 1
+        return jobs
+
+    def window_job(self, s, N):
+        '''
+        inputs of the window [s, s + Ws) of the main grid: its samples with the halo
+        and what comes from the state of the engine (zero crossings, PSD of the segments)
+        '''
+        Ws = self.Ws
+        lo, hi = max(0, s - self.halo, N - self.y.capacity), min(N, s + Ws + self.halo)
+        n = (Ws - self.hop) // self.hop
+        psd = None   # windows not aligned on the segments: Welch PSD of the window in compute_job
+        if s % self.hop == 0 and all(s // self.hop + j in self.segments for j in range(n)):
+            psd = np.mean([self.segments[s // self.hop + j] for j in range(n)], axis=0)
+        return {'kind': 'window', 'index': self.i_window, 't': self.t0 + (s + Ws) / self.fs,
+                'fs': self.fs, 'Ws': Ws, 'bands': self.bands,
+                'samples': np.array(self.y.get(lo, hi)), 'offset': s - lo,
+                'n_crossings': self.cum_crossings.get(s + Ws - 1, s + Ws)[0] - self.cum_crossings.get(s, s + 1)[0],
+                'psd': psd, 'freqs': np.fft.rfftfreq(self.nperseg, 1 / self.fs)}
+
+    def line_length_job(self, s):
+        '''
+        inputs of the window [s, s + Ws_line_length) of the line length
+        '''
+        Ws = self.Ws_line_length
+        return {'kind': 'line_length', 'index': self.i_line_length, 't': self.t0 + (s + Ws) / self.fs, 'Ws': Ws,
+                'samples': np.array(self.y.get(s, s + Ws)),
+                'sum_abs_diff': self.cum_abs_diff.get(s + Ws - 1, s + Ws)[0] - self.cum_abs_diff.get(s, s + 1)[0]}
+
+    def latency_stats(self):
+        '''
+        mean, 95th percentile and maximum time (s) to compute a window
+        '''
+        if not self.latencies:
+            return {'n': 0}
+        latencies = np.array(self.latencies)
+        return {'n': len(latencies), 'mean': latencies.mean(), 'p95': np.percentile(latencies, 95), 'max': latencies.max()}
+
+
+def compute_job(job, quantiles=[0.5, 0.75, 0.85, 0.95]):
+    '''
+    record of a window from its job (RealtimeEngine.feed), only depends on the job
+    '''
+    if job['kind'] == 'line_length':
+        amp = np.sqrt(np.median(job['samples'] ** 2))
+        return {'kind': 'line_length', 'index': job['index'], 't': job['t'],
+                'line_length': job['sum_abs_diff'] / amp / job['Ws']}
+
+    fs, Ws, offset = job['fs'], job['Ws'], job['offset']
+    y = job['samples'][offset:offset + Ws]
+    record = {'kind': 'window', 'index': job['index'], 't': job['t']}
+
+    #--- band powers: window filtered with its halo
+    signals = get_filtered_signal(job['samples'], fs, job['bands'])[:, offset:offset + Ws]
+    P = np.median(signals ** 2, axis=1)
+    record['P_signals'] = P
+    record['prop_P_signals'] = P / np.sum(P)
+
+    #--- suppressions and entropies of the samples of the window
+    IES, alpha_supp = detect_suppressions_power(y, fs)[-2:]
+    record['IES_prop'], record['alpha_supp_prop'] = IES, alpha_supp
+    record['supp'] = alpha_supp + 2 * IES
+    record['entropy'] = compute_entropy(y, np.zeros(Ws + 1), Ws, Ws)[-1][0]
+    record['be'] = compute_block_entropy_k(y, np.zeros(Ws + 1), Ws, Ws)[-1][0]
+
+    #--- frequencies
+    record['f_central'] = (job['n_crossings'] / 2) / (Ws / fs)
+    psd = job['psd'] if job['psd'] is not None else welch(y, fs=fs)[1]
+    cum_power = np.cumsum(psd)
+    cum_power /= cum_power[-1]
+    index = np.searchsorted(cum_power, quantiles)
+    record['freqs_quantiles'] = job['freqs'][np.minimum(index, len(job['freqs']) - 1)]
+
+    record['state'] = get_state_0_20(record['supp'], record['prop_P_signals'])
+    return record
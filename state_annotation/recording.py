@@ -0,0 +1,178 @@
+'''
+Load path of the recordings saved as .npy
+
+The file is opened memory-mapped (copy-on-write), the offset (median)
+correction is applied chunk by chunk when the signal is requested and the time
+is kept implicit as (t0, fs) instead of a full array of the same length as the
+signal.
+'''
+
+import numpy as np
+
+
+def select_kth(x, k, chunk_size=2**20, n_bins=4096):
+    '''
+    k-th smallest value of x (as np.partition(x, k)[k]) reading x chunk by chunk:
+    each pass counts the values in n_bins bins of the current interval and keeps the
+    bin of rank k, until it holds few enough values to be read at once
+    '''
+    N = len(x)
+    lo = min(float(np.min(x[i:i + chunk_size])) for i in range(0, N, chunk_size))
+    hi = max(float(np.max(x[i:i + chunk_size])) for i in range(0, N, chunk_size))
+    last = True   # the interval is [lo, hi] when last is True, [lo, hi) otherwise
+    while True:
+        edges = np.linspace(lo, hi, n_bins + 1)
+        below, counts = 0, np.zeros(n_bins, dtype=np.int64)
+        for i in range(0, N, chunk_size):
+            c = x[i:i + chunk_size]
+            below += np.count_nonzero(c < lo)
+            inside = c[(c >= lo) & ((c <= hi) if last else (c < hi))]
+            counts += np.bincount(np.clip(np.searchsorted(edges, inside, side='right') - 1, 0, n_bins - 1), minlength=n_bins)
+        b = int(np.searchsorted(np.cumsum(counts), k - below, side='right'))
+        below += int(counts[:b].sum())
+        lo, hi, last = edges[b], edges[b + 1], last and b == n_bins - 1
+        if counts[b] <= chunk_size or np.nextafter(lo, np.inf) >= hi:
+            break
+    if np.nextafter(lo, np.inf) >= hi and not last:
+        return lo
+    values = np.concatenate([c[(c >= lo) & ((c <= hi) if last else (c < hi))]
+                             for c in (x[i:i + chunk_size] for i in range(0, N, chunk_size))])
+    return float(np.partition(values, k - below)[k - below])
+
+
+def chunked_median(x, chunk_size=2**20):
+    '''
+    median of x (equal to np.median) without loading more than chunk_size values at once
+    '''
+    N = len(x)
+    if N <= chunk_size:
+        return float(np.median(x))
+    low = select_kth(x, (N - 1) // 2, chunk_size)
+    high = low if N % 2 else select_kth(x, N // 2, chunk_size)
+    return (low + high) / 2
+
+
+class TimeAxis:
+    '''
+    Implicit time axis t[i] = t0 + i / fs
+
+    It can be indexed like the time array it replaces (t[i], t[a:b], t[indices],
+    t[mask], len(t)), so it can be sent to Compute and to the sliding functions,
+    and it is only materialized when converted with np.asarray.
+    '''
+
+    def __init__(self, N, fs, t0=0):
+        self.N = N
+        self.fs = fs
+        self.t0 = t0
+
+    def __len__(self):
+        return self.N
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.N)
+            return self.t0 + np.arange(start, stop, step) / self.fs
+        if np.ndim(i) != 0 or isinstance(i, (bool, np.bool_)):
+            return self.t0 + self.indices(i) / self.fs
+        if i < 0:
+            i += self.N
+        if i < 0 or i >= self.N:
+            raise IndexError('time index out of range')
+        return self.t0 + i / self.fs
+
+    def indices(self, i):
+        '''
+        samples of an array of indices (negative ones counted from the end) or of a boolean mask
+        '''
+        index = np.asarray(i)
+        if index.dtype == bool:
+            if index.shape != (self.N,):
+                raise IndexError('boolean index of shape %s for a time axis of %d samples' % (index.shape, self.N))
+            return np.flatnonzero(index)
+        if index.size == 0:
+            return index.astype(np.intp)
+        if not np.issubdtype(index.dtype, np.integer):
+            raise IndexError('only integers, slices and integer or boolean arrays are valid time indices')
+        index = np.where(index < 0, index + self.N, index)
+        if np.any((index < 0) | (index >= self.N)):
+            raise IndexError('time index out of range')
+        return index
+
+    def __array__(self, dtype=None, copy=None):
+        t = self[:]
+        return t if dtype is None else t.astype(dtype)
+
+    @property
+    def duration(self):
+        return self.N / self.fs
+
+
+class Recording:
+    '''
+    Memory-mapped recording
+
+    Inputs:
+    - path            <-- path of the .npy file
+    - fs              <-- sampling frequency
+    - drop_last       <-- remove the last sample (as done by the viewer)
+    - correct_offset  <-- subtract the median of the signal
+    - chunk_size      <-- number of samples corrected at once
+    '''
+
+    def __init__(self, path, fs, drop_last=True, correct_offset=True, chunk_size=2**20):
+        self.path = path
+        self.fs = fs
+        # copy-on-write mapping: the file is never modified but the array is writable,
+        # as required by some extensions (pywt) even when they only read it
+        self.raw = np.load(path, mmap_mode='c')
+        if drop_last:
+            self.raw = self.raw[:-1]   # view of the memmap, no copy
+        self.N = len(self.raw)
+        self.t = TimeAxis(self.N, fs)
+        self.correct_offset = correct_offset
+        self.chunk_size = chunk_size
+        self._offset = None
+
+    def __len__(self):
+        return self.N
+
+    @property
+    def offset(self):
+        '''
+        median of the raw signal, computed on first use
+        '''
+        if self._offset is None:
+            self._offset = chunked_median(self.raw, self.chunk_size) if self.correct_offset else 0.0
+        return self._offset
+
+    def chunks(self, chunk_size=None):
+        '''
+        yields (start, corrected chunk) over the recording
+        '''
+        chunk_size = chunk_size or self.chunk_size
+        for start in range(0, self.N, chunk_size):
+            yield start, self.raw[start:start + chunk_size] - self.offset
+
+    def read(self, start, stop, dtype=np.float64):
+        '''
+        corrected samples start:stop (copy)
+        '''
+        return np.subtract(self.raw[start:stop], self.offset, dtype=dtype)
+
+    def signal(self, dtype=np.float64):
+        '''
+        Corrected signal as an array in memory, filled chunk by chunk so that no
+        temporary copy of the whole recording is created besides the output.
+        When there is nothing to correct and the dtype already matches, the
+        memory-mapped data is returned as is.
+        '''
+        if not self.correct_offset and self.raw.dtype == dtype:
+            return self.raw
+        y = np.empty(self.N, dtype=dtype)
+        offset = self.offset
+        for start in range(0, self.N, self.chunk_size):
+            stop = min(start + self.chunk_size, self.N)
+            np.subtract(self.raw[start:stop], offset, out=y[start:stop])
+        return y
+
@@ -0,0 +1,213 @@
+'''
+Mergeable quantile summaries of the features for the box plots
+
+A KLL sketch keeps a few hundred weighted values of a stream whatever its
+length: the values are added to level 0 and a level that exceeds its capacity
+is sorted and every other value (random offset) is promoted to the next level
+with twice the weight. The rank error of a quantile is about 1.7 / k. Two
+sketches are merged by concatenating their levels, so the sketches of the
+recordings (computed separately, e.g. in different workers) give the sketch of
+the whole corpus.
+
+FeatureSketches keeps one sketch per (feature, state) and gives the statistics
+of ax.bxp, so that the box plots of the whole corpus are drawn from a file of a
+few hundred kilobytes instead of every value of every epoch.
+'''
+
+import json
+import numpy as np
+
+from state_annotation.features import FEATURE_NAMES, N_STATES, group_by_state
+
+K = 200
+
+
+class KLLSketch:
+    '''
+    Inputs:
+    - k     <-- size parameter (capacity of the top level), the rank error is about 1.7 / k
+    - seed  <-- seed of the random offsets of the compactions
+    '''
+
+    def __init__(self, k=K, seed=0):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.zeros(0)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.sum = 0.0
+
+    def capacity(self, h):
+
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - h - 1))))
+
+    def update(self, values):
+        '''
+        adds values to the sketch (the values that are not finite are ignored)
+        '''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.sum += values.sum()
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.compress()
+
+    def merge(self, other):
+        '''
+        adds the values summarized by another sketch
+        '''
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate((self.levels[h], items))
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sum += other.sum
+        self.compress()
+
+    def compress(self):
+
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self.capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                items = np.sort(self.levels[h])
+                # with an odd number of values the largest one stays at this level
+                n_keep = len(items) % 2
+                promoted = items[self.rng.integers(2):len(items) - n_keep:2]
+                self.levels[h] = items[len(items) - n_keep:]
+                self.levels[h + 1] = np.concatenate((self.levels[h + 1], promoted))
+                h = 0   # adding a level lowers the capacity of the others
+            else:
+                h += 1
+
+    def is_exact(self):
+
+        return len(self.levels) == 1
+
+    def weighted_items(self):
+        '''
+        sorted retained values and their cumulated weights
+        '''
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_h), 2.0 ** h) for h, items_h in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantile(self, q):
+        '''
+        approximate quantile(s) q in [0, 1], the minimum and maximum are exact
+        (all the quantiles are exact as long as no value was compacted)
+        '''
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        if self.is_exact():
+            return np.percentile(self.levels[0], q * 100)
+        items, cum_weights = self.weighted_items()
+        index = np.searchsorted(cum_weights, q * cum_weights[-1], side='left')
+        values = items[np.minimum(index, len(items) - 1)]
+        return np.where(q <= 0, self.min, np.where(q >= 1, self.max, values))
+
+    def box_stats(self, label=None, whis=1.5):
+        '''
+        statistics of a box (format of matplotlib.cbook.boxplot_stats and ax.bxp),
+        the fliers are only given while the sketch is exact
+        '''
+        if self.n == 0:
+            return {'label': label, 'mean': np.nan, 'med': np.nan, 'q1': np.nan, 'q3': np.nan, 'iqr': np.nan,
+                    'cilo': np.nan, 'cihi': np.nan, 'whislo': np.nan, 'whishi': np.nan, 'fliers': np.zeros(0)}
+        q1, med, q3 = self.quantile([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        items, _ = self.weighted_items()
+        # whiskers: most extreme values within whis * iqr of the quartiles
+        low = items[items >= q1 - whis * iqr]
+        high = items[items <= q3 + whis * iqr]
+        whislo = self.min if self.min >= q1 - whis * iqr else (low.min() if len(low) else q1)
+        whishi = self.max if self.max <= q3 + whis * iqr else (high.max() if len(high) else q3)
+        whislo, whishi = min(whislo, q1), max(whishi, q3)
+        fliers = items[(items < whislo) | (items > whishi)] if self.is_exact() else np.zeros(0)
+        notch = 1.57 * iqr / np.sqrt(self.n)
+        return {'label': label, 'mean': self.sum / self.n, 'med': med, 'q1': q1, 'q3': q3, 'iqr': iqr,
+                'cilo': med - notch, 'cihi': med + notch, 'whislo': whislo, 'whishi': whishi, 'fliers': fliers}
+
+
+class FeatureSketches:
+    '''
+    one KLLSketch per (feature, state)
+
+    Inputs:
+    - features  <-- names of the features (columns of the matrices given to update)
+    - n_states  <-- number of states
+    '''
+
+    def __init__(self, features=FEATURE_NAMES, n_states=N_STATES, k=K):
+        self.features = list(features)
+        self.n_states = n_states
+        self.k = k
+        self.sketches = [[KLLSketch(k) for i in range(n_states)] for feature in self.features]
+
+    def update(self, state, X):
+        '''
+        Inputs:
+        - state  <-- state of each row
+        - X      <-- matrix (n_rows, n_features) of the features (e.g. stack_features)
+        '''
+        X_state, offsets = group_by_state(state, X, self.n_states)
+        for i in range(self.n_states):
+            if offsets[i + 1] > offsets[i]:
+                for j in range(len(self.features)):
+                    self.sketches[j][i].update(X_state[offsets[i]:offsets[i + 1], j])
+
+    def merge(self, other):
+
+        if other.features != self.features or other.n_states != self.n_states:
+            raise ValueError('the sketches have different features or states')
+        for j in range(len(self.features)):
+            for i in range(self.n_states):
+                self.sketches[j][i].merge(other.sketches[j][i])
+
+    def box_stats(self, feature, whis=1.5):
+        '''
+        list (one per state) of the statistics of ax.bxp
+        '''
+        j = self.features.index(feature)
+        return [self.sketches[j][i].box_stats(label=i, whis=whis) for i in range(self.n_states)]
+
+    def save(self, path):
+
+        sketches = [sketch for row in self.sketches for sketch in row]
+        n_levels = max(len(sketch.levels) for sketch in sketches)
+        sizes = np.zeros((len(sketches), n_levels), dtype=np.int64)
+        for s, sketch in enumerate(sketches):
+            sizes[s, :len(sketch.levels)] = [len(items) for items in sketch.levels]
+        header = {'features': self.features, 'n_states': self.n_states, 'k': self.k}
+        with open(path, 'wb') as file:
+            np.savez(file, header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+                     items=np.concatenate([items for sketch in sketches for items in sketch.levels]).astype(np.float32),
+                     sizes=sizes, stats=np.array([[sketch.n, sketch.min, sketch.max, sketch.sum] for sketch in sketches]))
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as data:
+            header = json.loads(data['header'].tobytes())
+            items, sizes, stats = data['items'].astype(np.float64), data['sizes'], data['stats']
+        self = cls(header['features'], header['n_states'], header['k'])
+        start = 0
+        for s, sketch in enumerate(sketch for row in self.sketches for sketch in row):
+            sketch.levels = []
+            for size in sizes[s]:
+                sketch.levels.append(items[start:start + size])
+                start += size
+            while len(sketch.levels) > 1 and len(sketch.levels[-1]) == 0:
+                sketch.levels.pop()
+            sketch.n, sketch.min, sketch.max, sketch.sum = int(stats[s, 0]), stats[s, 1], stats[s, 2], stats[s, 3]
+        return self
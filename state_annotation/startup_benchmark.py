@@ -0,0 +1,113 @@
+'''
+Cold-start time of the viewer (state_app.py)
+
+Each run starts a new interpreter that imports state_app, creates the
+QApplication and the EEGViewer and shows it (event loop processed once). The
+report gives the time of each step, the wall time of the process until the
+window is shown, the slowest imports (python -X importtime) and the heavy
+modules loaded at startup: scipy.signal, scipy.stats, scipy.ndimage, pywt and
+matplotlib are only needed once a recording is opened and must be imported on
+first use.
+
+The run fails (exit code 1) when the median time to the window exceeds the
+budget or when a heavy module is loaded at startup.
+
+    python -m state_annotation.startup_benchmark --runs 5 --budget 1.0 --out startup.json
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+HEAVY_MODULES = ['scipy.signal', 'scipy.stats', 'scipy.ndimage', 'scipy.interpolate', 'pywt', 'matplotlib']
+
+# run in the new interpreter, prints the timings (json) on its last line
+PROBE = '''
+import json, sys, time
+t0 = time.perf_counter()
+import state_app
+t1 = time.perf_counter()
+app = state_app.QApplication(sys.argv[:1])
+viewer = state_app.EEGViewer()
+viewer.show()
+app.processEvents()
+t2 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'window': t2 - t1, 'modules': [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def environment():
+
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')   # no display needed
+    return env
+
+
+def run_once(env):
+    '''
+    timings (s) of a cold start: import of state_app, creation of the window, wall time of the process
+    '''
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', PROBE], env=env, capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    # the process is ended once the window is shown: its wall time includes the start of the interpreter
+    result['total'] = time.perf_counter() - t0
+    return result
+
+
+def slowest_imports(env, n=15):
+    '''
+    modules with the largest cumulative import time (s) when state_app is imported
+    '''
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import state_app'], env=env,
+                         capture_output=True, text=True, check=True)
+    times = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|').split('|')]
+        times.append((name, int(cumulative_us) / 1e6, int(self_us) / 1e6))
+    times.sort(key=lambda item: -item[1])
+    return [{'module': name, 'cumulative': cumulative, 'self': own} for name, cumulative, own in times[:n]]
+
+
+def benchmark(runs=5, budget=1.0):
+
+    env = environment()
+    results = [run_once(env) for _ in range(runs)]
+    summary = {key: {'median': float(np.median([r[key] for r in results])), 'min': float(np.min([r[key] for r in results]))}
+               for key in ('import', 'window', 'total')}
+    modules = sorted(set(m for r in results for m in r['modules']))
+    failures = []
+    if summary['total']['median'] > budget:
+        failures.append('window shown after %.2f s (budget %.2f s)' % (summary['total']['median'], budget))
+    if modules:
+        failures.append('heavy modules loaded at startup: ' + ', '.join(modules))
+    return {'runs': runs, 'budget': budget, 'summary': summary, 'heavy_modules': modules,
+            'slowest_imports': slowest_imports(env), 'failures': failures, 'passed': not failures}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold-start time of the viewer')
+    parser.add_argument('--runs', type=int, default=5, help='number of cold starts')
+    parser.add_argument('--budget', type=float, default=1.0, help='maximal median time (s) until the window is shown')
+    parser.add_argument('--out', default=None, help='report (json)')
+    args = parser.parse_args()
+
+    result = benchmark(args.runs, args.budget)
+    for key, values in result['summary'].items():
+        print('%-7s median %.3f s  min %.3f s' % (key, values['median'], values['min']))
+    print('slowest imports:')
+    for item in result['slowest_imports'][:10]:
+        print('  %-40s %.3f s' % (item['module'], item['cumulative']))
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(result, file, indent=1)
+    print('passed' if result['passed'] else 'FAILED: ' + '; '.join(result['failures']))
+    sys.exit(0 if result['passed'] else 1)
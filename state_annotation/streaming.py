@@ -0,0 +1,128 @@
+'''
+Compute with a fixed memory budget for recordings larger than the memory
+
+The recording is read from its memmap chunk by chunk (Recording.read, the
+offset is the exact median computed by chunks). The chunks are aligned on the
+window grid and the windows that overlap two chunks are read again with the
+next one. The band filters are run on each chunk with a halo on both sides,
+as in parallel_compute.py, after which the forward-backward filter of the
+whole signal is reached (~1e-12 relative on the powers).
+
+The per-window features of each chunk are appended to the files of an output
+folder and packed in one .npy per feature at the end (opened memory-mapped).
+The peak memory is set by `memory_budget` (~224 bytes per sample of a chunk),
+whatever the length of the recording.
+
+    recording = Recording(path, fs)
+    C = StreamingCompute(memory_budget=256 * 2**20, out_folder='features_rec/')
+    C.get_data(recording.t, recording, fs, Ws, step, Ws_line_length, step_line_length)
+    C.run()
+'''
+
+import os
+import shutil
+import numpy as np
+
+from state_annotation.compute import PRECISIONS
+from state_annotation.parallel_compute import ParallelCompute, chunk_features
+
+# peak memory of chunk_features per sample of a chunk (measured 130-210 B)
+BYTES_PER_SAMPLE = 224
+
+# outputs of chunk_features: name --> family of windows
+OUTPUTS = {'IES_prop': 'main', 'alpha_supp_prop': 'main', 'freqs_quantiles': 'main', 'f_central': 'main',
+           'P_signals': 'main', 'entropy': 'entropy', 'be': 'entropy', 'line_length': 'line_length'}
+
+
+class StreamingCompute(ParallelCompute):
+    '''
+    Compute whose run() reads the signal by chunks within a memory budget
+
+    y (get_data) can be a Recording (read with its offset correction) or any array
+    that can be sliced without loading it (e.g. np.load(path, mmap_mode='r')).
+
+    Inputs:
+    - memory_budget  <-- peak memory (bytes) of the computation of a chunk
+    - out_folder     <-- folder of the per-window features (.npy), kept in memory when None
+    - halo           <-- samples filtered on each side of a chunk (HALO seconds by default)
+    '''
+
+    def __init__(self, memory_budget=256 * 2**20, out_folder=None, halo=None):
+        super().__init__(n_workers=1, halo=halo)
+        self.memory_budget = memory_budget
+        self.out_folder = out_folder
+
+    def read(self, lo, hi):
+
+        dtype = PRECISIONS[self.precision]
+        if hasattr(self.y, 'read'):
+            return self.y.read(lo, hi, dtype=dtype)
+        return np.array(self.y[lo:hi], dtype=dtype)
+
+    def chunk_windows(self):
+        '''
+        number of windows of a chunk that fits in the memory budget
+        '''
+        halo = self.get_halo()
+        samples = self.memory_budget // BYTES_PER_SAMPLE - 2 * halo - max(self.Ws, self.Ws_line_length)
+        n = samples // max(self.step, self.step_line_length)
+        if n < 1:
+            raise ValueError('memory budget of %d bytes too small for windows of %d samples' % (self.memory_budget, self.Ws))
+        return int(n)
+
+    def run(self):
+
+        N = len(self.y)
+        counts = self.window_counts()
+        n_windows = self.chunk_windows()
+        n_chunks = max(1, -(-counts['main'] // n_windows))
+        halo = self.get_halo()
+        params = self.chunk_params()
+        dtype = np.dtype(PRECISIONS[self.precision])
+
+        if self.out_folder is not None:
+            tmp = self.out_folder.rstrip('/') + '.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            files = {name: open(os.path.join(tmp, name + '.part'), 'wb') for name in OUTPUTS}
+        outs = []
+        for k in range(n_chunks):
+            # windows of each family starting in the samples [k * n_windows * step, (k + 1) * n_windows * step)
+            lo, hi = k * n_windows * self.step, (k + 1) * n_windows * self.step
+            last = k == n_chunks - 1
+            ranges = {'main': (k * n_windows, counts['main'] if last else (k + 1) * n_windows),
+                      'entropy': (k * n_windows, counts['entropy'] if last else (k + 1) * n_windows),
+                      'line_length': (min(counts['line_length'], -(-lo // self.step_line_length)),
+                                      counts['line_length'] if last else min(counts['line_length'], -(-hi // self.step_line_length)))}
+            out = chunk_features(self.read, N, self.fs, params, ranges, halo)
+            if self.out_folder is None:
+                outs.append(out)
+                continue
+            for name, values in out.items():
+                # 2D outputs are saved window by window (rows)
+                files[name].write(np.ascontiguousarray(values.T if values.ndim == 2 else values, dtype=dtype).tobytes())
+
+        if self.out_folder is not None:
+            for file in files.values():
+                file.close()
+            for name, family in OUTPUTS.items():
+                n_rows = counts[family]
+                path = os.path.join(tmp, name + '.part')
+                n_columns = os.path.getsize(path) // dtype.itemsize // n_rows if n_rows else 0
+                shape = (n_rows, n_columns) if name in ('P_signals', 'freqs_quantiles') else (n_rows,)
+                header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape}
+                with open(os.path.join(tmp, name + '.npy'), 'wb') as file:
+                    np.lib.format.write_array_header_1_0(file, header)
+                    with open(path, 'rb') as part:
+                        shutil.copyfileobj(part, file, 2**20)
+                os.remove(path)
+            shutil.rmtree(self.out_folder, ignore_errors=True)
+            os.replace(tmp, self.out_folder)
+            out = {}
+            for name in OUTPUTS:
+                values = np.load(os.path.join(self.out_folder, name + '.npy'), mmap_mode='r')
+                out[name] = values.T if values.ndim == 2 else values
+            outs = [out]
+        self.stitch(outs, counts)
+        if self.out_folder is not None:
+            np.save(os.path.join(self.out_folder, 'state.npy'), self.state)
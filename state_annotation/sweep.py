@@ -0,0 +1,193 @@
+'''
+Parameter sweep of Compute on one recording
+
+Every configuration (Ws, step, Ws_line_length, step_line_length, bands) of a
+grid gives a Compute object, but the intermediates are computed once for the
+whole grid:
+- the filtered signal and its square for each band (a band shared by several
+  band lists is filtered once)
+- the block statistics of BlockFeatures (|diff|, zero crossings, Welch
+  segments) from which the line length, central frequency and frequency
+  quantiles of every window size are assembled
+- the features that only depend on (Ws, step) (suppressions, entropies,
+  powers, ...) are computed once per (Ws, step) and shared by the configurations
+
+    results = sweep(t, y, fs, param_grid(Ws=[30 * fs, 60 * fs], step=[10 * fs], bands=[BANDS, BANDS_2]))
+    C = results[(60 * fs, 10 * fs, 30 * fs, 10 * fs, key_bands(BANDS))]
+'''
+
+import itertools
+from math import gcd
+import numpy as np
+
+import Functions.sliding_fct as sliding
+from Functions.block_fct import BlockFeatures
+from Functions.filter import filter_butterworth
+from state_annotation.compute import Compute, BANDS
+
+
+def key_bands(bands):
+
+    return tuple(tuple(band) for band in bands)
+
+
+def param_key(params):
+    '''
+    tuple (Ws, step, Ws_line_length, step_line_length, bands) indexing the results
+    '''
+    return (params['Ws'], params['step'], params['Ws_line_length'], params['step_line_length'], key_bands(params['bands']))
+
+
+def param_grid(Ws, step, Ws_line_length=None, step_line_length=None, bands=None):
+    '''
+    list of the parameter sets of the product of the given lists
+    (the line length uses Ws and step when its lists are not given)
+    '''
+    grid = []
+    for values in itertools.product(Ws, step, Ws_line_length or [None], step_line_length or [None], bands or [BANDS]):
+        params = dict(zip(['Ws', 'step', 'Ws_line_length', 'step_line_length', 'bands'], values))
+        params['Ws_line_length'] = params['Ws_line_length'] or params['Ws']
+        params['step_line_length'] = params['step_line_length'] or params['step']
+        grid.append(params)
+    return grid
+
+
+class SharedIntermediates:
+    '''
+    intermediates of a recording shared by the configurations of a sweep
+
+    Inputs:
+    - block  <-- block length of BlockFeatures (the gcd of the window sizes and steps of the grid)
+    '''
+
+    def __init__(self, t, y, fs, block):
+        self.t = t
+        self.y = y
+        self.fs = fs
+        self.blocks = BlockFeatures(y, t, fs, block)
+        self.filtered = {}   # band --> filtered signal
+        self.squared = {}    # band --> squared filtered signal
+        self.windowed = {}   # (name, Ws, step) --> output of a sliding function
+
+    def band_signal(self, band):
+
+        band = tuple(band)
+        if band not in self.filtered:
+            self.filtered[band] = filter_butterworth(self.y, self.fs, band)
+        return self.filtered[band]
+
+    def band_power(self, band, Ws, step):
+        '''
+        median of the squared filtered signal on each window (as sliding_fct.power_nD)
+        '''
+        band = tuple(band)
+        if band not in self.squared:
+            self.squared[band] = self.band_signal(band) ** 2
+        key = ('power', band, Ws, step)
+        if key not in self.windowed:
+            starts = np.arange(0, len(self.y) - Ws, step)
+            power = np.zeros(len(starts))
+            for c in range(0, len(starts), 256):
+                index = starts[c:c + 256, None] + np.arange(Ws)
+                power[c:c + 256] = np.median(self.squared[band][index], axis=1)
+            self.windowed[key] = power
+        return self.windowed[key]
+
+    def window(self, name, Ws, step, fct):
+        '''
+        output of fct(Ws, step), computed once per (name, Ws, step)
+        '''
+        key = (name, Ws, step)
+        if key not in self.windowed:
+            self.windowed[key] = fct(Ws, step)
+        return self.windowed[key]
+
+    def fits_blocks(self, Ws, step, segments=False):
+
+        unit = self.blocks.nperseg - self.blocks.noverlap if segments else 1
+        return Ws % self.blocks.block == 0 and step % self.blocks.block == 0 and self.blocks.block % unit == 0
+
+
+class SweepCompute(Compute):
+    '''
+    Compute whose features are taken from the shared intermediates of a sweep
+    '''
+
+    def __init__(self, shared):
+        super().__init__()
+        self.shared = shared
+
+    def get_power(self):
+
+        S = self.shared
+        self.t_list = S.window('t_list', self.Ws, self.step,
+            lambda Ws, step: [self.t[Ws + i * step] for i in range(len(range(0, len(self.y) - Ws, step)))])
+        self.P_signals = np.array([S.band_power(band, self.Ws, self.step) for band in self.bands])
+
+    def get_supp_ratio(self):
+
+        self.IES_prop, self.alpha_supp_prop = self.shared.window('supp', self.Ws, self.step,
+            lambda Ws, step: sliding.supp_power_prop(self.y, self.t, Ws, step, self.fs)[-2:])
+        self.supp = self.alpha_supp_prop + 2 * self.IES_prop
+
+    def get_be(self):
+
+        self.be = self.shared.window('be', self.Ws, self.step,
+            lambda Ws, step: sliding.compute_block_entropy_k(self.y, self.t, Ws, step)[-1])
+
+    def get_entropy(self):
+
+        self.entropy = self.shared.window('entropy', self.Ws, self.step,
+            lambda Ws, step: sliding.compute_entropy(self.y, self.t, Ws, step)[-1])
+
+    def get_line_length(self):
+
+        S = self.shared
+        if S.fits_blocks(self.Ws_line_length, self.step_line_length):
+            fct = S.blocks.line_length
+        else:
+            fct = lambda Ws, step: sliding.compute_line_length(self.y, self.t, Ws, step)
+        self.t_line_length, self.line_length = S.window('line_length', self.Ws_line_length, self.step_line_length, fct)
+
+    def get_freqs_quantiles(self):
+
+        S = self.shared
+        if S.fits_blocks(self.Ws, self.step, segments=True):
+            fct = lambda Ws, step: S.blocks.freqs_quantiles(Ws, step)[-1]
+        else:
+            fct = lambda Ws, step: sliding.compute_freqs_quantiles(self.y, self.t, Ws, step, self.fs)[-1]
+        self.freqs_quantiles = S.window('freqs_quantiles', self.Ws, self.step, fct)
+
+    def get_f_main(self):
+
+        S = self.shared
+        if S.fits_blocks(self.Ws, self.step):
+            fct = lambda Ws, step: S.blocks.central_frequency(Ws, step)[-1]
+        else:
+            fct = lambda Ws, step: sliding.compute_central_frequency(self.y, self.t, self.fs, Ws, step)[-1]
+        self.f_central = S.window('f_central', self.Ws, self.step, fct)
+
+
+def sweep(t, y, fs, grid):
+    '''
+    Inputs:
+    - t, y, fs  <-- recording (as Compute.get_data)
+    - grid      <-- list of parameter sets (dict with Ws, step, Ws_line_length, step_line_length, bands), see param_grid
+    Output:
+    - results   <-- dictionnary param_key(params) --> Compute object after run()
+    '''
+    block = 0
+    for params in grid:
+        for name in ('Ws', 'step', 'Ws_line_length', 'step_line_length'):
+            block = gcd(block, int(params[name]))
+    shared = SharedIntermediates(t, np.asarray(y), fs, block)
+
+    results = {}
+    for params in grid:
+        params = dict({'bands': BANDS}, **params)
+        C = SweepCompute(shared)
+        C.get_data(t, shared.y, fs, params['Ws'], params['step'], params['Ws_line_length'], params['step_line_length'],
+                   bands=params['bands'])
+        C.run()
+        results[param_key(params)] = C
+    return results
@@ -1,3 +1,4 @@
+import os
 import sys
 import numpy as np
 from PyQt6.QtWidgets import (
@@ -5,13 +6,36 @@ from PyQt6.QtWidgets import (
     QFileDialog, QLabel, QSpinBox, QHBoxLayout, QGraphicsEllipseItem,
     QRubberBand, QSlider
 )
-from PyQt6.QtCore import Qt, QPointF, QRect, QSize
+from PyQt6.QtCore import Qt, QPointF, QRect, QSize, QTimer
+from PyQt6.QtGui import QTransform, QShortcut, QKeySequence
 from Functions.time_frequency import spectrogram
 import pyqtgraph as pg
-from matplotlib import cm
 from state_annotation.compute import Compute
-from pathlib import Path
-from scipy.signal import savgol_filter
+from state_annotation.recording import Recording
+from state_annotation.feature_cache import FeatureCache
+from state_annotation.journal import EditJournal
+from state_annotation.annotation_io import annotation_path, find_annotation, load_annotation, save_annotation
+import scipy as sc   # scipy.signal is loaded on the first smoothing
+
+# lookup tables of the colormaps, built once
+_LUTS = {}
+
+# segments (x, value) of the red, green and blue channels of matplotlib's 'jet',
+# so that the spectrogram does not need to import matplotlib
+JET = {'red': [(0., 0.), (0.35, 0.), (0.66, 1.), (0.89, 1.), (1., 0.5)],
+       'green': [(0., 0.), (0.125, 0.), (0.375, 1.), (0.64, 1.), (0.91, 0.), (1., 0.)],
+       'blue': [(0., 0.5), (0.11, 1.), (0.34, 1.), (0.65, 0.), (1., 0.)]}
+
+def get_lut(name):
+    if name not in _LUTS:
+        x = np.linspace(0, 1, 256)
+        if name == 'jet':
+            rgb = np.stack([np.interp(x, *zip(*JET[channel])) for channel in ('red', 'green', 'blue')], axis=1)
+        else:
+            from matplotlib import colormaps   # other colormaps (imports matplotlib)
+            rgb = colormaps[name](x)[:, :3]
+        _LUTS[name] = (rgb * 255).astype(np.uint8)
+    return _LUTS[name]
 
 class RubberbandPlot(pg.PlotWidget):
     def __init__(self, viewer):
@@ -66,7 +90,8 @@ class RubberbandPlot(pg.PlotWidget):
             self.plotItem.vb.setMouseEnabled(x=True, y=True)
 
 class DraggablePoint(QGraphicsEllipseItem):
-    def __init__(self, x, y, radius=5, index=None, update_callback=None, selection_callback=None):
+    def __init__(self, x, y, radius=5, index=None, update_callback=None, selection_callback=None,
+                 press_callback=None, release_callback=None):
         super().__init__(-radius, -radius, 2*radius, 2*radius)
         self.setPos(x, y)
         self.setBrush(pg.mkBrush('g'))
@@ -78,6 +103,9 @@ class DraggablePoint(QGraphicsEllipseItem):
         self.fixed_x = x
         self.update_callback = update_callback
         self.selection_callback = selection_callback
+        # start and end of a drag (one edit of the journal per drag)
+        self.press_callback = press_callback
+        self.release_callback = release_callback
         self.selected = False
 
     def toggle_selection(self):
@@ -88,18 +116,25 @@ class DraggablePoint(QGraphicsEllipseItem):
         if event.modifiers() == Qt.KeyboardModifier.ControlModifier:
             self.toggle_selection()
         else:
+            if self.press_callback:
+                self.press_callback()
             super().mousePressEvent(event)
 
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        if self.release_callback:
+            self.release_callback(self.index)
+
     def itemChange(self, change, value):
         if change == self.GraphicsItemChange.ItemPositionChange:
             new_y = round(np.clip(value.y(), 0, 21))  # integer range
             new_pos = QPointF(self.fixed_x, new_y)
-            if self.update_callback:
-                self.update_callback(self.index, new_y)
 
-            # Apply same y to selected points (group move)
+            # Apply same y to selected points (group move, includes this point)
             if self.selection_callback and self.selected:
                 self.selection_callback(new_y)
+            elif self.update_callback:
+                self.update_callback(self.index, new_y)
 
             return new_pos
         return super().itemChange(change, value)
@@ -150,10 +185,23 @@ class EEGViewer(QMainWindow):
 
         #  marker for updating multiple points at once
         self._updating_group = False
+        #  marker for moving points from the undo/redo of the journal
+        self._applying_edits = False
+        # state list at the press on a point, the drag is recorded in the journal at the release
+        self._drag_start = None
 
         # folder to save updated state file
         self.save_folder = 'data_state_annotation/'
 
+        # journal of the edits (autosave between two saves of the state file, undo/redo)
+        self.journal_folder = 'journal_state_annotation/'
+        self.journal = None
+        self.journal_timer = QTimer(self)
+        self.journal_timer.timeout.connect(self.sync_journal)
+        self.journal_timer.start(1000)
+        QShortcut(QKeySequence.StandardKey.Undo, self, activated=self.undo_edit)
+        QShortcut(QKeySequence.StandardKey.Redo, self, activated=self.redo_edit)
+
         # label for visualization of plot values
         self.coord_label = QLabel("Cursor: (X, Y)")
         self.layout.addWidget(self.coord_label)
@@ -201,7 +249,7 @@ class EEGViewer(QMainWindow):
         spec_ctrl.addWidget(self.delta_f_input)
 
         self.apply_spec_btn = QPushButton("Update Spectrogram")
-        self.apply_spec_btn.clicked.connect(self.display_spectrogram)
+        self.apply_spec_btn.clicked.connect(self.update_spectrogram)
         spec_ctrl.addWidget(self.apply_spec_btn)
 
         self.layout.addLayout(spec_ctrl)
@@ -209,8 +257,23 @@ class EEGViewer(QMainWindow):
         # marker to identify which plot to display
         self.plot_id = None
 
+        # plot items of each view (created once per recording, attached/detached when switching view)
+        self.view_items = {}
+        self.attached_items = [[] for _ in range(3)]
+        # derived data (smoothed curves, spectrogram) cached for the current recording
+        self.derived = {}
+        self.spectro_img = None
+
+        # legends are created once, named items are added/removed with their view
+        self.plots[0].addLegend()
+        self.plots[1].addLegend()
+
         # initialize compute object
         self.C = Compute()
+        # features cached on disk between sessions
+        self.feature_cache = FeatureCache()
+        # thread evaluating the features of the current recording (None once cached)
+        self.feature_thread = None
 
     def load_file(self):
         path, _ = QFileDialog.getOpenFileName(self, "Open .npy file", "recordings_npy/", "NumPy files (*.npy)")
@@ -220,63 +283,65 @@ class EEGViewer(QMainWindow):
         
         #--- check whether or not a save for this recording already exists
         self.D_save = None # initialize to None
-        path_save = self.save_folder + 'D_' + self.name
-        my_file = Path(path_save)
-        if my_file.is_file():
-            self.D_save = np.load(path_save, allow_pickle=True).item()
-
-        self.data = np.load(path)
-        self.data = self.data[:-1]
-        self.data = self.data - np.median(self.data)
+        path_save = find_annotation(self.save_folder, self.name)
+        if path_save is not None:
+            self.D_save = load_annotation(path_save)
+
+        #--- memory-mapped recording, offset corrected chunk by chunk and implicit time axis
         self.fs = self.fs_input.value()
-        t = np.arange(len(self.data)) / self.fs
+        self.recording = Recording(path, self.fs)
+        self.data = self.recording.signal()
 
-        #--- send data to compute object
-        self.C.get_data(t, self.data, self.fs, 30 * self.fs, 10 *self.fs, 30 * self.fs, 10 * self.fs)
-        #--- run to get all variables
-        self.C.run()
+        #--- send data to a new compute object (the previous one may still be evaluated in the background)
+        self.C = Compute()
+        self.C.get_data(self.recording.t, self.data, self.fs, 30 * self.fs, 10 *self.fs, 30 * self.fs, 10 * self.fs)
+        #--- reuse the variables cached for this recording and parameters, or evaluate them in the background:
+        # the views compute on first access only what they display (View 0: power, suppressions and state)
+        self.feature_thread = self.feature_cache.run(self.C, path, background=True, drop_last=True, correct_offset=True)
         #--- call to plot the data 
         self.update_all()
 
     def update_all(self):
-        self.display_signal()
-        self.display_spectrogram()
-        self.display_state()
+        self.reset_views()
+        self.plot_id = 'spectro'
+        self.toggle_view()
+        self.plots[0].enableAutoRange(axis='x')
         self.display_editable_state()
 
     def display_signal(self):
-        self.plots[0].clear()
-        self.plots[0].setLogMode(y=False)
-        t = np.arange(len(self.data)) / self.fs
-        self.plots[0].plot(t, self.data, pen='b')
-        self.plots[0].setTitle("EEG Signal")
-        self.plots[0].setYRange(-75, 75)
+        # samples are plotted against their index and scaled to the time axis (no time array)
+        curve = pg.PlotDataItem(self.data, pen='b')
+        curve.setTransform(QTransform.fromScale(1 / self.fs, 1))
+        curve.setPos(self.recording.t.t0, 0)
+        return [curve], "EEG Signal", False, (-75, 75)
 
     def display_spectrogram(self):
-        self.plots[1].clear()
-        self.plots[1].setLogMode(y=False)
-        t, f, Sxx = spectrogram(self.data, self.fs, self.delta_f_input.value()/10)
-        img = pg.ImageItem(np.log(Sxx.T + 0.0000001))
-
-        # Apply custom colormap
-        cmap = cm.get_cmap('jet')  # you can try 'plasma', 'inferno', etc.
-        lut = (cmap(np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
-        img.setLookupTable(lut)
-        # fix range for values
-        img.setLevels([np.log(1/self.vmin_input.value()), np.log(self.vmax_input.value())])
-
-        img.setRect(pg.QtCore.QRectF(t[0], f[0], t[-1] - t[0], f[-1] - f[0]))
-        self.plots[1].addItem(img)
-        self.plots[1].setTitle("Spectrogram")
+        self.spectro_img = pg.ImageItem()
+        self.spectro_img.setLookupTable(get_lut('jet'))  # you can try 'plasma', 'inferno', etc.
         self.plots[1].setLabel('left', 'Freq (Hz)')
         self.plots[1].setLabel('bottom', 'Time (s)')
-        self.plots[1].setYRange(f[0], f[-1])
+        self.update_spectrogram()
+        return [self.spectro_img], "Spectrogram", False, 'spectro_f_range'
+
+    def update_spectrogram(self):
+        if self.spectro_img is None:
+            return
+        # recompute the spectrogram only when the frequency resolution changed
+        delta_f = self.delta_f_input.value()/10
+        if self.derived.get('spectro_delta_f') != delta_f:
+            t, f, Sxx = spectrogram(self.data, self.fs, delta_f)
+            self.spectro_img.setImage(np.log(Sxx.T + 0.0000001), autoLevels=False)
+            self.spectro_img.setRect(pg.QtCore.QRectF(t[0], f[0], t[-1] - t[0], f[-1] - f[0]))
+            self.derived['spectro_delta_f'] = delta_f
+            self.derived['spectro_f_range'] = (f[0], f[-1])
+        # fix range for values
+        self.spectro_img.setLevels([np.log(1/self.vmin_input.value()), np.log(self.vmax_input.value())])
+        if self.plot_id == 'spectro' and 'spectro' in self.view_items:
+            self.plots[1].setYRange(*self.derived['spectro_f_range'])
 
     def display_state(self):
-        self.plots[2].clear()
-        self.plots[2].plot(self.C.t_list, self.C.state, pen='r', symbol='o')
-        self.plots[2].setTitle("State")
-        self.plots[2].setYRange(-0.5, 21.5)
+        curve = pg.PlotDataItem(self.C.t_list, self.C.state, pen='r', symbol='o')
+        return [curve], "State", False, (-0.5, 21.5)
 
     def display_editable_state(self):
         self.plots[3].clear()
@@ -285,7 +350,14 @@ class EEGViewer(QMainWindow):
         if self.D_save == None:
             self.state_y_edit = self.C.state.copy()
         else:
-            self.state_y_edit = self.D_save['state_updated']
+            self.state_y_edit = np.array(self.D_save['state_updated'], dtype=float)
+
+        #--- replay the edits not saved in the state file and journal the next ones
+        if self.journal is not None:
+            self.journal.close()
+        os.makedirs(self.journal_folder, exist_ok=True)
+        self.journal = EditJournal(self.journal_folder + self.name[:-4] + '.journal', len(self.state_y_edit))
+        self.journal.open(self.state_y_edit)
 
         # Plot 4: Editable
         self.state_curve = self.plots[3].plot(self.C.t_list, self.state_y_edit, pen='g', symbol=None)
@@ -297,54 +369,49 @@ class EEGViewer(QMainWindow):
                 y=self.state_y_edit[i],
                 index=i,
                 update_callback=self.update_point,
-                selection_callback=self.group_update_points
+                selection_callback=self.group_update_points,
+                press_callback=self.begin_drag,
+                release_callback=self.end_drag
             )
             self.plots[3].addItem(point)
             self.state_points.append(point)
 
     def display_power(self):
-        self.plots[0].clear()
-        self.plots[0].setLogMode(y=True)
-        self.plots[0].addLegend()
-        for i in range(self.N_labels):
-            self.plots[0].plot(self.C.t_list, savgol_filter(self.C.P_signals[i, :], 3, 1), pen=pg.mkPen(self.colors[i], width=2), name = self.labels_power[i])
-        self.plots[0].setTitle("Power of the different waves")
-        self.plots[1].setYRange(-3, 3)
+        curves = [pg.PlotDataItem(self.C.t_list, self.smoothed('P_signals', i), pen=pg.mkPen(self.colors[i], width=2), name = self.labels_power[i]) for i in range(self.N_labels)]
+        return curves, "Power of the different waves", True, None
 
     def display_power_proportions(self):
-        self.plots[1].clear()
-        self.plots[1].setLogMode(y=True)
-        self.plots[1].addLegend()
-        for i in range(self.N_labels):
-            self.plots[1].plot(self.C.t_list, savgol_filter(self.C.prop_P_signals[i, :],3,1), pen=pg.mkPen(self.colors[i], width=2), name = self.labels_power_proportion[i])
-        self.plots[1].setTitle("Power proportion of the different waves")
-        self.plots[1].setYRange(-5, 0.1)
+        curves = [pg.PlotDataItem(self.C.t_list, self.smoothed('prop_P_signals', i), pen=pg.mkPen(self.colors[i], width=2), name = self.labels_power_proportion[i]) for i in range(self.N_labels)]
+        return curves, "Power proportion of the different waves", True, (-5, 0.1)
 
     def display_supp(self):
-        self.plots[2].clear()
-        self.plots[2].plot(self.C.t_list, self.C.supp, pen=pg.mkPen(width=2))
-        self.plots[2].setTitle("Suppression ratio")
-        self.plots[2].setYRange(-0.1, 2.1)
+        curve = pg.PlotDataItem(self.C.t_list, self.C.supp, pen=pg.mkPen(width=2))
+        return [curve], "Suppression ratio", False, (-0.1, 2.1)
 
     def display_be_entropy(self):
-        self.plots[0].clear()
-        self.plots[0].addLegend()
-        self.plots[0].plot(self.C.t_list, savgol_filter(self.C.be,3,1), pen=pg.mkPen(width=2), name = 'Block Entropy (k = 2)')
-        self.plots[0].plot(self.C.t_list, savgol_filter(self.C.entropy,3,1), pen=pg.mkPen(width=2), name = 'Entropy')
-        self.plots[0].setTitle("Entropy and block entropy of signal")
-        self.plots[0].setYRange(0, 10)
+        curves = [pg.PlotDataItem(self.C.t_list, self.smoothed('be'), pen=pg.mkPen(width=2), name = 'Block Entropy (k = 2)'),
+                  pg.PlotDataItem(self.C.t_list, self.smoothed('entropy'), pen=pg.mkPen(width=2), name = 'Entropy')]
+        return curves, "Entropy and block entropy of signal", False, (0, 10)
 
     def display_line_length(self):
-        self.plots[1].clear()
-        self.plots[1].plot(self.C.t_line_length, savgol_filter(self.C.line_length,3,1), pen=pg.mkPen(width=2))
-        self.plots[1].setTitle("Line length of signal")
+        curve = pg.PlotDataItem(self.C.t_line_length, self.smoothed('line_length'), pen=pg.mkPen(width=2))
+        return [curve], "Line length of signal", False, None
 
     def display_freqs_quantiles(self):
-        self.plots[2].clear()
-        for i in range(np.shape(self.C.freqs_quantiles)[0]):
-            self.plots[2].plot(self.C.t_list, savgol_filter(self.C.freqs_quantiles[i, :],3,1), pen=pg.mkPen(self.colors[i], width=2))
-        self.plots[2].setTitle("Frequencies associated to quantiles")
-        self.plots[2].setYRange(0, 30)
+        curves = [pg.PlotDataItem(self.C.t_list, self.smoothed('freqs_quantiles', i), pen=pg.mkPen(self.colors[i], width=2)) for i in range(np.shape(self.C.freqs_quantiles)[0])]
+        return curves, "Frequencies associated to quantiles", False, (0, 30)
+
+    def smoothed(self, name, row=None):
+        '''
+        savgol smoothed feature of the Compute object, computed once per recording
+        '''
+        key = (name, row)
+        if key not in self.derived:
+            values = getattr(self.C, name)
+            if row is not None:
+                values = values[row, :]
+            self.derived[key] = sc.signal.savgol_filter(values, 3, 1)
+        return self.derived[key]
 
     #-----------------------------------------------------------#
     #---- methods to update the point(s) of the state chart ----#
@@ -354,7 +421,7 @@ class EEGViewer(QMainWindow):
         self.state_curve.setData(self.C.t_list, self.state_y_edit)
 
     def group_update_points(self, new_y):
-        if self._updating_group:
+        if self._updating_group or self._applying_edits:
             return  # prevent recursive call
 
         self._updating_group = True
@@ -367,6 +434,56 @@ class EEGViewer(QMainWindow):
         finally:
             self._updating_group = False
 
+    def begin_drag(self):
+        self._drag_start = self.state_y_edit.copy()
+
+    def end_drag(self, index):
+        '''
+        records the drag of a point (or of the selected points) as one edit: values at the press --> final value
+        '''
+        if self._drag_start is None or self.journal is None:
+            return
+        changed = np.flatnonzero(self.state_y_edit != self._drag_start)
+        self.journal.record(changed, self._drag_start[changed], self.state_y_edit[index])
+        self._drag_start = None
+
+    #-----------------------------------------------------------#
+    #------------ undo / redo and autosave of edits ------------#
+    #-----------------------------------------------------------#
+    def undo_edit(self):
+        if self.journal is not None:
+            self.move_points(self.journal.undo(self.state_y_edit))
+
+    def redo_edit(self):
+        if self.journal is not None:
+            self.move_points(self.journal.redo(self.state_y_edit))
+
+    def move_points(self, runs):
+        if not runs:
+            return
+        self._applying_edits = True
+        try:
+            for start, stop, _, _ in runs:
+                for i in range(start, stop):
+                    p = self.state_points[i]
+                    p.setPos(QPointF(p.fixed_x, self.state_y_edit[i]))
+            self.state_curve.setData(self.C.t_list, self.state_y_edit)
+        finally:
+            self._applying_edits = False
+
+    def sync_journal(self):
+        if self.journal is None:
+            return
+        self.journal.sync()
+        # periodic compaction of the journal into the state file
+        if self.journal.n_edits >= 500:
+            self.journal.compact(self.write_state_file)
+
+    def closeEvent(self, event):
+        if self.journal is not None:
+            self.journal.close()
+        super().closeEvent(event)
+
     #-------------------------------------------------------#
     #------ method to visualise current cursor value -------#
     #-------------------------------------------------------#
@@ -397,34 +514,62 @@ class EEGViewer(QMainWindow):
         # Step 1: Save current x-axis range from the first plot (which is the master for X linking)
         current_x_range = self.plots[0].getViewBox().viewRange()[0]  # [xmin, xmax]
 
-        # Step 2: Update the plots
-        if self.plot_id == 'spectro':
-            self.display_signal()
-            self.display_spectrogram()
-            self.display_state()
-        elif self.plot_id == 'prop':
-            self.display_power()
-            self.display_power_proportions()
-            self.display_supp()
-        elif self.plot_id == 'freq':
-            self.display_be_entropy()
-            self.display_line_length()
-            self.display_freqs_quantiles()
-
-        # Step 3: Restore x-axis range
+        # Step 2: Create the items of the view the first time it is displayed
+        if self.plot_id not in self.view_items:
+            if self.plot_id == 'spectro':
+                displays = [self.display_signal, self.display_spectrogram, self.display_state]
+            elif self.plot_id == 'prop':
+                displays = [self.display_power, self.display_power_proportions, self.display_supp]
+            elif self.plot_id == 'freq':
+                displays = [self.display_be_entropy, self.display_line_length, self.display_freqs_quantiles]
+            else:
+                return
+            self.view_items[self.plot_id] = [display() for display in displays]
+
+        # Step 3: Swap the items of the plots (no data is recomputed)
+        for i, (items, title, log_y, y_range) in enumerate(self.view_items[self.plot_id]):
+            plot = self.plots[i]
+            for item in self.attached_items[i]:
+                plot.removeItem(item)
+            plot.setLogMode(y=log_y)
+            for item in items:
+                plot.addItem(item)
+            self.attached_items[i] = items
+            plot.setTitle(title)
+            if y_range is None:
+                plot.enableAutoRange(axis='y')
+            elif isinstance(y_range, str):  # range stored with the derived data
+                plot.setYRange(*self.derived[y_range])
+            else:
+                plot.setYRange(*y_range)
+
+        # Step 4: Restore x-axis range
         for p in self.plots:
             p.setXRange(*current_x_range, padding=0)
+
+    def reset_views(self):
+        '''
+        remove the items of the previous recording and clear the cached derived data
+        '''
+        for i in range(3):
+            for item in self.attached_items[i]:
+                self.plots[i].removeItem(item)
+        self.attached_items = [[] for _ in range(3)]
+        self.view_items = {}
+        self.derived = {}
+        self.spectro_img = None
     
     #-------------------------------------------------------#
-    #------- save to .npy Dict the edited state list -------#
+    #-------- save to .npz the edited state list -----------#
     #-------------------------------------------------------#
     def save_updated_state_list(self):
+        if self.journal is not None:
+            self.journal.compact(self.write_state_file)
+
+    def write_state_file(self):
 
-        D = {}
-        D['t_list'] = self.C.t_list
-        D['state'] = self.C.state
-        D['state_updated'] = self.state_y_edit
-        np.save(self.save_folder + 'D_' + self.name, D)
+        save_annotation(annotation_path(self.save_folder, self.name), self.C.t_list, self.C.state, self.state_y_edit,
+                        fs=self.fs, Ws=self.C.Ws, step=self.C.step)
 
 
 if __name__ == "__main__":